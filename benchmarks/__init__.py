@@ -0,0 +1,9 @@
+"""
+Benchmarks for oodocx, run from the repository root with:
+
+    python -m benchmarks -o results.json
+    python -m benchmarks --baseline results.json --paragraphs 20000
+
+generate builds deterministic synthetic documents, and runner times
+scenarios on them and measures their peak memory.
+"""
@@ -0,0 +1,55 @@
+import argparse
+import json
+import sys
+from benchmarks import runner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+    description='Time oodocx operations on generated documents.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+    help='scenarios to run (default: all): ' + ', '.join(runner.SCENARIOS))
+    parser.add_argument('-o', '--output', help='write results as JSON here')
+    parser.add_argument('--baseline',
+    help='JSON results of an earlier run to compare against')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+    help='skip the peak memory measurements')
+    parser.add_argument('--paragraphs', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=3,
+    help='runs per paragraph')
+    parser.add_argument('--tables', type=int, default=5)
+    parser.add_argument('--table-rows', type=int, default=10)
+    parser.add_argument('--table-columns', type=int, default=4)
+    parser.add_argument('--images', type=int, default=2)
+    parser.add_argument('--comments', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in runner.SCENARIOS]
+    if unknown:
+        parser.error('unknown scenario: ' + ', '.join(unknown))
+    results = runner.run(args.scenarios, args.repeat, args.memory,
+                         paragraphs=args.paragraphs, runs=args.runs,
+                         tables=args.tables, table_rows=args.table_rows,
+                         table_columns=args.table_columns, images=args.images,
+                         comments=args.comments, seed=args.seed)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    for name, result in results['results'].items():
+        line = '{0:<14} median {1:9.4f}s  min {2:9.4f}s'.format(
+               name, result['median'], result['min'])
+        if result.get('rss_growth_bytes') is not None:
+            line += '  rss +{0:.1f} MB'.format(result['rss_growth_bytes'] / 1e6)
+        print(line)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            comparison = runner.compare(results, json.load(baseline))
+        print()
+        for name, old, new, ratio in comparison:
+            print('{0:<14} {1:9.4f}s -> {2:9.4f}s  x{3:.2f}'.format(
+                  name, old, new, ratio if ratio is not None else 0))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
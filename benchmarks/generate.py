@@ -0,0 +1,80 @@
+"""
+Deterministic generator of synthetic docx files for benchmarking.
+
+The same arguments and seed always produce the same document content, so
+timings taken on different revisions of oodocx measure the same work.
+"""
+
+import os
+import random
+import struct
+import tempfile
+import zlib
+from oodocx import oodocx
+
+WORDS = ('the', 'contract', 'party', 'shall', 'within', 'days', 'of',
+         'notice', 'apple', 'banana', 'agreement', 'payment', 'term', 'and',
+         'to', 'any', 'this', 'section', 'provided', 'that', 'each', 'other',
+         'in', 'writing', 'supplier', 'customer', 'goods', 'services')
+# Formatting codes understood by oodocx.paragraph
+RUN_FORMATS = ('', '', '', 'b', 'i', 'u', 'bi')
+
+
+def png(width, height, color):
+    '''Returns the bytes of a solid colour RGB PNG image'''
+    row = b'\x00' + bytes(color) * width
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0,
+                                       0, 0)) +
+            chunk(b'IDAT', zlib.compress(row * height)) + chunk(b'IEND', b''))
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for i in range(words))
+
+def generate(output, paragraphs=1000, runs=3, tables=5, table_rows=10,
+             table_columns=4, images=2, comments=10, seed=0):
+    '''Writes a synthetic docx file to output with the given numbers of
+    paragraphs, runs per paragraph, tables of table_rows by table_columns
+    cells, images and comments, spread evenly through the body. Returns
+    output.'''
+    rng = random.Random(seed)
+    document = oodocx.Docx()
+    sectpr = document.body[-1]
+    blocks = [paragraph(rng, runs) for i in range(paragraphs)]
+    for number in range(tables):
+        contents = [['Heading {0}'.format(column)
+                     for column in range(table_columns)]]
+        contents.extend([sentence(rng, 3) for column in range(table_columns)]
+                        for row in range(table_rows - 1))
+        blocks.insert(rng.randint(0, len(blocks)), oodocx.table(contents))
+    image_dir = tempfile.mkdtemp()
+    try:
+        for number in range(images):
+            path = os.path.join(image_dir, 'image{0}.png'.format(number))
+            with open(path, 'wb') as image:
+                image.write(png(64 + number, 48, (rng.randrange(256),
+                                rng.randrange(256), rng.randrange(256))))
+            blocks.insert(rng.randint(0, len(blocks)),
+                          oodocx.picture(document, path))
+    finally:
+        for filename in os.listdir(image_dir):
+            os.remove(os.path.join(image_dir, filename))
+        os.rmdir(image_dir)
+    for block in blocks:
+        sectpr.addprevious(block)
+    anchors = [block for block in blocks if block.tag ==
+               '{' + oodocx.NSPREFIXES['w'] + '}p']
+    if comments and anchors:
+        document.add_comments([(anchors[index * len(anchors) // comments],
+                                sentence(rng, 8), 'Benchmark')
+                               for index in range(comments)])
+    document.save(output)
+    return output
+
+def paragraph(rng, runs):
+    return oodocx.paragraph([(sentence(rng, rng.randint(3, 12)) + ' ',
+                              rng.choice(RUN_FORMATS))
+                             for run in range(runs)])
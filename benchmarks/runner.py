@@ -0,0 +1,219 @@
+"""
+Benchmark scenarios and the code that times them.
+
+Each scenario has a setup function, which is not timed and runs before every
+repetition, and a run function, which is timed. Peak memory is measured in
+a separate repetition with tracemalloc, which sees Python allocations, and
+in a fresh process, whose growth in maximum resident set size also counts
+the memory lxml allocates in C.
+"""
+
+import io
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from queue import Empty
+from lxml import etree
+from oodocx import oodocx
+from benchmarks import generate
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class Fixtures():
+    '''Generates the input files the scenarios share into a temporary
+    directory'''
+    def __init__(self, directory, **sizes):
+        self.directory = directory
+        self.sizes = sizes
+        self.document = generate.generate(os.path.join(directory,
+                                          'document.docx'), **sizes)
+        small = dict(sizes, paragraphs=max(sizes.get('paragraphs', 1000) //
+                                           10, 1))
+        self.other = generate.generate(os.path.join(directory, 'other.docx'),
+                                       **small)
+        self.image = os.path.join(directory, 'image.png')
+        with open(self.image, 'wb') as image:
+            image.write(generate.png(640, 480, (200, 30, 30)))
+
+
+def open_document(fixtures):
+    return oodocx.Docx(fixtures.document)
+
+def scenario_open(fixtures):
+    return None, lambda state: oodocx.Docx(fixtures.document)
+
+def scenario_open_readonly(fixtures):
+    return None, lambda state: oodocx.Docx.open_readonly(fixtures.document)
+
+def scenario_search(fixtures):
+    # A pattern that never matches makes search visit every paragraph
+    return (open_document(fixtures),
+            lambda document: document.search('zebra crossing'))
+
+def scenario_replace(fixtures):
+    return (open_document(fixtures),
+            lambda document: document.replace('apple', 'pear'))
+
+def scenario_modify_font(fixtures):
+    document = open_document(fixtures)
+    paragraphs = list(document.body.iter('{' + oodocx.NSPREFIXES['w'] +
+                                         '}p'))
+    return paragraphs, lambda paragraphs: oodocx.modify_font(
+    paragraphs, name='Arial', size=11, bold=True, color='red')
+
+def scenario_table(fixtures):
+    contents = [['Cell {0} {1}'.format(row, column) for column in range(10)]
+                for row in range(100)]
+    return contents, oodocx.table
+
+def scenario_picture(fixtures):
+    return (oodocx.Docx(), lambda document: oodocx.picture(document,
+                                                           fixtures.image))
+
+def scenario_merge(fixtures):
+    return ((open_document(fixtures), oodocx.Docx(fixtures.other)),
+            lambda documents: documents[0].merge(documents[1]))
+
+def scenario_save(fixtures):
+    return (open_document(fixtures),
+            lambda document: document.save(io.BytesIO()))
+
+
+SCENARIOS = {'open': scenario_open, 'open_readonly': scenario_open_readonly,
+             'search': scenario_search, 'replace': scenario_replace,
+             'modify_font': scenario_modify_font, 'table': scenario_table,
+             'picture': scenario_picture, 'merge': scenario_merge,
+             'save': scenario_save}
+
+
+def time_scenario(scenario, fixtures, repeat):
+    '''Returns the wall time of each of repeat runs of a scenario'''
+    times = []
+    for repetition in range(repeat):
+        state, run = scenario(fixtures)
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+    return times
+
+def python_peak(scenario, fixtures):
+    '''Returns the peak bytes allocated by Python code during one run'''
+    state, run = scenario(fixtures)
+    tracemalloc.start()
+    try:
+        run(state)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def peak_rss():
+    '''Returns the peak resident set size of this process in bytes, or
+    None where it can't be read'''
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss *
+            (1 if platform.system() == 'Darwin' else 1024))
+
+def rss_growth(name, directory, sizes, queue):
+    '''Runs a scenario in this process, which should be a fresh one, and
+    puts the growth of its peak resident set size in bytes on queue'''
+    fixtures = Fixtures.__new__(Fixtures)
+    fixtures.directory = directory
+    fixtures.sizes = sizes
+    fixtures.document = os.path.join(directory, 'document.docx')
+    fixtures.other = os.path.join(directory, 'other.docx')
+    fixtures.image = os.path.join(directory, 'image.png')
+    state, run = SCENARIOS[name](fixtures)
+    try:
+        # Resets the peak to the current size on Linux, so that only
+        # memory used by the run counts
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+    before = peak_rss()
+    run(state)
+    after = peak_rss()
+    queue.put(after - before if before is not None else None)
+
+def process_peak(name, fixtures):
+    '''Returns the growth in peak resident set size of one run of the
+    named scenario in a new process. Raises RuntimeError if the process
+    exits without a result, for instance when it is killed for running
+    out of memory.'''
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=rss_growth, args=(name,
+                              fixtures.directory, fixtures.sizes, queue))
+    process.start()
+    while True:
+        # Checked before waiting, so that a result put just before the
+        # process exited is still picked up
+        exited = process.exitcode is not None
+        try:
+            growth = queue.get(timeout=1)
+            break
+        except Empty:
+            if exited:
+                raise RuntimeError('measuring {0} failed: the process '
+                                   'exited with code {1}'.format(
+                                   name, process.exitcode))
+    process.join()
+    return growth
+
+def run(names=None, repeat=5, memory=True, **sizes):
+    '''Runs the named scenarios, all of them by default, on generated
+    documents of the given sizes (see generate.generate) and returns the
+    results as a dictionary ready to be written as JSON'''
+    names = names or list(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            raise ValueError('unknown scenario: ' + name)
+    directory = tempfile.mkdtemp()
+    try:
+        fixtures = Fixtures(directory, **sizes)
+        results = {}
+        for name in names:
+            times = time_scenario(SCENARIOS[name], fixtures, repeat)
+            result = {'times': times, 'min': min(times),
+                      'median': statistics.median(times)}
+            if memory:
+                result['python_peak_bytes'] = python_peak(SCENARIOS[name],
+                                                          fixtures)
+                result['rss_growth_bytes'] = process_peak(name, fixtures)
+            results[name] = result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {'environment': {'python': platform.python_version(),
+                            'lxml': '.'.join(map(str, etree.LXML_VERSION)),
+                            'platform': platform.platform()},
+            'sizes': sizes, 'repeat': repeat, 'results': results}
+
+def compare(results, baseline):
+    '''Returns a list of (scenario, baseline median, median, ratio) tuples
+    for the scenarios in both result dictionaries; a ratio above 1 means
+    the scenario got slower'''
+    comparison = []
+    for name, result in results['results'].items():
+        if name in baseline['results']:
+            old = baseline['results'][name]['median']
+            comparison.append((name, old, result['median'],
+                               result['median'] / old if old else None))
+    return comparison
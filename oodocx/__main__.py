@@ -0,0 +1,91 @@
+"""
+Command line interface for running Docx operations over many documents:
+
+    python -m oodocx text reports/ -o text.jsonl
+    python -m oodocx stats a.docx b.docx --workers 4
+    python -m oodocx replace 'ACME' 'Acme Ltd' contracts/ --output-dir out/
+    python -m oodocx clean contracts/ --output-dir out/
+
+One JSON record is written per file, with its path, timing and either the
+result or the error. The exit status is 1 if any file failed.
+"""
+
+import argparse
+import json
+import sys
+from oodocx import corpus
+
+
+def common_arguments(argument_default=None):
+    '''Returns a parent parser with the options shared by all commands'''
+    common = argparse.ArgumentParser(add_help=False,
+                                     argument_default=argument_default)
+    common.add_argument('--workers', type=int,
+    help='number of worker processes, 1 to run in this process '
+    '(default: one per CPU)')
+    common.add_argument('--chunksize', type=int,
+    help='files sent to a worker at a time (default: 1)')
+    common.add_argument('-o', '--output',
+    help='file to write JSON lines records to (default: stdout)')
+    return common
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m oodocx',
+    description='Run oodocx operations over docx files and directories.',
+    parents=[common_arguments()])
+    parser.set_defaults(chunksize=1, output='-')
+    # The common options are also accepted after the command. There they
+    # have no defaults, so they don't overwrite values given before it.
+    common = common_arguments(argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+    command = commands.add_parser('text', parents=[common],
+    help='paragraph text of each file')
+    command.add_argument('paths', nargs='+')
+    command = commands.add_parser('stats', parents=[common],
+    help='paragraph, word and character counts of each file')
+    command.add_argument('paths', nargs='+')
+    command = commands.add_parser('replace', parents=[common],
+    help='replace a regular expression, saving copies to --output-dir')
+    command.add_argument('search')
+    command.add_argument('replace')
+    command.add_argument('paths', nargs='+')
+    command.add_argument('--output-dir', required=True)
+    command.add_argument('--keep-runs', dest='ignore_runs',
+    action='store_false', help='match within single text elements only')
+    command = commands.add_parser('clean', parents=[common],
+    help='remove empty text elements, saving copies to --output-dir')
+    command.add_argument('paths', nargs='+')
+    command.add_argument('--output-dir', required=True)
+    args = parser.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.chunksize < 1:
+        parser.error('--chunksize must be at least 1')
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {}
+    if args.command == 'replace':
+        options = {'search': args.search, 'replace': args.replace,
+                   'ignore_runs': args.ignore_runs}
+    output = (sys.stdout if args.output == '-' else
+              open(args.output, 'w', encoding='utf-8'))
+    failures = 0
+    try:
+        for record in corpus.run(args.command, args.paths,
+        getattr(args, 'output_dir', None), args.workers, args.chunksize,
+        **options):
+            if not record['ok']:
+                failures += 1
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
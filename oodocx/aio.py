@@ -0,0 +1,65 @@
+"""
+Open and save documents from asyncio code without blocking the event loop.
+
+    from oodocx import aio
+
+    document = await aio.open(await request.read())
+    document.replace('apple', 'banana')
+    return web.Response(body=await document.save_async())
+
+Extracting, parsing, serializing and compressing run on an executor, the
+event loop's default thread pool unless one is configured. Docx objects
+hold lxml trees, which can't be sent to other processes, so the executor
+should be a thread pool. configure() can also cap how many of these jobs
+run at once, so a burst of requests waits its turn instead of
+overcommitting the CPU.
+"""
+
+import asyncio
+import functools
+import io
+from oodocx import oodocx
+
+_executor = None
+_semaphore = None
+
+
+def configure(executor=None, max_concurrency=None):
+    '''Sets the executor that open and save run on, None for the event
+    loop's default, and the maximum number of documents opened or saved
+    at the same time, None for no limit'''
+    global _executor, _semaphore
+    if max_concurrency is not None and max_concurrency < 1:
+        raise ValueError('max_concurrency must be at least 1')
+    _executor = executor
+    _semaphore = (asyncio.Semaphore(max_concurrency) if max_concurrency
+                  else None)
+
+async def run(function, *args, executor=None, **kwargs):
+    '''Runs function on the executor once the concurrency limit allows,
+    and returns its result'''
+    loop = asyncio.get_running_loop()
+    call = functools.partial(function, *args, **kwargs)
+    executor = executor or _executor
+    if _semaphore is None:
+        return await loop.run_in_executor(executor, call)
+    async with _semaphore:
+        return await loop.run_in_executor(executor, call)
+
+async def open(file='', executor=None):
+    '''Returns a Docx opened from a path, a file-like object or the bytes
+    of a docx file. With no file a new document is created.'''
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        file = io.BytesIO(file)
+    return await run(oodocx.Docx, file, executor=executor)
+
+async def save(document, output=None, executor=None, **options):
+    '''Saves a Docx to a path or writable file-like object. With no output
+    the docx file is returned as bytes. options, such as compresslevel,
+    are passed on to Docx.save.'''
+    if output is not None:
+        await run(document.save, output, executor=executor, **options)
+        return
+    buffer = io.BytesIO()
+    await run(document.save, buffer, executor=executor, **options)
+    return buffer.getvalue()
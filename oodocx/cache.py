@@ -0,0 +1,263 @@
+"""
+A cache of parsed documents, for jobs that open the same source files again
+and again.
+
+    cache = DocumentCache(maxsize=16, directory='docx-cache')
+    document = cache.open('template.docx')
+
+The first open of a file extracts and parses it as usual and keeps a
+snapshot of the parsed parts. Later opens of a file with the same content
+copy the snapshot's trees, which is much quicker than extracting and
+parsing the file again, and each copy can be changed without affecting the
+cache or other copies. Snapshots are kept in memory with least recently
+used eviction and, if a directory is given, on disk keyed by the SHA-1 of
+the file's content, so they survive between processes.
+"""
+
+import collections
+import copy
+import hashlib
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from lxml import etree
+from oodocx import oodocx
+
+# Attributes rebuilt for each restored Docx rather than copied
+LOCAL_ATTRIBUTES = ('write_dir', 'media_dir', 'xmlfiles', 'body', 'stats')
+
+
+class Snapshot():
+    '''The parsed state of a Docx: a tree for each XML part, the Docx
+    attributes that refer to those parts or hold other values, and a
+    directory holding the document's other files, such as media'''
+    def __init__(self, parts, part_attributes, attributes, files_dir):
+        self.parts = parts
+        self.part_attributes = part_attributes
+        self.attributes = attributes
+        self.files_dir = files_dir
+        # The number of restores in progress and whether the snapshot has
+        # left its cache, kept by DocumentCache under its lock
+        self.users = 0
+        self.retired = False
+
+    @classmethod
+    def capture(cls, document, files_dir):
+        '''Takes a snapshot of a Docx, copying its non-XML files to
+        files_dir. The document should not have been changed since it was
+        opened, as the snapshot stands for its source file.'''
+        parts = {}
+        part_paths = {}
+        for element, relpath in document.xmlfiles.items():
+            relpath = relpath.replace(os.sep, '/')
+            parts[relpath] = copy.deepcopy(element)
+            part_paths[id(element)] = relpath
+        part_attributes = {}
+        attributes = {}
+        for name, value in vars(document).items():
+            if name in LOCAL_ATTRIBUTES:
+                continue
+            if id(value) in part_paths:
+                part_attributes[name] = part_paths[id(value)]
+            elif name.endswith('_registry'):
+                # Registries index parts and are rebuilt when first needed
+                attributes[name] = None
+            else:
+                attributes[name] = copy.deepcopy(value)
+        for dirpath, dirnames, filenames in os.walk(document.write_dir):
+            reldir = os.path.relpath(dirpath, document.write_dir)
+            os.makedirs(os.path.join(files_dir, reldir), exist_ok=True)
+            for filename in filenames:
+                relpath = os.path.normpath(os.path.join(reldir, filename))
+                if relpath.replace(os.sep, '/') not in parts:
+                    shutil.copyfile(os.path.join(dirpath, filename),
+                                    os.path.join(files_dir, relpath))
+        return cls(parts, part_attributes, attributes, files_dir)
+
+    def restore(self):
+        '''Returns a new Docx with its own copy of the snapshot's parts
+        and files'''
+        document = oodocx.Docx.__new__(oodocx.Docx)
+        document.__dict__.update(copy.deepcopy(self.attributes))
+        document.stats = oodocx.Stats()
+        document.write_dir = tempfile.mkdtemp(dir=oodocx.BASE_DIR)
+        document.media_dir = os.path.join(document.write_dir, 'word', 'media')
+        shutil.copytree(self.files_dir, document.write_dir, dirs_exist_ok=True)
+        document.xmlfiles = {}
+        parts = {}
+        for relpath, element in self.parts.items():
+            # Copying a tree is a single C call, far cheaper than parsing
+            element = copy.deepcopy(element)
+            parts[relpath] = element
+            document.xmlfiles[element] = relpath.replace('/', os.sep)
+        for name, relpath in self.part_attributes.items():
+            setattr(document, name, parts[relpath])
+        document.body = document.document.xpath('/w:document/w:body',
+                                                namespaces=oodocx.NSPREFIXES)[0]
+        return document
+
+    def dump(self, path):
+        '''Writes the snapshot's parts and attributes to a file; the files
+        directory is stored separately'''
+        with open(path, 'wb') as output:
+            pickle.dump({'parts': dict((relpath, etree.tostring(element))
+                                       for relpath, element
+                                       in self.parts.items()),
+                         'part_attributes': self.part_attributes,
+                         'attributes': self.attributes}, output,
+                        pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, files_dir):
+        '''Reads a snapshot written by dump'''
+        with open(path, 'rb') as source:
+            state = pickle.load(source)
+        parser = oodocx.get_parser()
+        parts = dict((relpath, etree.fromstring(xml, parser)) for relpath, xml
+                     in state['parts'].items())
+        return cls(parts, state['part_attributes'], state['attributes'],
+                   files_dir)
+
+
+class DocumentCache():
+    '''Opens documents from snapshots of their parsed state, keyed by the
+    SHA-1 of the file's content. Up to maxsize snapshots are kept in
+    memory; if directory is given, snapshots are also stored there.'''
+    def __init__(self, maxsize=32, directory=None):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.snapshots = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        '''Returns a dictionary of the cache's hit and miss counts'''
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self.snapshots),
+                    'hit_rate': ((self.hits + self.disk_hits) / lookups
+                                 if lookups else 0.0)}
+
+    def open(self, file):
+        '''Returns a Docx for a path or the bytes of a docx file, restored
+        from a snapshot if the same content has been opened before'''
+        if isinstance(file, (bytes, bytearray)):
+            data = bytes(file)
+        else:
+            with open(file, 'rb') as source:
+                data = source.read()
+        key = hashlib.sha1(data).hexdigest()
+        with self.lock:
+            snapshot = self.snapshots.get(key)
+            if snapshot is not None:
+                self.snapshots.move_to_end(key)
+                self.hits += 1
+                # Pinned so that an eviction meanwhile doesn't delete the
+                # files it is being restored from
+                snapshot.users += 1
+        if snapshot is not None:
+            try:
+                return snapshot.restore()
+            finally:
+                self.release(snapshot)
+        snapshot = self.load(key)
+        if snapshot is not None:
+            with self.lock:
+                self.disk_hits += 1
+            self.add(key, snapshot)
+            return snapshot.restore()
+        with self.lock:
+            self.misses += 1
+        document = oodocx.Docx(io.BytesIO(data))
+        snapshot = self.store(key, document)
+        self.add(key, snapshot)
+        return document
+
+    def add(self, key, snapshot):
+        with self.lock:
+            # Two threads that miss on the same content both add it
+            replaced = self.snapshots.get(key)
+            self.snapshots[key] = snapshot
+            self.snapshots.move_to_end(key)
+            evicted = ([replaced] if replaced is not None and
+                       replaced is not snapshot else [])
+            while len(self.snapshots) > self.maxsize:
+                evicted.append(self.snapshots.popitem(last=False)[1])
+                self.evictions += 1
+            unused = self.retire(evicted)
+        self.remove_files(unused)
+
+    def retire(self, snapshots):
+        '''Marks snapshots that have been taken out of the cache, returning
+        those that no restore is using. Called with the lock held.'''
+        unused = []
+        for snapshot in snapshots:
+            snapshot.retired = True
+            if not snapshot.users:
+                unused.append(snapshot)
+        return unused
+
+    def release(self, snapshot):
+        '''Unpins a snapshot after a restore, removing its files if it was
+        evicted in the meantime'''
+        with self.lock:
+            snapshot.users -= 1
+            unused = snapshot.retired and not snapshot.users
+        if unused:
+            self.remove_files([snapshot])
+
+    def remove_files(self, snapshots):
+        '''Deletes the files of snapshots that are no longer cached, unless
+        they are kept in the cache directory'''
+        if self.directory is None:
+            for snapshot in snapshots:
+                shutil.rmtree(snapshot.files_dir, ignore_errors=True)
+
+    def load(self, key):
+        '''Reads the snapshot for key from the cache directory, if any'''
+        if self.directory is None:
+            return None
+        entry = os.path.join(self.directory, key)
+        if not os.path.isfile(os.path.join(entry, 'snapshot.pickle')):
+            return None
+        return Snapshot.load(os.path.join(entry, 'snapshot.pickle'),
+                             os.path.join(entry, 'files'))
+
+    def store(self, key, document):
+        '''Takes a snapshot of a newly opened document, writing it to the
+        cache directory if there is one'''
+        if self.directory is None:
+            return Snapshot.capture(document,
+                                    tempfile.mkdtemp(dir=oodocx.BASE_DIR))
+        # Build the entry under a temporary name and rename it into place,
+        # so that other processes never see a partly written entry
+        staging = tempfile.mkdtemp(dir=self.directory)
+        snapshot = Snapshot.capture(document, os.path.join(staging, 'files'))
+        snapshot.dump(os.path.join(staging, 'snapshot.pickle'))
+        entry = os.path.join(self.directory, key)
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Another process stored the same content first
+            shutil.rmtree(staging, ignore_errors=True)
+        snapshot.files_dir = os.path.join(entry, 'files')
+        return snapshot
+
+    def clear(self):
+        '''Empties the in-memory cache; snapshots on disk are kept'''
+        with self.lock:
+            unused = self.retire(self.snapshots.values())
+            self.snapshots.clear()
+        self.remove_files(unused)
@@ -0,0 +1,119 @@
+"""
+Run Docx operations over many files at once in a pool of worker processes.
+
+Each file is handled independently: a failure is reported as a record for
+that file instead of stopping the run. Records are dictionaries, written by
+the command line interface (python -m oodocx) as one JSON object per line.
+"""
+
+import os
+import re
+import shutil
+import time
+import traceback
+import concurrent.futures
+from oodocx import oodocx
+
+COMMANDS = ('text', 'stats', 'replace', 'clean')
+# Commands that write a modified copy of each document
+WRITING_COMMANDS = ('replace', 'clean')
+
+
+def find_documents(paths):
+    '''Yields a (path, relative path) tuple for each docx file in paths,
+    which may name files or directories to walk. The relative path is
+    where the file sits below the directory it was found in.'''
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path, os.path.basename(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                # Word leaves ~$ lock files next to open documents
+                if (filename.lower().endswith('.docx') and
+                not filename.startswith('~$')):
+                    filepath = os.path.join(dirpath, filename)
+                    yield filepath, os.path.relpath(filepath, path)
+
+def run(command, paths, output_dir=None, workers=None, chunksize=1,
+        **options):
+    '''Runs command on every docx file found in paths and yields one record
+    per file, in the order the files were found. With workers=1 the files
+    are processed in this process; otherwise a ProcessPoolExecutor with
+    that many workers (by default one per CPU) is sent chunksize files at
+    a time. replace and clean need an output_dir, below which modified
+    copies are saved with the same relative paths; the sources are never
+    overwritten. options are passed to the command, for replace these are
+    search, replace and ignore_runs.'''
+    if command not in COMMANDS:
+        raise ValueError('command must be one of: ' + ', '.join(COMMANDS))
+    if command in WRITING_COMMANDS and not output_dir:
+        raise ValueError(command + ' needs an output directory')
+    if command == 'replace':
+        # Fail once here rather than once per file
+        re.compile(options['search'])
+    jobs = ((command, path, os.path.join(output_dir, relpath) if output_dir
+             else None, options) for path, relpath in find_documents(paths))
+    if workers == 1:
+        for job in jobs:
+            yield process(job)
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for record in executor.map(process, jobs, chunksize=chunksize):
+            yield record
+
+def process(job):
+    '''Runs one (command, path, output path, options) job and returns its
+    record, catching any error so that one bad file does not end the run'''
+    command, path, output, options = job
+    record = {'path': path, 'command': command}
+    start = time.perf_counter()
+    try:
+        record.update(OPERATIONS[command](path, output, **options))
+        record['ok'] = True
+    except Exception as error:
+        record['ok'] = False
+        record['error'] = '{0}: {1}'.format(type(error).__name__, error)
+        record['traceback'] = traceback.format_exc()
+    record['seconds'] = round(time.perf_counter() - start, 6)
+    return record
+
+def text(path, output):
+    return {'paragraphs': list(oodocx.iter_document_text(path))}
+
+def stats(path, output):
+    paragraphs = words = characters = 0
+    for paragraph in oodocx.iter_document_text(path):
+        if paragraph.strip():
+            paragraphs += 1
+            words += len(paragraph.split())
+            characters += len(paragraph)
+    return {'paragraphs': paragraphs, 'words': words,
+            'characters': characters}
+
+def replace(path, output, search, replace, ignore_runs=True):
+    return modify(path, output,
+                  lambda document: document.replace(search, replace,
+                                                    ignore_runs))
+
+def clean(path, output):
+    return modify(path, output, lambda document: document.clean())
+
+def modify(path, output, operation):
+    '''Opens path, applies operation to the Docx and saves the result to
+    output, removing the extracted files if anything fails'''
+    document = oodocx.Docx(path)
+    try:
+        operation(document)
+        directory = os.path.dirname(os.path.abspath(output))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        document.save(os.path.abspath(output))
+    finally:
+        shutil.rmtree(document.write_dir, ignore_errors=True)
+    return {'output': output}
+
+
+OPERATIONS = {'text': text, 'stats': stats, 'replace': replace,
+              'clean': clean}
@@ -0,0 +1,447 @@
+"""
+Compare two documents paragraph by paragraph, used by Docx.compare.
+
+    changes = diff.compare(oodocx.Docx('v1.docx'), oodocx.Docx('v2.docx'))
+
+Each paragraph of both bodies is reduced to a key of its paragraph
+properties and its text grouped by run formatting, ignoring revision ids,
+proofing marks, bookmarks and how the text happens to be split into runs.
+The two lists of keys are aligned with difflib after trimming their common
+start and end, and only paragraphs that differ are split into words and
+compared again, so the work grows with the size of the documents and the
+size of the changes rather than their product. difflib's SequenceMatcher
+is not Myers' linear-space diff, though: on a stretch that differs
+throughout, its time and memory can grow with the product of the two
+sides' lengths. Its autojunk heuristic is turned off, as it would treat
+words such as 'the' that fill over 1% of a long paragraph as unmatchable.
+
+redline() marks the changes up in the newer document as tracked changes.
+"""
+
+import collections
+import copy
+import datetime
+import difflib
+import itertools
+import re
+from lxml import etree
+from oodocx import oodocx
+
+W = '{' + oodocx.NSPREFIXES['w'] + '}'
+TEXT_TAGS = {W + 't': None, W + 'tab': '\t', W + 'br': '\n', W + 'cr': '\n'}
+# Children of a paragraph or run that redline can rebuild without losing
+# anything but noise
+SIMPLE_PARAGRAPH_TAGS = frozenset((W + 'pPr', W + 'r', W + 'proofErr'))
+SIMPLE_RUN_TAGS = frozenset((W + 'rPr', W + 'lastRenderedPageBreak') +
+                            tuple(TEXT_TAGS))
+TOKEN = re.compile(r'\w+|\s+|[^\w\s]')
+# Elements of a paragraph whose runs are marked as inserted along with the
+# runs directly in the paragraph
+RUN_CONTAINER_TAGS = frozenset(W + tag for tag in ('hyperlink', 'smartTag',
+                               'customXml', 'fldSimple', 'sdt', 'sdtContent'))
+
+# kind is 'insert', 'delete' or 'change'. old_index and new_index are the
+# positions of the paragraphs in document order; for an insertion
+# old_index is the old paragraph it comes before, and the other way
+# around for a deletion. edits lists the (operation, old text, new text)
+# word level differences of a changed paragraph, where operation is
+# 'replace', 'delete', 'insert' or 'format' for text whose formatting
+# changed; it is empty when only the paragraph's properties changed.
+Change = collections.namedtuple('Change',
+         'kind old_index new_index old_text new_text edits')
+
+
+def properties_key(element):
+    '''Returns a hashable key for a properties element such as rPr. This
+    is much quicker than serializing the element, whose string would also
+    carry every namespace declared by the document.'''
+    return tuple((child.tag, tuple(child.items()),
+                  properties_key(child) if len(child) else ())
+                 for child in element)
+
+
+class Paragraph():
+    '''A paragraph reduced to what compare looks at'''
+    __slots__ = ('element', 'ppr', 'segments', 'key', 'simple')
+
+    def __init__(self, element):
+        self.element = element
+        self.ppr = None
+        self.simple = True
+        segments = []
+        rpr = None
+        for child in element:
+            if child.tag == W + 'r':
+                runs = (child,)
+            elif child.tag == W + 'pPr':
+                self.ppr = child
+                continue
+            else:
+                if child.tag not in SIMPLE_PARAGRAPH_TAGS:
+                    self.simple = False
+                runs = child.iter(W + 'r')
+            for run in runs:
+                text = []
+                rpr = None
+                for part in run:
+                    tag = part.tag
+                    if tag in TEXT_TAGS:
+                        text.append(TEXT_TAGS[tag] or part.text or '')
+                    elif tag == W + 'rPr':
+                        rpr = part
+                    elif tag not in SIMPLE_RUN_TAGS:
+                        self.simple = False
+                if not text:
+                    continue
+                rkey = properties_key(rpr) if rpr is not None else ()
+                if segments and segments[-1][0] == rkey:
+                    segments[-1][1] += ''.join(text)
+                else:
+                    segments.append([rkey, ''.join(text), rpr])
+        self.segments = segments
+        self.key = ((properties_key(self.ppr) if self.ppr is not None
+                     else ()),) + tuple((segment[0], segment[1])
+                                         for segment in segments)
+
+    @property
+    def text(self):
+        return ''.join(segment[1] for segment in self.segments)
+
+    def tokens(self):
+        '''Returns a list of (word, formatting key, rPr) tuples'''
+        return [(word, rkey, rpr) for rkey, text, rpr in self.segments
+                for word in TOKEN.findall(text)]
+
+
+def paragraphs(document):
+    return [Paragraph(element) for element in document.body.iter(W + 'p')]
+
+def align(old, new):
+    '''Yields difflib opcodes aligning two lists of paragraphs'''
+    start = 0
+    end = min(len(old), len(new))
+    while start < end and old[start].key == new[start].key:
+        start += 1
+    tail = 0
+    while (tail < end - start and
+           old[len(old) - 1 - tail].key == new[len(new) - 1 - tail].key):
+        tail += 1
+    if start:
+        yield 'equal', 0, start, 0, start
+    matcher = difflib.SequenceMatcher(None,
+              [paragraph.key for paragraph in old[start:len(old) - tail]],
+              [paragraph.key for paragraph in new[start:len(new) - tail]],
+              autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        yield tag, start + i1, start + i2, start + j1, start + j2
+    if tail:
+        yield 'equal', len(old) - tail, len(old), len(new) - tail, len(new)
+
+def edit_script(opcodes):
+    '''Yields ('insert' or 'delete' or 'change', old index, new index) for
+    each paragraph that differs, given the opcodes from align, pairing up
+    the paragraphs of replaced blocks in order'''
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            continue
+        paired = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+        for offset in range(paired):
+            yield 'change', i1 + offset, j1 + offset
+        for index in range(i1 + paired, i2):
+            yield 'delete', index, j1 + paired
+        for index in range(j1 + paired, j2):
+            yield 'insert', i1 + paired, index
+
+def word_opcodes(old_tokens, new_tokens):
+    matcher = difflib.SequenceMatcher(None,
+              [token[:2] for token in old_tokens],
+              [token[:2] for token in new_tokens], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'replace' and ([token[0] for token in old_tokens[i1:i2]]
+                                 == [token[0] for token in new_tokens[j1:j2]]):
+            tag = 'format'
+        yield tag, i1, i2, j1, j2
+
+def compare(old, new):
+    '''Returns a list of Change tuples describing how the paragraphs of the
+    Docx new differ from those of the Docx old'''
+    return compare_paragraphs(paragraphs(old), paragraphs(new))
+
+def compare_paragraphs(old_paragraphs, new_paragraphs, opcodes=None):
+    if opcodes is None:
+        opcodes = align(old_paragraphs, new_paragraphs)
+    changes = []
+    for kind, i, j in edit_script(opcodes):
+        if kind == 'insert':
+            changes.append(Change(kind, i, j, '', new_paragraphs[j].text, []))
+        elif kind == 'delete':
+            changes.append(Change(kind, i, j, old_paragraphs[i].text, '', []))
+        else:
+            old_tokens = old_paragraphs[i].tokens()
+            new_tokens = new_paragraphs[j].tokens()
+            edits = [(tag, ''.join(token[0] for token in old_tokens[i1:i2]),
+                      ''.join(token[0] for token in new_tokens[j1:j2]))
+                     for tag, i1, i2, j1, j2 in word_opcodes(old_tokens,
+                                                             new_tokens)
+                     if tag != 'equal']
+            changes.append(Change(kind, i, j, old_paragraphs[i].text,
+                                  new_paragraphs[j].text, edits))
+    return changes
+
+
+class Redliner():
+    '''Builds the tracked change markup for redline'''
+    def __init__(self, document, author, date):
+        self.attributes = {W + 'author': author, W + 'date': date}
+        ids = [int(value) for element in itertools.chain(
+               document.body.iter(), document.comments.iter()
+               if document.comments is not None else ())
+               for value in (element.get(W + 'id'),)
+               if value is not None and value.isdigit()]
+        self.ids = itertools.count(max(ids) + 1 if ids else 0)
+
+    def mark(self, tag):
+        attributes = dict(self.attributes)
+        attributes[W + 'id'] = str(next(self.ids))
+        return etree.Element(tag, attributes)
+
+    def run(self, text, rpr, deleted=False):
+        '''Returns a w:r for text, with its tabs and line breaks'''
+        run = etree.Element(W + 'r')
+        if rpr is not None:
+            run.append(copy.deepcopy(rpr))
+        for part in re.split('([\t\n])', text):
+            if part == '\t':
+                etree.SubElement(run, W + 'tab')
+            elif part == '\n':
+                etree.SubElement(run, W + 'br')
+            elif part:
+                t = etree.SubElement(run, W + ('delText' if deleted else 't'))
+                t.text = part
+                t.set('{http://www.w3.org/XML/1998/namespace}space',
+                      'preserve')
+        return run
+
+    def mark_paragraph(self, paragraph, tag):
+        '''Marks a paragraph's mark as inserted or deleted'''
+        ppr = paragraph.find(W + 'pPr')
+        if ppr is None:
+            ppr = etree.Element(W + 'pPr')
+            paragraph.insert(0, ppr)
+        rpr = ppr.find(W + 'rPr')
+        if rpr is None:
+            rpr = etree.SubElement(ppr, W + 'rPr')
+            # rPr comes before sectPr and pPrChange
+            for name in ('sectPr', 'pPrChange'):
+                following = ppr.find(W + name)
+                if following is not None:
+                    following.addprevious(rpr)
+                    break
+        rpr.insert(0, self.mark(W + tag))
+
+    def deleted(self, paragraph):
+        '''Returns a new w:p holding the text of a Paragraph as deleted'''
+        element = etree.Element(W + 'p')
+        if paragraph.ppr is not None:
+            ppr = copy.deepcopy(paragraph.ppr)
+            for sectpr in ppr.findall(W + 'sectPr'):
+                ppr.remove(sectpr)
+            element.append(ppr)
+        if paragraph.segments:
+            wrapper = self.mark(W + 'del')
+            element.append(wrapper)
+            for rkey, text, rpr in paragraph.segments:
+                wrapper.append(self.run(text, rpr, deleted=True))
+        self.mark_paragraph(element, 'del')
+        return element
+
+    def inserted(self, paragraph):
+        '''Marks the content of a w:p as inserted'''
+        self.insert_runs(paragraph)
+        self.mark_paragraph(paragraph, 'ins')
+
+    def insert_runs(self, parent):
+        '''Wraps each group of consecutive runs in parent, and in the
+        hyperlinks and other run containers in it, in a w:ins where the
+        group is, so that bookmarks, comment ranges and the like keep
+        their places between the runs'''
+        group = []
+        for child in list(parent):
+            if child.tag == W + 'r':
+                group.append(child)
+                continue
+            self.wrap(group)
+            group = []
+            if child.tag in RUN_CONTAINER_TAGS:
+                self.insert_runs(child)
+        self.wrap(group)
+
+    def wrap(self, runs):
+        if runs:
+            wrapper = self.mark(W + 'ins')
+            runs[0].addprevious(wrapper)
+            wrapper.extend(runs)
+
+    def changed(self, old, new):
+        '''Rebuilds the runs of the new Paragraph with word level tracked
+        changes from the old one'''
+        old_tokens = old.tokens()
+        new_tokens = new.tokens()
+        content = []
+        for tag, i1, i2, j1, j2 in word_opcodes(old_tokens, new_tokens):
+            if tag in ('delete', 'replace'):
+                content.append(('del', old_tokens[i1:i2]))
+            if tag in ('insert', 'replace'):
+                content.append(('ins', new_tokens[j1:j2]))
+            elif tag == 'equal':
+                content.append(('equal', new_tokens[j1:j2]))
+            elif tag == 'format':
+                content.append(('format', list(zip(old_tokens[i1:i2],
+                                                   new_tokens[j1:j2]))))
+        element = new.element
+        for child in list(element):
+            if child.tag != W + 'pPr':
+                element.remove(child)
+        for kind, tokens in content:
+            if kind == 'format':
+                for (word, old_rkey, old_rpr), (word, rkey, rpr) in tokens:
+                    run = self.run(word, rpr)
+                    run_rpr = run.find(W + 'rPr')
+                    if run_rpr is None:
+                        run_rpr = etree.Element(W + 'rPr')
+                        run.insert(0, run_rpr)
+                    change = self.mark(W + 'rPrChange')
+                    change.append(copy.deepcopy(old_rpr) if old_rpr is not None
+                                  else etree.Element(W + 'rPr'))
+                    run_rpr.append(change)
+                    element.append(run)
+                continue
+            parent = element
+            if kind != 'equal':
+                parent = self.mark(W + kind)
+                element.append(parent)
+            for rkey, group in itertools.groupby(tokens,
+                                                 lambda token: token[1]):
+                group = list(group)
+                parent.append(self.run(''.join(token[0] for token in group),
+                                       group[0][2], deleted=kind == 'del'))
+        if old.key[0] != new.key[0]:
+            ppr = element.find(W + 'pPr')
+            if ppr is None:
+                ppr = etree.Element(W + 'pPr')
+                element.insert(0, ppr)
+            change = self.mark(W + 'pPrChange')
+            old_ppr = etree.SubElement(change, W + 'pPr')
+            if old.ppr is not None:
+                old_ppr.extend(copy.deepcopy(child) for child in old.ppr
+                if child.tag not in (W + 'rPr', W + 'sectPr', W + 'pPrChange'))
+            ppr.append(change)
+
+
+class Placer():
+    '''Finds where deleted paragraphs go in the new document: next to
+    the new counterpart of a neighbour in the container, such as the body
+    or a table cell, that the paragraph was deleted from'''
+    def __init__(self, new, counterparts):
+        self.new = new
+        # old paragraph elements to the new or inserted deleted elements
+        # standing for them
+        self.counterparts = counterparts
+
+    def counterpart(self, element, reverse):
+        '''Returns the new element standing for an old paragraph, or for
+        the last (reverse) or first paragraph in another old element'''
+        if element.tag == W + 'p':
+            return self.counterparts.get(element)
+        paragraphs = list(element.iter(W + 'p'))
+        if reverse:
+            paragraphs.reverse()
+        for paragraph in paragraphs:
+            if paragraph in self.counterparts:
+                return self.counterparts[paragraph]
+        return None
+
+    def ancestor(self, element, container_tags):
+        '''Returns element or its nearest ancestor whose parent has one of
+        container_tags, or None'''
+        for ancestor in itertools.chain((element,), element.iterancestors()):
+            parent = ancestor.getparent()
+            if parent is not None and parent.tag in container_tags:
+                return ancestor
+        return None
+
+    def place(self, old_element, deleted):
+        '''Inserts the deleted copy of an old paragraph into the new
+        document'''
+        element = old_element
+        while element.getparent() is not None:
+            # A neighbour's counterpart may be in the same kind of
+            # container or, if that container was deleted, in an outer one
+            container_tags = set(ancestor.tag for ancestor in
+                                 element.iterancestors())
+            for reverse, siblings in ((True, element.itersiblings(
+            preceding=True)), (False, element.itersiblings())):
+                for sibling in siblings:
+                    found = self.counterpart(sibling, reverse)
+                    if found is None:
+                        continue
+                    anchor = self.ancestor(found, container_tags)
+                    if anchor is None:
+                        continue
+                    if reverse:
+                        anchor.addnext(deleted)
+                    else:
+                        anchor.addprevious(deleted)
+                    self.counterparts[old_element] = deleted
+                    return
+            # Nothing left of the container, such as a deleted table, so
+            # place the paragraph next to where the container was
+            element = element.getparent()
+        sectpr = self.new.body.find(W + 'sectPr')
+        if sectpr is not None:
+            sectpr.addprevious(deleted)
+        else:
+            self.new.body.append(deleted)
+        self.counterparts[old_element] = deleted
+
+
+def redline(old, new, author='oodocx', date=None):
+    '''Marks up the Docx new with tracked changes, insertions and
+    deletions that Word shows as a redline against the Docx old, and
+    returns the list of Change tuples, as compare does. Deleted text is
+    copied from old without images or other objects. date is a datetime,
+    the current time by default. new is changed in place.'''
+    date = (date or datetime.datetime.now(datetime.timezone.utc)).strftime(
+            '%Y-%m-%dT%H:%M:%SZ')
+    old_paragraphs = paragraphs(old)
+    new_paragraphs = paragraphs(new)
+    redliner = Redliner(new, author, date)
+    opcodes = list(align(old_paragraphs, new_paragraphs))
+    changes = compare_paragraphs(old_paragraphs, new_paragraphs, opcodes)
+    counterparts = {}
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            for offset in range(i2 - i1):
+                counterparts[old_paragraphs[i1 + offset].element] = (
+                new_paragraphs[j1 + offset].element)
+    for change in changes:
+        if change.kind == 'change':
+            counterparts[old_paragraphs[change.old_index].element] = (
+            new_paragraphs[change.new_index].element)
+    placer = Placer(new, counterparts)
+    for change in changes:
+        if change.kind == 'insert':
+            redliner.inserted(new_paragraphs[change.new_index].element)
+            continue
+        old_paragraph = old_paragraphs[change.old_index]
+        if change.kind == 'delete':
+            placer.place(old_paragraph.element,
+                         redliner.deleted(old_paragraph))
+            continue
+        new_paragraph = new_paragraphs[change.new_index]
+        if old_paragraph.simple and new_paragraph.simple:
+            redliner.changed(old_paragraph, new_paragraph)
+        else:
+            new_paragraph.element.addprevious(redliner.deleted(old_paragraph))
+            redliner.inserted(new_paragraph.element)
+    return changes
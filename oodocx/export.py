@@ -0,0 +1,316 @@
+"""
+Export the body of a Docx to HTML, Markdown or plain text.
+
+The body is walked once and output is written to a file-like object as
+each block is rendered, so large documents are never held as one string.
+"""
+
+import io
+import re
+from html import escape
+from oodocx.oodocx import NSPREFIXES
+
+W = '{' + NSPREFIXES['w'] + '}'
+HEADING_RE = re.compile(r'^(?:Heading|Titolo)(\d)$')
+MARKDOWN_SPECIAL_RE = re.compile(r'([\\`*_\[\]#<>|])')
+# Link targets that are written out; any other link, such as a javascript:
+# or file: URL, is exported as plain text
+SAFE_HREF_RE = re.compile(r'^(?:https?:|mailto:|#)', re.IGNORECASE)
+
+
+def export(document, output=None, format='html'):
+    '''Writes the body of a Docx to output, a file-like object opened in
+    text mode, as 'html', 'markdown' or 'text'. If output is None the
+    result is returned as a string.'''
+    if format not in EXPORTERS:
+        raise ValueError('format must be one of: ' +
+                         ', '.join(sorted(EXPORTERS)))
+    if output is None:
+        output = io.StringIO()
+        EXPORTERS[format].export(document, output)
+        return output.getvalue()
+    EXPORTERS[format].export(document, output)
+
+def to_html(document, output=None):
+    return export(document, output, 'html')
+
+def to_markdown(document, output=None):
+    return export(document, output, 'markdown')
+
+def to_text(document, output=None):
+    return export(document, output, 'text')
+
+def numbering_formats(document):
+    '''Returns a dictionary mapping (numId, ilvl) to the numFmt of that
+    list level, read once from the document's numbering part'''
+    formats = {}
+    if document.numbering is None:
+        return formats
+    abstract_formats = {}
+    for abstract in document.numbering.iterchildren(W + 'abstractNum'):
+        levels = {}
+        for lvl in abstract.iterchildren(W + 'lvl'):
+            numfmt = lvl.find(W + 'numFmt')
+            levels[lvl.get(W + 'ilvl')] = (numfmt.get(W + 'val') if numfmt
+                                           is not None else 'decimal')
+        abstract_formats[abstract.get(W + 'abstractNumId')] = levels
+    for num in document.numbering.iterchildren(W + 'num'):
+        abstract_id = num.find(W + 'abstractNumId').get(W + 'val')
+        for ilvl, numfmt in abstract_formats.get(abstract_id, {}).items():
+            formats[(num.get(W + 'numId'), ilvl)] = numfmt
+    return formats
+
+def safe_href(href):
+    '''Returns href if it is an http, https or mailto URL or a # anchor,
+    and None otherwise'''
+    if href is not None and SAFE_HREF_RE.match(href):
+        return href
+    return None
+
+def is_on(rpr, tag):
+    '''Returns whether a toggle property such as w:b is set in an rPr'''
+    if rpr is None:
+        return False
+    element = rpr.find(W + tag)
+    if element is None:
+        return False
+    return element.get(W + 'val', 'true') not in ('0', 'false', 'off', 'none')
+
+
+class Exporter():
+    '''Walks the body of a Docx once and calls a hook for each block.
+    Subclasses render the hooks for one output format.'''
+    def export(self, document, output):
+        formats = numbering_formats(document)
+        hyperlinks = dict((relationship.get('Id'), relationship.get('Target'))
+                          for relationship in document.relationships)
+        # A [ordered, item open] pair for each list that is open
+        lists = []
+        self.start(output)
+        for block in document.body.iterchildren(W + 'p', W + 'tbl'):
+            if block.tag == W + 'tbl':
+                self.close_lists(output, lists, 0)
+                self.table(output, [[[self.segments(p, hyperlinks)
+                for p in cell.iter(W + 'p')]
+                for cell in row.iterchildren(W + 'tc')]
+                for row in block.iterchildren(W + 'tr')])
+                continue
+            ppr = block.find(W + 'pPr')
+            style = ppr.find(W + 'pStyle') if ppr is not None else None
+            heading = (HEADING_RE.match(style.get(W + 'val', '')) if style is
+                       not None else None)
+            numpr = ppr.find(W + 'numPr') if ppr is not None else None
+            if heading:
+                self.close_lists(output, lists, 0)
+                self.heading(output, int(heading.group(1)),
+                             self.segments(block, hyperlinks, plain=True))
+            elif numpr is not None and numpr.find(W + 'numId') is not None:
+                ilvl = numpr.find(W + 'ilvl')
+                ilvl = ilvl.get(W + 'val') if ilvl is not None else '0'
+                ordered = formats.get((numpr.find(W + 'numId').get(W + 'val'),
+                                       ilvl), 'decimal') != 'bullet'
+                level = int(ilvl)
+                self.close_lists(output, lists, level + 1)
+                if len(lists) == level + 1 and lists[-1][0] != ordered:
+                    self.close_lists(output, lists, level)
+                if len(lists) == level + 1 and lists[-1][1]:
+                    self.close_item(output)
+                # A deeper list is opened inside the item that is still
+                # open in its parent list
+                while len(lists) < level + 1:
+                    lists.append([ordered, False])
+                    self.open_list(output, ordered)
+                self.list_item(output, ordered, level,
+                               self.segments(block, hyperlinks))
+                lists[-1][1] = True
+            else:
+                self.close_lists(output, lists, 0)
+                self.paragraph(output, self.segments(block, hyperlinks))
+        self.close_lists(output, lists, 0)
+        self.end(output)
+
+    def close_lists(self, output, lists, depth):
+        while len(lists) > depth:
+            ordered, item_open = lists.pop()
+            if item_open:
+                self.close_item(output)
+            self.close_list(output, ordered)
+
+    def segments(self, paragraph, hyperlinks, plain=False):
+        '''Returns the text of a paragraph as a list of [text, bold,
+        italic, underline, href] segments, merging neighbouring runs with
+        the same formatting. Links to anything but web pages, mail
+        addresses and bookmarks lose their href.'''
+        segments = []
+        for run in paragraph.iter(W + 'r'):
+            href = None
+            parent = run.getparent()
+            if parent.tag == W + 'hyperlink':
+                if parent.get(W + 'anchor'):
+                    href = '#' + parent.get(W + 'anchor')
+                else:
+                    href = safe_href(hyperlinks.get(parent.get(
+                                     '{' + NSPREFIXES['r'] + '}id')))
+            rpr = run.find(W + 'rPr')
+            if plain:
+                formatting = [False, False, False, href]
+            else:
+                formatting = [is_on(rpr, 'b'), is_on(rpr, 'i'),
+                              is_on(rpr, 'u'), href]
+            pieces = []
+            for child in run:
+                if child.tag == W + 't':
+                    pieces.append(child.text or '')
+                elif child.tag == W + 'tab':
+                    pieces.append('\t')
+                elif child.tag in (W + 'br', W + 'cr'):
+                    pieces.append('\n')
+            text = ''.join(pieces)
+            if not text:
+                continue
+            if segments and segments[-1][1:] == formatting:
+                segments[-1][0] += text
+            else:
+                segments.append([text] + formatting)
+        return segments
+
+    def start(self, output):
+        pass
+
+    def end(self, output):
+        pass
+
+    def open_list(self, output, ordered):
+        pass
+
+    def close_list(self, output, ordered):
+        pass
+
+    def close_item(self, output):
+        '''Ends a list item, after any lists nested in it'''
+        pass
+
+
+class HTMLExporter(Exporter):
+    def inline(self, segments):
+        html = []
+        for text, bold, italic, underline, href in segments:
+            text = escape(text).replace('\n', '<br>')
+            for on, tag in ((underline, 'u'), (italic, 'em'), (bold, 'strong')):
+                if on:
+                    text = '<{0}>{1}</{0}>'.format(tag, text)
+            if href:
+                text = '<a href="{0}">{1}</a>'.format(escape(href), text)
+            html.append(text)
+        return ''.join(html)
+
+    def start(self, output):
+        output.write('<!DOCTYPE html>\n<html>\n<body>\n')
+
+    def end(self, output):
+        output.write('</body>\n</html>\n')
+
+    def heading(self, output, level, segments):
+        level = min(max(level, 1), 6)
+        output.write('<h{0}>{1}</h{0}>\n'.format(level, self.inline(segments)))
+
+    def paragraph(self, output, segments):
+        output.write('<p>{0}</p>\n'.format(self.inline(segments)))
+
+    def open_list(self, output, ordered):
+        output.write('<ol>\n' if ordered else '<ul>\n')
+
+    def close_list(self, output, ordered):
+        output.write('</ol>\n' if ordered else '</ul>\n')
+
+    def list_item(self, output, ordered, level, segments):
+        # Left open for nested lists until close_item
+        output.write('<li>{0}'.format(self.inline(segments)))
+
+    def close_item(self, output):
+        output.write('</li>\n')
+
+    def table(self, output, rows):
+        output.write('<table>\n')
+        for row in rows:
+            output.write('<tr>')
+            for cell in row:
+                output.write('<td>{0}</td>'.format('<br>'.join(
+                self.inline(paragraph) for paragraph in cell)))
+            output.write('</tr>\n')
+        output.write('</table>\n')
+
+
+class MarkdownExporter(Exporter):
+    def inline(self, segments):
+        markdown = []
+        for text, bold, italic, underline, href in segments:
+            text = MARKDOWN_SPECIAL_RE.sub(r'\\\1', text).replace('\n', '  \n')
+            stripped = text.strip()
+            if stripped:
+                # Markers must touch the text, so keep spaces outside them
+                lead = text[:len(text) - len(text.lstrip())]
+                trail = text[len(text.rstrip()):]
+                if underline:
+                    stripped = '<u>{0}</u>'.format(stripped)
+                if italic:
+                    stripped = '*{0}*'.format(stripped)
+                if bold:
+                    stripped = '**{0}**'.format(stripped)
+                if href:
+                    stripped = '[{0}]({1})'.format(stripped, href.replace(
+                    ' ', '%20').replace('(', '%28').replace(')', '%29'))
+                text = lead + stripped + trail
+            markdown.append(text)
+        return ''.join(markdown)
+
+    def heading(self, output, level, segments):
+        output.write('{0} {1}\n\n'.format('#' * min(max(level, 1), 6),
+                                          self.inline(segments)))
+
+    def paragraph(self, output, segments):
+        output.write(self.inline(segments) + '\n\n')
+
+    def close_list(self, output, ordered):
+        output.write('\n')
+
+    def list_item(self, output, ordered, level, segments):
+        output.write('{0}{1} {2}\n'.format('    ' * level,
+                     '1.' if ordered else '-', self.inline(segments)))
+
+    def table(self, output, rows):
+        if not rows:
+            return
+        columns = max(len(row) for row in rows)
+        for index, row in enumerate(rows):
+            cells = [' '.join(self.inline(paragraph).replace('  \n', ' ')
+                     for paragraph in cell) for cell in row]
+            cells += [''] * (columns - len(cells))
+            output.write('| ' + ' | '.join(cells) + ' |\n')
+            if index == 0:
+                output.write('|' + ' --- |' * columns + '\n')
+        output.write('\n')
+
+
+class TextExporter(Exporter):
+    def inline(self, segments):
+        return ''.join(segment[0] for segment in segments)
+
+    def heading(self, output, level, segments):
+        output.write(self.inline(segments) + '\n')
+
+    def paragraph(self, output, segments):
+        output.write(self.inline(segments) + '\n')
+
+    def list_item(self, output, ordered, level, segments):
+        output.write('    ' * level + self.inline(segments) + '\n')
+
+    def table(self, output, rows):
+        for row in rows:
+            output.write('\t'.join(' '.join(self.inline(paragraph)
+                         for paragraph in cell) for cell in row) + '\n')
+
+
+# The exporters hold no per-document state, so one of each is shared
+EXPORTERS = {'html': HTMLExporter(), 'markdown': MarkdownExporter(),
+             'text': TextExporter()}
@@ -0,0 +1,218 @@
+"""
+A persistent full-text index of the paragraphs in a collection of docx files,
+kept in an SQLite database with the FTS5 extension.
+
+    index = DocumentIndex('corpus.db')
+    index.update([r'C:\\users\\applecart'])
+    for hit in index.search('apple NEAR banana'):
+        print(hit.path, hit.paragraph, hit.snippet)
+    document, paragraph = index.open(hit)
+
+Updates are incremental: a file whose size and modification time are
+unchanged is skipped, and one whose content hash is unchanged is not
+reparsed.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+from lxml import etree
+from oodocx import oodocx
+from oodocx.corpus import find_documents
+
+SearchHit = collections.namedtuple('SearchHit', 'path paragraph snippet')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS paragraphs (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    ordinal INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS paragraphs_file ON paragraphs(file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS paragraph_text USING fts5(
+    text, content='paragraphs', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS paragraphs_insert AFTER INSERT ON paragraphs
+BEGIN
+    INSERT INTO paragraph_text(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS paragraphs_delete AFTER DELETE ON paragraphs
+BEGIN
+    INSERT INTO paragraph_text(paragraph_text, rowid, text)
+    VALUES ('delete', old.id, old.text);
+END;
+'''
+
+
+def file_hash(path):
+    '''Returns the SHA-1 hex digest of a file's contents'''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def extract(job):
+    '''Takes a (path, previous hash) tuple and returns (hash, paragraphs),
+    where paragraphs is None if the hash has not changed and otherwise a
+    list of (ordinal, text hash, text) tuples for the non-empty paragraphs'''
+    path, previous_hash = job
+    digest = file_hash(path)
+    if digest == previous_hash:
+        return digest, None
+    paragraphs = []
+    for ordinal, text in enumerate(oodocx.iter_document_text(path)):
+        if text.strip():
+            paragraphs.append((ordinal, hashlib.sha1(
+            text.encode('utf-8')).hexdigest(), text))
+    return digest, paragraphs
+
+def try_extract(job):
+    '''Runs extract, logging and returning None if the file can't be read'''
+    try:
+        return extract(job)
+    except Exception:
+        oodocx.log.warning('Could not index %s', job[0], exc_info=True)
+        return None
+
+
+class DocumentIndex():
+    '''A full-text index of paragraph text stored in the SQLite database at
+    path, which is created if it does not exist'''
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, paths, workers=1, prune=False):
+        '''Indexes the docx files in paths, which may name files or
+        directories to walk, skipping files that have not changed since
+        they were last indexed. With more than one worker, changed files
+        are parsed in a process pool. If prune is true, indexed files that
+        no longer exist are removed. Returns a dictionary counting the
+        files that were indexed, unchanged, removed and failed.'''
+        counts = {'indexed': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+        known = dict((row[0], row[1:]) for row in self.connection.execute(
+                     'SELECT path, id, size, mtime, hash FROM files'))
+        jobs = []
+        for path, relpath in find_documents(paths):
+            path = os.path.abspath(path)
+            try:
+                status = os.stat(path)
+            except OSError:
+                # Removed since the directory was listed, or a broken link
+                oodocx.log.warning('Could not index %s', path, exc_info=True)
+                counts['failed'] += 1
+                continue
+            record = known.get(path)
+            if (record is not None and record[1] == status.st_size and
+            record[2] == status.st_mtime):
+                counts['unchanged'] += 1
+                continue
+            jobs.append((path, status, record))
+        if workers == 1:
+            results = map(try_extract,
+                          [(path, record and record[3])
+                           for path, status, record in jobs])
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(workers)
+            results = executor.map(try_extract,
+                                   [(path, record and record[3])
+                                    for path, status, record in jobs])
+        try:
+            for (path, status, record), result in zip(jobs, results):
+                if result is None:
+                    counts['failed'] += 1
+                    continue
+                digest, paragraphs = result
+                with self.connection:
+                    if record is None:
+                        file_id = self.connection.execute(
+                        'INSERT INTO files (path, size, mtime, hash) '
+                        'VALUES (?, ?, ?, ?)', (path, status.st_size,
+                        status.st_mtime, digest)).lastrowid
+                    else:
+                        file_id = record[0]
+                        self.connection.execute(
+                        'UPDATE files SET size = ?, mtime = ?, hash = ? '
+                        'WHERE id = ?', (status.st_size, status.st_mtime,
+                        digest, file_id))
+                    if paragraphs is None:
+                        counts['unchanged'] += 1
+                        continue
+                    self.connection.execute(
+                    'DELETE FROM paragraphs WHERE file_id = ?', (file_id,))
+                    self.connection.executemany(
+                    'INSERT INTO paragraphs (file_id, ordinal, hash, text) '
+                    'VALUES (?, ?, ?, ?)', ((file_id,) + paragraph
+                                            for paragraph in paragraphs))
+                counts['indexed'] += 1
+        finally:
+            if workers != 1:
+                executor.shutdown()
+        if prune:
+            for path, record in known.items():
+                if not os.path.exists(path):
+                    self.remove(path)
+                    counts['removed'] += 1
+        return counts
+
+    def remove(self, path):
+        '''Removes a file and its paragraphs from the index'''
+        path = os.path.abspath(path)
+        with self.connection:
+            row = self.connection.execute('SELECT id FROM files WHERE '
+                                          'path = ?', (path,)).fetchone()
+            if row is None:
+                return
+            self.connection.execute('DELETE FROM paragraphs WHERE '
+                                    'file_id = ?', row)
+            self.connection.execute('DELETE FROM files WHERE id = ?', row)
+
+    def search(self, query, limit=100, marks=('[', ']')):
+        '''Runs an FTS5 query, such as 'apple', '"apple pie"' or
+        'apple NOT pie', and returns a list of SearchHit tuples of (path,
+        paragraph index, snippet), best matches first. The matched words
+        in each snippet are surrounded by marks.'''
+        return [SearchHit(*row) for row in self.connection.execute(
+                'SELECT files.path, paragraphs.ordinal, '
+                "snippet(paragraph_text, 0, ?, ?, '...', 16) "
+                'FROM paragraph_text '
+                'JOIN paragraphs ON paragraphs.id = paragraph_text.rowid '
+                'JOIN files ON files.id = paragraphs.file_id '
+                'WHERE paragraph_text MATCH ? ORDER BY rank LIMIT ?',
+                (marks[0], marks[1], query, limit))]
+
+    def open(self, hit):
+        '''Opens the document of a SearchHit and returns a (Docx, paragraph
+        element) tuple for the paragraph that matched'''
+        document = oodocx.Docx(hit.path)
+        # Paragraphs are numbered in the order iter_document_text yields
+        # them, which is the order their end tags appear in
+        for ordinal, (event, paragraph) in enumerate(etree.iterwalk(
+        document.document, events=('end',),
+        tag='{' + oodocx.NSPREFIXES['w'] + '}p')):
+            if ordinal == hit.paragraph:
+                return document, paragraph
+        raise ValueError('paragraph {0} not found in {1}; the document has '
+                         'changed since it was indexed'.format(hit.paragraph,
+                                                               hit.path))
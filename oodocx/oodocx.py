@@ -14,9 +14,17 @@ import time
 import datetime
 import os
 import io
+import bisect
 import collections
+import concurrent.futures
+import contextlib
+import copy
+import csv
+import functools
+import itertools
 import stat
 import tempfile
+import threading
 from lxml import etree
 from oodocx import helper_functions
 from oodocx import write_files
@@ -24,6 +32,15 @@ from oodocx import write_files
 log = logging.getLogger(__name__)
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'template')
 BASE_DIR = tempfile.mkdtemp()
+# Options for parsing every XML part: parts may be larger than libxml2's
+# default limits, ignorable whitespace is dropped, xml:id attributes are not
+# indexed, and entities and network access are refused so that a document
+# can't pull in outside content
+PARSER_OPTIONS = {'huge_tree': True, 'remove_blank_text': True,
+                  'collect_ids': False, 'resolve_entities': False,
+                  'no_network': True}
+# lxml parsers must not be shared between threads, so each gets its own
+_parsers = threading.local()
 # All Word prefixes / namespace matches used in document.xml & core.xml.
 # LXML doesn't actually use prefixes (just the real namespace) , but these
 # make it easier to copy Word output more easily.
@@ -72,32 +89,178 @@ COLOR_MAP = {
     'white': 'FFFFFF',
     'yellow': 'FFFF00'}
 
+CommentInfo = collections.namedtuple('CommentInfo',
+                                     'id author date text anchored_text paragraph')
+
+# Extensions of file formats that are already compressed, which save()
+# stores rather than deflating again
+COMPRESSED_EXTENSIONS = set(('.jpeg', '.jpg', '.png', '.gif', '.tif', '.tiff',
+                             '.wdp', '.zip', '.docx', '.xlsx', '.pptx',
+                             '.mp3', '.mp4', '.m4a', '.avi', '.wmv'))
+# The earliest time a zip file can hold, used for deterministic saves
+FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Instrumentation is off until enable_stats() is called. While it is off,
+# each instrumented stage costs a single check of this flag.
+instrumented = False
+stat_hooks = []
+
+
+class Stats():
+    '''Counts, wall time and byte totals for each stage of a document's
+    lifecycle, filled in while instrumentation is enabled. stages maps a
+    stage name to a dictionary of totals, and parts does the same for each
+    part of the package.'''
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.parts = collections.OrderedDict()
+
+    def __repr__(self):
+        return 'Stats({0!r})'.format(dict(self.stages))
+
+    def __getitem__(self, stage):
+        return self.stages[stage]
+
+    def add(self, stage, seconds=0.0, part=None, **totals):
+        '''Adds one occurrence of stage taking seconds, and any numeric
+        totals such as byte counts'''
+        entries = [self.stages.setdefault(stage, {'count': 0,
+                                                  'seconds': 0.0})]
+        if part is not None:
+            entries.append(self.parts.setdefault(part, {}).setdefault(stage,
+                           {'count': 0, 'seconds': 0.0}))
+        for entry in entries:
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            for name, value in totals.items():
+                entry[name] = entry.get(name, 0) + value
+
+    def as_dict(self):
+        return {'stages': copy.deepcopy(dict(self.stages)),
+                'parts': copy.deepcopy(dict(self.parts))}
+
+    def reset(self):
+        self.stages.clear()
+        self.parts.clear()
+
+
+# Stages not tied to a document, such as elements made by makeelement
+global_stats = Stats()
+
+def enable_stats(hook=None):
+    '''Turns instrumentation on. Each Docx then records its stages in
+    its stats attribute and makeelement counts elements in global_stats.
+    If hook is given it is called as hook(document, stage, seconds,
+    details) for each stage; log_stats_hook sends them to logging.'''
+    global instrumented
+    if hook is not None and hook not in stat_hooks:
+        stat_hooks.append(hook)
+    instrumented = True
+
+def disable_stats():
+    '''Turns instrumentation off and removes all hooks'''
+    global instrumented
+    instrumented = False
+    del stat_hooks[:]
+
+def log_stats_hook(document, stage, seconds, details):
+    '''A hook for enable_stats that logs each stage at debug level'''
+    log.debug('%s took %.6fs %r', stage, seconds, details)
+
+def record_stage(document, stage, start, end=None, **details):
+    '''Records a stage that began at perf_counter() time start, and ended
+    at end or now, in the document's stats and passes it to the hooks.
+    Only call this while instrumented is true.'''
+    seconds = (end if end is not None else time.perf_counter()) - start
+    stats = document.stats if document is not None else global_stats
+    stats.add(stage, seconds, **details)
+    for hook in stat_hooks:
+        hook(document, stage, seconds, details)
+
+
+def load_entry(entry):
+    '''Takes an (archive name, XML part or file path) entry of a package
+    being saved and returns (archive name, bytes, start, end), where start
+    and end are perf_counter() times around serializing an XML part, or
+    None for files'''
+    archivename, source = entry
+    if isinstance(source, str):
+        with open(source, 'rb') as package_file:
+            return archivename, package_file.read(), None, None
+    start = time.perf_counter()
+    data = etree.tostring(source, xml_declaration=True, encoding='UTF-8',
+                          standalone=True)
+    return archivename, data, start, time.perf_counter()
+
+def load_entries(executor, entries, window):
+    '''Yields the results of load_entry for entries in order, running it
+    on executor with at most window entries loaded ahead of the one being
+    written, so that memory holds a few serialized parts rather than all
+    of them'''
+    pending = collections.deque()
+    for entry in entries:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(load_entry, entry))
+    while pending:
+        yield pending.popleft().result()
+
 
 class Docx():
     def __init__(self, file=''):
-        folder_number = 1
-        self.write_dir = os.path.join(BASE_DIR, str(folder_number))
-        while os.path.isdir(self.write_dir):
-            folder_number += 1
-            self.write_dir = os.path.join(BASE_DIR,  str(folder_number))
+        self.stats = Stats()
+        # Read once, so that a stage is never half timed if instrumentation
+        # is switched on or off meanwhile
+        timed = instrumented
+        if timed:
+            open_start = time.perf_counter()
+        # mkdtemp picks and creates the directory in one step, so documents
+        # opened from several threads at once never share a directory
+        self.write_dir = tempfile.mkdtemp(dir=BASE_DIR)
         # dictionary to connect element objects to their path in the docx file
         self.xmlfiles = {}
-        try:
-            shutil.rmtree(self.write_dir, onerror=helper_functions.remove_readonly)
-        except:
-            pass
         self.media_dir = os.path.join(self.write_dir, 'word', 'media')
         # Declare empty attributes, which may or may not be assigned to xml
         # elements later
         self.comments = None
+        self.numbering = None
+        self.numbering_registry = None
+        self.style_registry = None
         # self.xmlfiles[self.comments] = os.path.join('word/comments.xml')
+        # XML parts are parsed straight from the zip file or template and
+        # only written to write_dir by save(); other files are extracted
+        parser = get_parser()
+        parts = []
         if file:
-            os.mkdir(self.write_dir)
-            zipdoc = zipfile.ZipFile(file)
-            for filepath in zipdoc.namelist():
-                zipdoc.extractall(self.write_dir)
+            if timed:
+                start = time.perf_counter()
+            with zipfile.ZipFile(file) as zipdoc:
+                if timed:
+                    record_stage(self, 'zip_read', start,
+                                 parts=len(zipdoc.infolist()))
+                for info in zipdoc.infolist():
+                    name = info.filename
+                    relpath = os.path.normpath(name)
+                    if timed:
+                        start = time.perf_counter()
+                    if name.endswith('.xml') or name.endswith('.rels'):
+                        with zipdoc.open(info) as part:
+                            parts.append((relpath, etree.parse(part,
+                                          parser).getroot()))
+                        if timed:
+                            record_stage(self, 'parse', start, part=name,
+                                         bytes=info.file_size)
+                    elif not name.endswith('/'):
+                        zipdoc.extract(info, self.write_dir)
+                        if timed:
+                            record_stage(self, 'extract', start, part=name,
+                                         bytes=info.file_size)
         else:
-            shutil.copytree(TEMPLATE_DIR, self.write_dir)
+            for dirpath, dirnames, filenames in os.walk(TEMPLATE_DIR):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    parts.append((os.path.relpath(path, TEMPLATE_DIR),
+                                  etree.parse(path, parser).getroot()))
             
             self.rels = write_files.write_rels()
             self.xmlfiles[self.rels] = os.path.join('_rels', '.rels')
@@ -105,70 +268,74 @@ class Docx():
             self.contenttypes = write_files.write_content_types()
             self.xmlfiles[self.contenttypes] = '[Content_Types].xml'
             
-        for root, dirs, filenames in os.walk(self.write_dir):
-            for file in filenames:
-                if file[-4:] == '.xml' or file[-5:] == '.rels':
-                    absdir = os.path.abspath(os.path.join(root, file))
-                    docstr = io.open(absdir, 'r', encoding='utf8')
-                    relpath = os.path.relpath(absdir, self.write_dir)
-                    xmlfile = (etree.fromstring(docstr.read().encode('utf_8')))
-                    if file == '[Content_Types].xml':
-                        self.contenttypes = xmlfile
-                        self.xmlfiles[self.contenttypes] = relpath
-                        # update self.contenttypes, as needed
-                        filetypes = {'gif':  'image/gif',
-                        'jpeg': 'image/jpeg',
-                        'jpg':  'image/jpeg',
-                        'png':  'image/png',
-                        'rels': 'application/vnd.openxmlformats-package'
-                                '.relationships+xml',
-                        'xml':  'application/xml'}
-                        default_elements = [child for child
-                        in self.contenttypes.iterchildren()
-                        if 'Default' in child.tag] 
-                        for key, value in filetypes.items():
-                            missing_filetype = True
-                            for child in default_elements:
-                                if key == child.items()[0][1]:
-                                    missing_filetype = False
-                            if missing_filetype:
-                                default_element = makeelement('Default',
-                                nsprefix=None,
-                                attributes={'Extension': key,
-                                'ContentType': value})
-                                self.contenttypes.append(default_element)
-                    elif file == 'app.xml':
-                        self.app = xmlfile
-                        self.xmlfiles[self.app] = relpath
-                    elif file == 'comments.xml':
-                        self.comments = xmlfile
-                        self.xmlfiles[self.comments] = relpath
-                    elif file == 'core.xml': 
-                        self.core = xmlfile
-                        self.xmlfiles[self.core] = relpath
-                    elif file == 'document.xml': 
-                        self.document = xmlfile
-                        self.xmlfiles[self.document] = relpath
-                    elif file == 'document.xml.rels': 
-                        self.relationships = xmlfile
-                        self.xmlfiles[self.relationships] = relpath	
-                    elif file == 'fontTable.xml': 
-                        self.fontTable = xmlfile
-                        self.xmlfiles[self.fontTable] = relpath
-                    elif file == 'settings.xml': 
-                        self.styles = xmlfile
-                        self.xmlfiles[self.styles] = relpath						
-                    elif file == 'styles.xml': 
-                        self.styles = xmlfile
-                        self.xmlfiles[self.styles] = relpath
-                    elif file == 'stylesWithEffects.xml': 
-                        self.stylesWithEffects = xmlfile
-                        self.xmlfiles[self.stylesWithEffects] = relpath		
-                    elif file == 'webSettings.xml': 
-                        self.webSettings = xmlfile
-                        self.xmlfiles[self.webSettings] = relpath	
+        for relpath, xmlfile in parts:
+            file = os.path.basename(relpath)
+            if file == '[Content_Types].xml':
+                self.contenttypes = xmlfile
+                self.xmlfiles[self.contenttypes] = relpath
+                # update self.contenttypes, as needed
+                filetypes = {'gif':  'image/gif',
+                'jpeg': 'image/jpeg',
+                'jpg':  'image/jpeg',
+                'png':  'image/png',
+                'rels': 'application/vnd.openxmlformats-package'
+                        '.relationships+xml',
+                'xml':  'application/xml'}
+                default_elements = [child for child
+                in self.contenttypes.iterchildren()
+                if 'Default' in child.tag] 
+                for key, value in filetypes.items():
+                    missing_filetype = True
+                    for child in default_elements:
+                        if key == child.items()[0][1]:
+                            missing_filetype = False
+                    if missing_filetype:
+                        default_element = makeelement('Default',
+                        nsprefix=None,
+                        attributes={'Extension': key,
+                        'ContentType': value})
+                        self.contenttypes.append(default_element)
+            elif file == 'app.xml':
+                self.app = xmlfile
+                self.xmlfiles[self.app] = relpath
+            elif file == 'comments.xml':
+                self.comments = xmlfile
+                self.xmlfiles[self.comments] = relpath
+            elif file == 'numbering.xml':
+                self.numbering = xmlfile
+                self.xmlfiles[self.numbering] = relpath
+            elif file == 'core.xml': 
+                self.core = xmlfile
+                self.xmlfiles[self.core] = relpath
+            elif file == 'document.xml': 
+                self.document = xmlfile
+                self.xmlfiles[self.document] = relpath
+            elif file == 'document.xml.rels': 
+                self.relationships = xmlfile
+                self.xmlfiles[self.relationships] = relpath	
+            elif file == 'fontTable.xml': 
+                self.fontTable = xmlfile
+                self.xmlfiles[self.fontTable] = relpath
+            elif file == 'settings.xml': 
+                self.settings = xmlfile
+                self.xmlfiles[self.settings] = relpath
+            elif file == 'styles.xml': 
+                self.styles = xmlfile
+                self.xmlfiles[self.styles] = relpath
+            elif file == 'stylesWithEffects.xml': 
+                self.stylesWithEffects = xmlfile
+                self.xmlfiles[self.stylesWithEffects] = relpath		
+            elif file == 'webSettings.xml': 
+                self.webSettings = xmlfile
+                self.xmlfiles[self.webSettings] = relpath	
+            else:
+                # Parts without an attribute, such as headers and themes,
+                # are still written back by save()
+                self.xmlfiles[xmlfile] = relpath
         self.body = self.document.xpath('/w:document/w:body',
                                         namespaces=NSPREFIXES)[0]
+        if timed:
+            record_stage(self, 'open', open_start)
         
     def get_body(self):
         print('Warning: This method is deprecated and will be removed at some '
@@ -180,6 +347,9 @@ class Docx():
         '''Search each paragraph for a regex, returns first matching
         element object or None if nothing found. Will return the
         first element if match spans multiple text elements.'''
+        timed = instrumented
+        if timed:
+            stage_start = time.perf_counter()
         searchre = re.compile(search)
         result = None
         if ignore_runs:
@@ -222,8 +392,43 @@ class Docx():
                         result = result.getparent()
                 else:
                     raise
+        if timed:
+            record_stage(self, 'search', stage_start)
         return result
-        
+
+    def find_all(self, search):
+        '''Search each paragraph for a regex, yielding a (paragraph, start,
+        end) tuple for every match, where start and end are character
+        offsets into the paragraph's text as returned by get_text.'''
+        searchre = re.compile(search)
+        for paragraph in self.document.iter('{' + NSPREFIXES['w'] + '}p'):
+            for match in searchre.finditer(get_text(paragraph)):
+                yield paragraph, match.start(), match.end()
+
+    def format_matches(self, search, **kwargs):
+        '''Applies modify_font, with the given keyword arguments, to
+        every match of a regex in the document and returns the number
+        of matches. Runs are split exactly at the match boundaries, and
+        the document is traversed once no matter how many matches. The
+        text of a text box is searched as its own paragraph rather than
+        as part of the paragraph it is anchored in.'''
+        searchre = re.compile(search)
+        run_list = []
+        count = 0
+        for paragraph in self.document.iter('{' + NSPREFIXES['w'] + '}p'):
+            text_index = None
+            text = ''.join(run_text(run) for run in paragraph_runs(paragraph))
+            for match in searchre.finditer(text):
+                if match.start() == match.end():
+                    continue
+                if text_index is None:
+                    text_index = TextIndex(paragraph, own_runs=True)
+                run_list.extend(text_index.runs(match.start(), match.end()))
+                count += 1
+        if run_list:
+            modify_font(run_list, **kwargs)
+        return count
+
     def replace(self, search, replace, ignore_runs=True):
         '''Replace all occurrences of string with a different string.
         If ignore_runs is true, the function will ignore separate run
@@ -232,6 +437,9 @@ class Docx():
         formatting elements within a paragraph such as tabs, which
         may cause unexpected results. Set ignore_runs to false if you
         want a more conservative search.'''
+        timed = instrumented
+        if timed:
+            stage_start = time.perf_counter()
         searchre = re.compile(search)
         if ignore_runs:
             for paragraph_element in self.document.iter('{' + NSPREFIXES['w'] +
@@ -310,6 +518,8 @@ class Docx():
             for element in self.document.iter('{' + NSPREFIXES['w'] + '}t'):
                 if element.text and searchre.search(element.text):
                     element.text = re.sub(search, replace, element.text)
+        if timed:
+            record_stage(self, 'replace', stage_start)
                         
     def clean(self):
         '''Remove empty text and run elements'''
@@ -329,9 +539,12 @@ class Docx():
         else:
             style = makeelement('style', attributes={'styleId': styleId, 
             'type': type})
+        if name:
+            style.append(makeelement('name', attributes={'val': name}))
         style.append(makeelement('pPr'))
         style.append(makeelement('rPr'))
         self.styles.append(style)
+        self.style_registry = None
         return style
         
     def set_margins(self, left='', right='', top='', bottom='', header='',
@@ -354,7 +567,7 @@ class Docx():
         if docdefaults is None:
             docdefaults = makeelement('docDefaults')
             self.styles.insert(0, docdefaults)
-        pprdefault = self.styles.find('{' + NSPREFIXES['w'] + '}pPrDefault')
+        pprdefault = docdefaults.find('{' + NSPREFIXES['w'] + '}pPrDefault')
         if pprdefault is None:
             pprdefault = makeelement('pPrDefault')
             docdefaults.append(pprdefault)
@@ -364,6 +577,7 @@ class Docx():
             self.styles.iterchildren('{' + NSPREFIXES['w'] + '}style')])
         modify_paragraph(elements_to_modify, indent=indent,
         spacing=spacing, pstyle=pstyle, justification=justification)
+        self.style_registry = None
 
     def modify_font_defaults(self, name='default', size='default', 
     underline='default', color='default', highlight='default',
@@ -376,7 +590,7 @@ class Docx():
         if docdefaults is None:
             docdefaults = makeelement('docDefaults')
             self.styles.insert(0, docdefaults)
-        rprdefault = self.styles.find('{' + NSPREFIXES['w'] + '}rPrDefault')
+        rprdefault = docdefaults.find('{' + NSPREFIXES['w'] + '}rPrDefault')
         if rprdefault is None:
             rprdefault = makeelement('rPrDefault')
             docdefaults.append(rprdefault)
@@ -389,7 +603,133 @@ class Docx():
         strikethrough=strikethrough, subscript=subscript,
         superscript=superscript, bold=bold, italics=italics, shadow=shadow,
         smallcaps=smallcaps, allcaps=allcaps, hidden=hidden)
+        self.style_registry = None
+
+    def compact_formatting(self, min_count=2):
+        '''Replaces direct formatting that is repeated in at least
+        min_count paragraphs or runs with generated paragraph and
+        character styles, which makes document.xml much smaller. Empty
+        pPr and rPr elements are removed. Run formatting with a toggle
+        property (such as bold) that the paragraph's style also sets is
+        left alone, because in a character style it would toggle the
+        property off instead of setting it. Returns the new styleIds.'''
+        registry = self.get_style_registry()
+        paragraph_groups = collections.OrderedDict()
+        run_groups = collections.OrderedDict()
+        for paragraph in self.body.iter('{' + NSPREFIXES['w'] + '}p'):
+            pPr = paragraph.find('{' + NSPREFIXES['w'] + '}pPr')
+            if pPr is not None:
+                if not len(pPr):
+                    paragraph.remove(pPr)
+                else:
+                    key = formatting_key(pPr, 'pStyle', ('rPr',),
+                                         ('sectPr', 'pPrChange'))
+                    if key is not None:
+                        paragraph_groups.setdefault(key, []).append(pPr)
+            style_toggles = TOGGLE_PROPERTIES.intersection(registry.resolve(
+            registry.paragraph_style_id(paragraph))[1])
+            # Text box runs are grouped with their own paragraph's style
+            for run in paragraph_runs(paragraph):
+                if not len(run) or run[0].tag != '{' + NSPREFIXES['w'] + '}rPr':
+                    continue
+                rPr = run[0]
+                if not len(rPr):
+                    run.remove(rPr)
+                    continue
+                if style_toggles and any(isinstance(child.tag, str) and
+                child.tag.rpartition('}')[2] in style_toggles for child in rPr):
+                    continue
+                key = formatting_key(rPr, 'rStyle', (), ('rPrChange',))
+                if key is not None:
+                    run_groups.setdefault(key, []).append(rPr)
+        style_ids = set(self.get_style_registry().style_elements)
+        new_style_ids = []
+        for groups, style_type, properties_tag, style_tag, kept_tags in (
+        (paragraph_groups, 'paragraph', 'pPr', 'pStyle', ('rPr',)),
+        (run_groups, 'character', 'rPr', 'rStyle', ())):
+            number = 0
+            kept_tags = set('{' + NSPREFIXES['w'] + '}' + tag for tag in
+                            kept_tags)
+            for (base_id, content), elements in groups.items():
+                if len(elements) < min_count:
+                    continue
+                number += 1
+                while 'Compact' + style_type.title() + str(number) in style_ids:
+                    number += 1
+                style_id = 'Compact' + style_type.title() + str(number)
+                style_ids.add(style_id)
+                style = self.add_style(style_id, style_type,
+                name='Compact {0} {1}'.format(style_type, number))
+                if base_id is None and style_type == 'paragraph':
+                    # Paragraphs without a pStyle use the default style, so
+                    # the new style must inherit from it
+                    base_id = registry.default_paragraph_style
+                if base_id is not None:
+                    style.find('{' + NSPREFIXES['w'] + '}name').addnext(
+                    makeelement('basedOn', attributes={'val': base_id}))
+                # add_style creates both an empty pPr and rPr
+                for child in list(style)[-2:]:
+                    if child.tag != '{' + NSPREFIXES['w'] + '}' + properties_tag:
+                        style.remove(child)
+                    else:
+                        child.extend(copy.deepcopy(element) for element in
+                        elements[0] if element.tag not in kept_tags and
+                        element.tag != '{' + NSPREFIXES['w'] + '}' + style_tag)
+                for element in elements:
+                    element[:] = ([makeelement(style_tag,
+                    attributes={'val': style_id})] + [child for child in
+                    element if child.tag in kept_tags])
+                new_style_ids.append(style_id)
+        return new_style_ids
+
+    def get_style_registry(self):
+        '''Returns the StyleRegistry for self.styles, building it if the
+        styles have been changed through this object since it was last
+        used. Set self.style_registry to None after editing self.styles
+        directly.'''
+        if self.style_registry is None:
+            self.style_registry = StyleRegistry(self.styles)
+        return self.style_registry
+
+    def effective_run_props(self, run):
+        '''Returns the effective properties of a run as a dictionary
+        mapping each rPr child's tag name to a dictionary of its
+        attributes, combining docDefaults, the paragraph style, the
+        character style and direct formatting. The attribute
+        dictionaries are shared and should not be modified.'''
+        paragraph = run.getparent()
+        while (paragraph is not None and
+        paragraph.tag != '{' + NSPREFIXES['w'] + '}p'):
+            paragraph = paragraph.getparent()
+        registry = self.get_style_registry()
+        return registry.run_properties(run, registry.paragraph_style_id(
+        paragraph) if paragraph is not None else None)
+
+    def effective_paragraph_props(self, paragraph):
+        '''Returns the effective pPr properties of a paragraph, in the
+        same form as effective_run_props'''
+        registry = self.get_style_registry()
+        properties = dict(registry.resolve(
+        registry.paragraph_style_id(paragraph))[0])
+        return merge_properties(properties, paragraph.find(
+        '{' + NSPREFIXES['w'] + '}pPr'))
+
+    def iter_run_props(self):
+        '''Yields a (run, properties) tuple for every run in the body,
+        where properties is as returned by effective_run_props. Each
+        paragraph's style is only looked up once.'''
+        registry = self.get_style_registry()
+        for paragraph in self.body.iter('{' + NSPREFIXES['w'] + '}p'):
+            style_id = registry.paragraph_style_id(paragraph)
+            for run in paragraph.iter('{' + NSPREFIXES['w'] + '}r'):
+                yield run, registry.run_properties(run, style_id)
         
+    def iter_tables(self):
+        '''Yields every table element in the body in document order,
+        including tables nested in other tables. Use iter_table_rows,
+        table_to_csv or table_to_array to read their contents.'''
+        return self.body.iter('{' + NSPREFIXES['w'] + '}tbl')
+
     def get_section_properties(self):
         '''Returns the sectPr element at the end of the body, creates
         the element first if one is not found'''
@@ -414,45 +754,227 @@ class Docx():
         # that paragraph's text.
         for para in paralist:
             paratext = ''
-            for element in para.iter('{' + NSPREFIXES['w'] + '}t'):
+            for element in para.iter('{' + NSPREFIXES['w'] + '}t',
+                                     '{' + NSPREFIXES['w'] + '}tab'):
                 # Find t (text) elements
-                if element.text:
-                    paratext += paratext
-                elif element.tag == '{' + NSPREFIXES['w'] + '}tab':
+                if element.tag == '{' + NSPREFIXES['w'] + '}t':
+                    if element.text:
+                        paratext += element.text
+                elif (element.getparent().tag !=
+                '{' + NSPREFIXES['w'] + '}tabs'):
                     paratext += '\t'
             # Add our completed paragraph text to the list of paragraph text
             if len(paratext):
                 paratextlist.append(paratext)
         return paratextlist
-    
+
+    def add_comments(self, annotations, initials=''):
+        '''Adds a comment for each (anchor, text, author) item in
+        annotations and returns the list of new comment ids. An anchor
+        may be a paragraph, run or text element, a (start, end) tuple of
+        such elements, or a (paragraph, start, end) tuple of character
+        offsets like those yielded by find_all. Unlike add_comment, the
+        comments part is only set up once for the whole batch and the
+        anchors are not checked for ordering.'''
+        next_id = int(write_files.setup_comments(self))
+        date = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:00Z')
+        id_list = []
+        text_indexes = {}
+        for anchor, text, author in annotations:
+            id_number = str(next_id)
+            next_id += 1
+            if isinstance(anchor, tuple) and len(anchor) == 3:
+                paragraph, start, end = anchor
+                if paragraph not in text_indexes:
+                    text_indexes[paragraph] = TextIndex(paragraph)
+                runs = text_indexes[paragraph].runs(start, end)
+                if not runs:
+                    raise ValueError('comment anchor must contain text')
+                start, end = runs[0], runs[-1]
+            elif isinstance(anchor, tuple):
+                start, end = anchor
+            else:
+                start = end = anchor
+            mark_comment(start, end, id_number)
+            self.comments.append(make_comment(id_number, text, author,
+                                              initials, date))
+            id_list.append(id_number)
+        return id_list
+
+    def iter_comments(self):
+        '''Yields a CommentInfo tuple of (id, author, date, text,
+        anchored_text, paragraph) for every comment in the document,
+        where paragraph is the index of the paragraph the comment's range
+        starts in. The body is walked once, and each comment is yielded
+        as soon as its commentRangeEnd element is reached.'''
+        if self.comments is None:
+            return
+        comment_info = collections.OrderedDict()
+        for comment in self.comments.iterchildren(
+        '{' + NSPREFIXES['w'] + '}comment'):
+            comment_info[comment.get('{' + NSPREFIXES['w'] + '}id')] = (
+            comment.get('{' + NSPREFIXES['w'] + '}author', ''),
+            comment.get('{' + NSPREFIXES['w'] + '}date', ''),
+            '\n'.join(get_text(para) for para in
+            comment.iter('{' + NSPREFIXES['w'] + '}p')))
+        open_ranges = collections.OrderedDict()
+        first_paragraph = {}
+        paragraph_index = -1
+        for element in self.body.iter('{' + NSPREFIXES['w'] + '}p',
+        '{' + NSPREFIXES['w'] + '}t', '{' + NSPREFIXES['w'] + '}tab',
+        '{' + NSPREFIXES['w'] + '}commentRangeStart',
+        '{' + NSPREFIXES['w'] + '}commentRangeEnd',
+        '{' + NSPREFIXES['w'] + '}commentReference'):
+            tag = element.tag[len(NSPREFIXES['w']) + 2:]
+            if tag == 'p':
+                paragraph_index += 1
+                for text_list in open_ranges.values():
+                    if text_list:
+                        text_list.append('\n')
+            elif tag == 't':
+                if element.text:
+                    for text_list in open_ranges.values():
+                        text_list.append(element.text)
+            elif tag == 'tab':
+                if element.getparent().tag == '{' + NSPREFIXES['w'] + '}tabs':
+                    continue
+                for text_list in open_ranges.values():
+                    text_list.append('\t')
+            else:
+                id_number = element.get('{' + NSPREFIXES['w'] + '}id')
+                first_paragraph.setdefault(id_number, paragraph_index)
+                if tag == 'commentRangeStart':
+                    open_ranges[id_number] = []
+                elif tag == 'commentRangeEnd' and id_number in comment_info:
+                    author, date, text = comment_info.pop(id_number)
+                    yield CommentInfo(id_number, author, date, text,
+                    ''.join(open_ranges.pop(id_number, [])),
+                    first_paragraph[id_number])
+        # Comments without a complete range in the body
+        for id_number, (author, date, text) in comment_info.items():
+            yield CommentInfo(id_number, author, date, text,
+            ''.join(open_ranges.get(id_number, [])),
+            first_paragraph.get(id_number))
+
+    def make_list(self, start, end=None, list_type='numbered', level=0,
+    restart=True):
+        '''Turns the paragraphs in a range of body children into a list and
+        returns its numId. start and end are either positions in the body,
+        which select children like a slice, or paragraph elements, in which
+        case both are included. level is a list level from 0 to 8, or a
+        sequence of levels with one item per paragraph. list_type is
+        'numbered' or 'bullet'; the numbering definition for each type is
+        created in numbering.xml on first use and reused afterwards.'''
+        if isinstance(start, int):
+            elements = self.body[start:end]
+        else:
+            elements = sibling_range(start, start if end is None else end)
+        if self.numbering_registry is None:
+            self.numbering_registry = NumberingRegistry(
+            write_files.setup_numbering(self))
+        numId = self.numbering_registry.num(list_type, restart)
+        apply_numbering([element for element in elements if
+        element.tag == '{' + NSPREFIXES['w'] + '}p'], numId, level)
+        return numId
+
+    def reconcile_styles(self, fromdoc):
+        '''Adds the styles of another Docx that this document lacks and
+        returns a dictionary mapping each of fromdoc's styleIds to the
+        styleId to use in this document. Identical styles are reused,
+        found by styleId or by content, and styles whose styleId is
+        already used for different formatting are added under a new
+        styleId. basedOn, next and link references are updated.'''
+        registry = self.get_style_registry()
+        source = fromdoc.get_style_registry().style_elements
+        style_map = {}
+        added_styles = []
+        def map_style(style_id):
+            if style_id in style_map:
+                return style_map[style_id]
+            # Guards against basedOn cycles until the style is mapped
+            style_map[style_id] = style_id
+            style = copy.deepcopy(source[style_id])
+            based_on = style.find('{' + NSPREFIXES['w'] + '}basedOn')
+            if (based_on is not None and
+            based_on.get('{' + NSPREFIXES['w'] + '}val') in source):
+                based_on.set('{' + NSPREFIXES['w'] + '}val', map_style(
+                based_on.get('{' + NSPREFIXES['w'] + '}val')))
+            key = style_key(style)
+            if (style_id in registry.style_elements and
+            registry.style_key(style_id) == key):
+                new_id = style_id
+            elif key in registry.content_index():
+                new_id = registry.content_index()[key]
+            else:
+                new_id = style_id
+                number = 1
+                while new_id in registry.style_elements:
+                    number += 1
+                    new_id = '{0}_{1}'.format(style_id, number)
+                if new_id != style_id:
+                    style.set('{' + NSPREFIXES['w'] + '}styleId', new_id)
+                    name = style.find('{' + NSPREFIXES['w'] + '}name')
+                    if name is not None:
+                        name.set('{' + NSPREFIXES['w'] + '}val', '{0} ({1})'
+                        .format(name.get('{' + NSPREFIXES['w'] + '}val'),
+                                number))
+                # This document keeps its own default styles
+                style.attrib.pop('{' + NSPREFIXES['w'] + '}default', None)
+                registry.add(style, key)
+                added_styles.append(style)
+            style_map[style_id] = new_id
+            return new_id
+        for style_id in source:
+            map_style(style_id)
+        for style in added_styles:
+            for tag in ('next', 'link'):
+                reference = style.find('{' + NSPREFIXES['w'] + '}' + tag)
+                if (reference is not None and
+                reference.get('{' + NSPREFIXES['w'] + '}val') in style_map):
+                    reference.set('{' + NSPREFIXES['w'] + '}val', style_map[
+                    reference.get('{' + NSPREFIXES['w'] + '}val')])
+        return style_map
+
     def merge(self, docpath, page_break=True):
         '''Appends a .docx to the end of this document. docpath can
         either be a Docx object or a file path. This method will likely
         break if both documents possess the same type of elements that
         require id mapping such as lists or comments. Pictures and other
-        <w: drawing> elements, however, should work 100% of the time.'''
+        <w: drawing> elements, however, should work 100% of the time.
+        Styles are reconciled with reconcile_styles.'''
         if isinstance(docpath, Docx):
             fromdoc = docpath
         else:
             fromdoc = Docx(docpath)
-        # Update relationship Ids
+        # Map relationship Ids and styleIds, then update both in a single
+        # pass over the merged body
+        rId_map = {}
+        targets = dict((relationship.get('Target'), relationship.get('Id'))
+                       for relationship in self.relationships)
         for relationship in fromdoc.relationships:
-            old_rId = relationship.values()[0]
-            relationship_type = relationship.values()[1]
-            relationship_target = relationship.values()[2]
+            old_rId = relationship.get('Id')
             new_rId = helper_functions.add_relationship(self,
-                                                        relationship_target,
-                                                        relationship_type)
+                                                        relationship.get('Target'),
+                                                        relationship.get('Type'))
             if new_rId is None:
-                new_rId = old_rId
-            for element in fromdoc.body.iter():
-                for item in element.items():
-                    attribute = item[0]
-                    value = item[1]
-                    if old_rId == value:
-                        element.set(attribute, new_rId)
+                new_rId = targets.get(relationship.get('Target'), old_rId)
+            rId_map[old_rId] = new_rId
+        style_map = self.reconcile_styles(fromdoc)
+        style_tags = set('{' + NSPREFIXES['w'] + '}' + tag for tag in
+                         ('pStyle', 'rStyle', 'tblStyle'))
+        for element in fromdoc.body.iter():
+            if not isinstance(element.tag, str):
+                continue
+            if element.tag in style_tags:
+                value = element.get('{' + NSPREFIXES['w'] + '}val')
+                if value in style_map:
+                    element.set('{' + NSPREFIXES['w'] + '}val', style_map[value])
+            for attribute, value in element.items():
+                if (value in rId_map and
+                attribute.startswith('{' + NSPREFIXES['r'] + '}')):
+                    element.set(attribute, rId_map[value])
         if not os.path.isdir(self.media_dir):
-            os.mkdir(self.media_dir)
+            os.makedirs(self.media_dir)
         tofiles = []
         for (dirpath, dirnames, filenames) in os.walk(self.write_dir):
             relpath = dirpath[len(self.write_dir) + 1:]
@@ -474,10 +996,16 @@ class Docx():
             else:
                 for file in filenames:
                     if not os.path.isdir(os.path.join(self.write_dir, relpath)):
-                        os.mkdir(os.path.join(self.write_dir, relpath))
+                        os.makedirs(os.path.join(self.write_dir, relpath))
                     if os.path.join(relpath, file) not in tofiles:  
                         shutil.copyfile(os.path.join(fromdoc.write_dir, relpath, file),
                         os.path.join(self.write_dir, relpath, file))
+        # XML parts are kept in xmlfiles rather than on disk, so copy over
+        # those this document lacks, such as headers
+        relpaths = set(self.xmlfiles.values())
+        for element, relpath in fromdoc.xmlfiles.items():
+            if relpath not in relpaths:
+                self.xmlfiles[copy.deepcopy(element)] = relpath
         # Update Content Types if necessary
         for type in fromdoc.contenttypes.iterchildren():
             type_string = etree.tostring(type)
@@ -506,39 +1034,989 @@ class Docx():
             r.insert(0, makeelement('lastRenderedPageBreak'))
         self.body.extend(fromdoc.body.iterchildren())
       
-    def save(self, output):
-        '''Saves the Docx to the output path provided.'''
-        docxfile = zipfile.ZipFile(output, mode='w',
-        compression=zipfile.ZIP_DEFLATED)
-        # Move to the template data path
-        prev_dir = os.path.abspath('.')  # save previous working dir
-        os.chdir(self.write_dir)
-        # Write changes made to xml files in write directory between __init__()
-        # and save()
-        for xmlfile, relpath in self.xmlfiles.items():
-            absolutepath = os.path.split(
-                           os.path.join(self.write_dir, relpath))[0]
-            if not os.path.isdir(absolutepath):
-                os.mkdir(absolutepath)
-            newdoc = io.open(relpath, 'w')
-            newdoc.write(etree.tostring(
-            xmlfile, xml_declaration=True).decode(encoding='UTF-8'))
-            newdoc.close()
+    def save(self, output, compresslevel=None, store_compressed=True,
+             workers=1, deterministic=False):
+        '''Saves the Docx to the output path or file-like object provided.
+        compresslevel sets the deflate level, 0 to 9, of XML parts and
+        other compressible files. If store_compressed is true, files that
+        are already compressed, such as JPEG and PNG images, are stored
+        as they are rather than deflated again. With more than one
+        worker, parts are serialized in a thread pool while earlier parts
+        are being compressed. If deterministic is true, entries are
+        written in sorted order with fixed timestamps and attributes, so
+        documents with the same content produce identical files.'''
+        timed = instrumented
+        if timed:
+            save_start = time.perf_counter()
+        # XML parts are serialized straight into the zip file; other files,
+        # such as media, are read from write_dir
+        entries = [(relpath.replace(os.sep, '/'), xmlfile) for xmlfile, relpath
+                   in self.xmlfiles.items()]
+        part_names = set(name for name, xmlfile in entries)
         files_to_ignore = ['.DS_Store']  # nuisance from some os's
-        for dirpath, dirnames, filenames in os.walk('.'):
+        for dirpath, dirnames, filenames in os.walk(self.write_dir):
             for filename in filenames:
                 if filename in files_to_ignore:
                     continue
-                templatefile = os.path.join(dirpath, filename)
-                archivename = templatefile[2:]
-                docxfile.write(templatefile, archivename)
-        docxfile.close()
-        os.chdir(prev_dir)  # restore previous working dir
+                path = os.path.join(dirpath, filename)
+                archivename = os.path.relpath(path,
+                              self.write_dir).replace(os.sep, '/')
+                if archivename not in part_names:
+                    entries.append((archivename, path))
+        if deterministic:
+            # [Content_Types].xml goes first, as Word itself writes it
+            entries.sort(key=lambda entry: (entry[0] != '[Content_Types].xml',
+                                            entry[0]))
+        if workers > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(workers)
+            loaded = load_entries(executor, entries, workers * 2)
+        else:
+            executor = None
+            loaded = map(load_entry, entries)
+        docxfile = zipfile.ZipFile(output, mode='w',
+        compression=zipfile.ZIP_DEFLATED)
+        try:
+            for archivename, data, start, end in loaded:
+                if timed and start is not None:
+                    record_stage(self, 'serialize', start, end,
+                                 part=archivename, bytes=len(data))
+                if (store_compressed and os.path.splitext(archivename)[1]
+                .lower() in COMPRESSED_EXTENSIONS):
+                    compress_type = zipfile.ZIP_STORED
+                else:
+                    compress_type = zipfile.ZIP_DEFLATED
+                if deterministic:
+                    info = zipfile.ZipInfo(archivename, FIXED_DATE_TIME)
+                    info.create_system = 0
+                else:
+                    info = zipfile.ZipInfo(archivename,
+                                           time.localtime(time.time())[:6])
+                info.external_attr = 0o644 << 16
+                info.compress_type = compress_type
+                if timed:
+                    start = time.perf_counter()
+                docxfile.writestr(info, data, compresslevel=compresslevel)
+                if timed:
+                    record_stage(self, 'compress', start, part=archivename,
+                                 bytes=info.file_size,
+                                 compressed_bytes=info.compress_size)
+        finally:
+            docxfile.close()
+            if executor is not None:
+                executor.shutdown()
         try:
             shutil.rmtree(self.write_dir, onerror=helper_functions.remove_readonly)
         except FileNotFoundError:
             pass
+        if timed:
+            record_stage(self, 'save', save_start)
+
+    @staticmethod
+    def open_readonly(file, runs=True):
+        '''Returns a ReadOnlyDocx with lightweight views of the paragraphs
+        and tables of a docx file, for reading documents without building
+        a tree. If runs is False, paragraphs get no run views.'''
+        return ReadOnlyDocx(file, runs)
+
+    def save_async(self, output=None, executor=None, **options):
+        '''Returns an awaitable that saves the Docx on an executor, see
+        oodocx.aio.save. With no output the docx file's bytes are returned.
+        options are passed on to save.'''
+        from oodocx import aio
+        return aio.save(self, output, executor, **options)
+
+    def split(self, predicate, output=None, workers=None, **save_options):
+        '''Splits the document before every body element for which
+        predicate(element) is true, such as oodocx.split.heading_start()
+        or oodocx.split.section_start. Each piece only gets the media,
+        relationships, styles, numbering and comments it uses. With no
+        output a list of new Docx objects is returned; otherwise output
+        is a format string like 'part{0}.docx' or a function of the
+        piece's index, the pieces are saved on a pool of workers threads
+        and the list of outputs is returned. See oodocx.split.split.'''
+        from oodocx import split
+        return split.split(self, predicate, output, workers, **save_options)
+
+    def compare(self, new, redline=False, author='oodocx'):
+        '''Returns a list of oodocx.diff.Change tuples describing how the
+        paragraphs of the Docx new differ from this document's. If
+        redline is True, new is also marked up with the changes as
+        tracked insertions and deletions by author. See oodocx.diff.'''
+        from oodocx import diff
+        if redline:
+            return diff.redline(self, new, author)
+        return diff.compare(self, new)
+
+
+class DocxWriter():
+    '''Writes a new docx file without keeping its body in memory. The
+    package is created from the template, then paragraphs, tables and
+    other body elements passed to write() are serialized straight into
+    word/document.xml inside the zip file, so memory use is bounded by
+    the size of one element. Use it as a context manager:
+
+        with DocxWriter('report.docx') as writer:
+            for line in lines:
+                writer.write(paragraph(line))
+
+    Only the body is streamed; features that need other parts updated,
+    such as pictures or comments, are not supported.'''
+    def __init__(self, output, section_properties=None):
+        self.output = output
+        self.section_properties = section_properties
+        self.stack = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        template = etree.parse(os.path.join(TEMPLATE_DIR, 'word',
+                               'document.xml'), get_parser()).getroot()
+        if self.section_properties is None:
+            self.section_properties = template.find(
+            '{0}body/{0}sectPr'.format('{' + NSPREFIXES['w'] + '}'))
+        self.stack = contextlib.ExitStack()
+        docxfile = self.stack.enter_context(zipfile.ZipFile(self.output,
+        mode='w', compression=zipfile.ZIP_DEFLATED))
+        docxfile.writestr('[Content_Types].xml', etree.tostring(
+        write_files.write_content_types(), xml_declaration=True,
+        encoding='UTF-8', standalone=True))
+        docxfile.writestr('_rels/.rels', etree.tostring(
+        write_files.write_rels(), xml_declaration=True, encoding='UTF-8',
+        standalone=True))
+        for dirpath, dirnames, filenames in os.walk(TEMPLATE_DIR):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                archivename = os.path.relpath(path, TEMPLATE_DIR).replace(
+                              os.sep, '/')
+                if archivename != 'word/document.xml':
+                    docxfile.write(path, archivename)
+        # The size of a streamed body is not known in advance, so allow
+        # it to grow past the 4 GiB limit of a plain zip entry
+        document = self.stack.enter_context(docxfile.open('word/document.xml',
+                                            mode='w', force_zip64=True))
+        xmlfile = self.stack.enter_context(etree.xmlfile(document,
+                                                         encoding='UTF-8'))
+        xmlfile.write_declaration(standalone=True)
+        self.stack.enter_context(xmlfile.element(template.tag,
+        template.attrib, nsmap=template.nsmap))
+        self.stack.enter_context(xmlfile.element(
+        '{' + NSPREFIXES['w'] + '}body'))
+        self.xmlfile = xmlfile
+        # Elements made with makeelement carry no prefixes of their own;
+        # moving them under a parent that maps w gives them the w prefix
+        self.holder = etree.Element('{' + NSPREFIXES['w'] + '}body',
+                                    nsmap={'w': NSPREFIXES['w']})
+
+    def write(self, *elements):
+        '''Appends elements, such as paragraphs or tables, to the body'''
+        self.extend(elements)
+
+    def extend(self, elements):
+        '''Appends every element of an iterable to the body, which may be
+        a generator producing them one at a time. Elements that belong to
+        another tree, such as paragraphs of an open Docx, are copied
+        rather than moved out of it.'''
+        holder = self.holder
+        for element in elements:
+            if element.getparent() is not None:
+                element = copy.deepcopy(element)
+            holder.append(element)
+            self.xmlfile.write(element)
+            holder.remove(element)
+
+    def close(self):
+        '''Finishes the body and closes the file'''
+        if self.stack is None:
+            return
+        if self.section_properties is not None:
+            self.extend([self.section_properties])
+        self.stack.close()
+        self.stack = None
+
+
+class RunView():
+    '''The text and formatting of a run, read by iter_blocks'''
+    __slots__ = ('text', 'style', 'bold', 'italic', 'underline')
+
+    def __init__(self, text, style, bold, italic, underline):
+        self.text = text
+        self.style = style
+        self.bold = bold
+        self.italic = italic
+        self.underline = underline
+
+    def __repr__(self):
+        return 'RunView({0!r})'.format(self.text)
+
+
+class ParagraphView():
+    '''The text, paragraph style id, position among the body's blocks and
+    runs of a paragraph, read by iter_blocks. runs is an empty tuple if
+    run views were not requested.'''
+    __slots__ = ('index', 'text', 'style', 'runs')
+
+    def __init__(self, index, text, style, runs):
+        self.index = index
+        self.text = text
+        self.style = style
+        self.runs = runs
+
+    def __repr__(self):
+        return 'ParagraphView({0}, {1!r})'.format(self.index, self.text)
+
+
+class TableView():
+    '''The table style id, position among the body's blocks and cell text
+    of a table, read by iter_blocks. rows holds a list of cell text per
+    row, as produced by iter_table_rows.'''
+    __slots__ = ('index', 'style', 'rows')
+
+    def __init__(self, index, style, rows):
+        self.index = index
+        self.style = style
+        self.rows = rows
+
+    def __repr__(self):
+        return 'TableView({0}, {1} rows)'.format(self.index, len(self.rows))
+
+
+class ReadOnlyDocx():
+    '''A read-only view of the body of a docx file, made by
+    Docx.open_readonly. Paragraphs and tables are read in one pass into
+    blocks, a list of ParagraphView and TableView objects, and the XML is
+    freed as it is read, so the document is never held as a tree. To
+    process documents too large to keep even the views, use iter_blocks.'''
+    def __init__(self, file, runs=True):
+        self.file = file
+        self.blocks = list(iter_blocks(file, runs))
+
+    @property
+    def paragraphs(self):
+        return [block for block in self.blocks
+                if isinstance(block, ParagraphView)]
+
+    @property
+    def tables(self):
+        return [block for block in self.blocks if isinstance(block, TableView)]
+
+    def get_document_text(self):
+        '''Return the raw text of the body paragraphs, as a list of
+        non-empty paragraphs.'''
+        return [paragraph.text for paragraph in self.paragraphs
+                if paragraph.text]
+
+
+class StyleRegistry():
+    '''Indexes the w:style elements of a styles part by styleId and
+    resolves the effective pPr and rPr properties of each style, through
+    its basedOn chain and the docDefaults, once. Property sets are
+    dictionaries mapping tag names to attribute dictionaries.'''
+    def __init__(self, styles):
+        self.styles = styles
+        self.invalidate()
+
+    def invalidate(self):
+        '''Drops all cached styles and resolved properties'''
+        self.style_elements = {}
+        self.default_paragraph_style = None
+        for style in self.styles.iterchildren('{' + NSPREFIXES['w'] + '}style'):
+            style_id = style.get('{' + NSPREFIXES['w'] + '}styleId')
+            self.style_elements[style_id] = style
+            if (style.get('{' + NSPREFIXES['w'] + '}type') == 'paragraph' and
+            style.get('{' + NSPREFIXES['w'] + '}default') in ('1', 'true',
+            'on')):
+                self.default_paragraph_style = style_id
+        ppr_default = self.styles.find('{0}docDefaults/{0}pPrDefault/{0}pPr'
+                                       .format('{' + NSPREFIXES['w'] + '}'))
+        rpr_default = self.styles.find('{0}docDefaults/{0}rPrDefault/{0}rPr'
+                                       .format('{' + NSPREFIXES['w'] + '}'))
+        self.resolved = {None: (merge_properties({}, ppr_default),
+                                merge_properties({}, rpr_default))}
+        self.run_cache = {}
+        self.style_keys = {}
+        self.content_ids = None
+
+    def style_key(self, style_id):
+        '''Returns the memoized style_key of a style'''
+        if style_id not in self.style_keys:
+            self.style_keys[style_id] = style_key(self.style_elements[style_id])
+        return self.style_keys[style_id]
+
+    def content_index(self):
+        '''Returns a dictionary mapping style keys to styleIds, built on
+        first use'''
+        if self.content_ids is None:
+            self.content_ids = {}
+            for style_id in self.style_elements:
+                self.content_ids.setdefault(self.style_key(style_id), style_id)
+        return self.content_ids
+
+    def add(self, style, key=None):
+        '''Appends a style element to the styles part and indexes it,
+        optionally under an extra key, such as the key it had before it
+        was renamed'''
+        self.styles.append(style)
+        style_id = style.get('{' + NSPREFIXES['w'] + '}styleId')
+        self.style_elements[style_id] = style
+        content_index = self.content_index()
+        content_index.setdefault(self.style_key(style_id), style_id)
+        if key is not None:
+            content_index.setdefault(key, style_id)
+
+    def resolve(self, style_id, seen=None):
+        '''Returns a (pPr properties, rPr properties) tuple for a style,
+        including the docDefaults. Unknown styles resolve to the
+        defaults.'''
+        if style_id in self.resolved:
+            return self.resolved[style_id]
+        style = self.style_elements.get(style_id)
+        if style is None:
+            return self.resolved[None]
+        seen = set() if seen is None else seen
+        seen.add(style_id)
+        based_on = style.find('{' + NSPREFIXES['w'] + '}basedOn')
+        if based_on is not None:
+            base_id = based_on.get('{' + NSPREFIXES['w'] + '}val')
+        else:
+            base_id = None
+        if base_id in seen:
+            base_id = None
+        base_ppr, base_rpr = self.resolve(base_id, seen)
+        resolved = (merge_properties(dict(base_ppr),
+                    style.find('{' + NSPREFIXES['w'] + '}pPr')),
+                    merge_properties(dict(base_rpr),
+                    style.find('{' + NSPREFIXES['w'] + '}rPr')))
+        self.resolved[style_id] = resolved
+        return resolved
+
+    def paragraph_style_id(self, paragraph):
+        ppr = paragraph.find('{' + NSPREFIXES['w'] + '}pPr')
+        if ppr is not None:
+            pstyle = ppr.find('{' + NSPREFIXES['w'] + '}pStyle')
+            if pstyle is not None:
+                return pstyle.get('{' + NSPREFIXES['w'] + '}val')
+        return self.default_paragraph_style
+
+    def run_properties(self, run, paragraph_style_id):
+        '''Returns the effective rPr properties of a run inside a
+        paragraph with the given style'''
+        rpr = run.find('{' + NSPREFIXES['w'] + '}rPr')
+        rstyle = None
+        if rpr is not None:
+            rstyle = rpr.find('{' + NSPREFIXES['w'] + '}rStyle')
+            if rstyle is not None:
+                rstyle = rstyle.get('{' + NSPREFIXES['w'] + '}val')
+        key = (paragraph_style_id, rstyle)
+        if key not in self.run_cache:
+            properties = dict(self.resolve(paragraph_style_id)[1])
+            if rstyle is not None:
+                defaults = self.resolved[None][1]
+                for tag, attributes in self.resolve(rstyle)[1].items():
+                    # Skip what the character style only inherited from
+                    # the docDefaults, as the paragraph style may override it
+                    if defaults.get(tag) is not attributes:
+                        properties[tag] = dict(properties.get(tag, {}),
+                                               **attributes)
+            self.run_cache[key] = properties
+        return merge_properties(dict(self.run_cache[key]), rpr)
+
+
+class NumberingRegistry():
+    '''Indexes the abstractNum and num definitions of a numbering part
+    and caches one definition per list type, so that lists can reuse
+    them instead of searching numbering.xml each time'''
+    list_formats = {
+        'numbered': (('decimal', '%{0}.'), ('lowerLetter', '%{0}.'),
+                     ('lowerRoman', '%{0}.')),
+        'bullet': (('bullet', '\u2022'), ('bullet', 'o'),
+                   ('bullet', '\u25aa'))}
+
+    def __init__(self, numbering):
+        self.numbering = numbering
+        self.abstract_ids = {}
+        self.num_ids = {}
+        self.next_abstract_id = 0
+        self.next_num_id = 1
+        for abstract in numbering.iterchildren(
+        '{' + NSPREFIXES['w'] + '}abstractNum'):
+            abstract_id = abstract.get('{' + NSPREFIXES['w'] + '}abstractNumId')
+            self.next_abstract_id = max(self.next_abstract_id,
+                                        int(abstract_id) + 1)
+            name = abstract.find('{' + NSPREFIXES['w'] + '}name')
+            if name is not None:
+                name = name.get('{' + NSPREFIXES['w'] + '}val', '')
+                if name.startswith('oodocx '):
+                    self.abstract_ids[name[7:]] = abstract_id
+        for num in numbering.iterchildren('{' + NSPREFIXES['w'] + '}num'):
+            num_id = num.get('{' + NSPREFIXES['w'] + '}numId')
+            self.next_num_id = max(self.next_num_id, int(num_id) + 1)
+            abstract_id = num[0].get('{' + NSPREFIXES['w'] + '}val')
+            for list_type, value in self.abstract_ids.items():
+                if value == abstract_id:
+                    self.num_ids.setdefault(list_type, num_id)
+
+    def abstract_num(self, list_type):
+        '''Returns the abstractNumId for a list type, creating the
+        abstractNum element on first use'''
+        if list_type in self.abstract_ids:
+            return self.abstract_ids[list_type]
+        if list_type not in self.list_formats:
+            raise ValueError("list_type must be one of: " +
+                             ', '.join(sorted(self.list_formats)))
+        abstract_id = str(self.next_abstract_id)
+        self.next_abstract_id += 1
+        abstract = makeelement('abstractNum',
+                               attributes={'abstractNumId': abstract_id})
+        abstract.append(makeelement('multiLevelType',
+                                    attributes={'val': 'hybridMultilevel'}))
+        abstract.append(makeelement('name',
+                                    attributes={'val': 'oodocx ' + list_type}))
+        formats = self.list_formats[list_type]
+        for level in range(9):
+            numfmt, lvltext = formats[level % len(formats)]
+            lvl = makeelement('lvl', attributes={'ilvl': str(level)})
+            lvl.append(makeelement('start', attributes={'val': '1'}))
+            lvl.append(makeelement('numFmt', attributes={'val': numfmt}))
+            lvl.append(makeelement('lvlText',
+                       attributes={'val': lvltext.format(level + 1)}))
+            lvl.append(makeelement('lvlJc', attributes={'val': 'left'}))
+            pPr = makeelement('pPr')
+            pPr.append(makeelement('ind', attributes={
+                'left': str(720 * (level + 1)), 'hanging': '360'}))
+            lvl.append(pPr)
+            abstract.append(lvl)
+        # abstractNum elements must precede all num elements
+        first_num = self.numbering.find('{' + NSPREFIXES['w'] + '}num')
+        if first_num is not None:
+            first_num.addprevious(abstract)
+        else:
+            self.numbering.append(abstract)
+        self.abstract_ids[list_type] = abstract_id
+        return abstract_id
+
+    def num(self, list_type, restart=True):
+        '''Returns a numId for a list type. If restart is True, a new num
+        element is created so that the list starts counting from one,
+        otherwise the cached num for the list type is reused.'''
+        if not restart and list_type in self.num_ids:
+            return self.num_ids[list_type]
+        abstract_id = self.abstract_num(list_type)
+        num_id = str(self.next_num_id)
+        self.next_num_id += 1
+        num = makeelement('num', attributes={'numId': num_id})
+        num.append(makeelement('abstractNumId', attributes={'val': abstract_id}))
+        if list_type in self.num_ids:
+            override = makeelement('lvlOverride', attributes={'ilvl': '0'})
+            override.append(makeelement('startOverride', attributes={'val': '1'}))
+            num.append(override)
+        else:
+            self.num_ids[list_type] = num_id
+        self.numbering.append(num)
+        return num_id
+
+
+class EditBatch():
+    '''Collects insertions, replacements and removals against anchor
+    elements and applies them together, rebuilding each affected parent's
+    children in a single ordered pass instead of calling index() and
+    insert() once per edit. Can be used as a context manager, in which
+    case the edits are applied when the block exits without error.'''
+    def __init__(self):
+        # anchor element -> [elements before, elements after, replacement]
+        self.edits = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.apply()
+
+    def _edit(self, anchor):
+        if anchor not in self.edits:
+            self.edits[anchor] = [[], [], None]
+        return self.edits[anchor]
+
+    def insert_before(self, anchor, *elements):
+        self._edit(anchor)[0].extend(elements)
+
+    def insert_after(self, anchor, *elements):
+        self._edit(anchor)[1].extend(elements)
+
+    def replace(self, anchor, *elements):
+        '''Replaces anchor with elements, or removes it if none are given'''
+        self._edit(anchor)[2] = list(elements)
+
+    def remove(self, anchor):
+        self._edit(anchor)[2] = []
+
+    def apply(self):
+        '''Applies all pending edits, then empties the batch'''
+        parents = collections.OrderedDict()
+        for anchor in self.edits:
+            parent = anchor.getparent()
+            if parent is None:
+                raise ValueError('anchor elements must have a parent')
+            parents[parent] = None
+        for parent in parents:
+            children = []
+            for child in parent:
+                edit = self.edits.get(child)
+                if edit is None:
+                    children.append(child)
+                    continue
+                before, after, replacement = edit
+                children.extend(before)
+                if replacement is None:
+                    children.append(child)
+                else:
+                    children.extend(replacement)
+                children.extend(after)
+            parent[:] = children
+        self.edits.clear()
+
+
+def paragraph_runs(paragraph):
+    '''Yields the runs of a paragraph in document order: its own runs and
+    those in hyperlinks, content controls, fields and other containers,
+    but not the runs of the paragraphs in its text boxes, which are
+    paragraphs of their own'''
+    pending = [iter(paragraph)]
+    while pending:
+        for child in pending[-1]:
+            if child.tag == '{' + NSPREFIXES['w'] + '}r':
+                yield child
+            elif len(child) and child.tag != '{' + NSPREFIXES['w'] + '}pPr':
+                pending.append(iter(child))
+                break
+        else:
+            pending.pop()
+
+def run_text(run):
+    '''Returns the text of a run's own w:t elements, without the text of
+    any text box anchored in the run'''
+    return ''.join(child.text or '' for child in
+                   run.iterchildren('{' + NSPREFIXES['w'] + '}t'))
+
+
+class TextIndex():
+    '''Maps character offsets in the text of an element, as returned by
+    get_text, to the runs that hold them. Offsets are resolved with a
+    binary search over the element's original runs, then over the few
+    pieces each of those runs has been split into, whose offsets are kept
+    relative to the start of their original run. Edits made through a
+    Range update the index in place, so only the starts of the following
+    runs move. Set stale to True after changing the element in other
+    ways, and the index is rebuilt on the next lookup. If own_runs is
+    true, element must be a paragraph and only the text of
+    paragraph_runs(element) is indexed, leaving out its text boxes.'''
+    def __init__(self, element, own_runs=False):
+        self.element = element
+        self.own_runs = own_runs
+        self.refresh()
+
+    def refresh(self):
+        self.starts = []
+        # per original run, the runs it has been split into and their
+        # offsets from the original run's start, in document order
+        self.pieces = []
+        self.piece_offsets = []
+        position = 0
+        if self.own_runs:
+            runs = ((run, run_text(run)) for run in
+                    paragraph_runs(self.element))
+        else:
+            runs = ((run, get_text(run)) for run in
+                    self.element.iter('{' + NSPREFIXES['w'] + '}r'))
+        for run, text in runs:
+            length = len(text)
+            if length:
+                self.starts.append(position)
+                self.pieces.append([run])
+                self.piece_offsets.append([0])
+                position += length
+        self.length = position
+        self.stale = False
+
+    def locate(self, offset):
+        '''Returns the (original run, piece) indexes of the piece holding
+        the character at offset'''
+        if self.stale:
+            self.refresh()
+        index = bisect.bisect_right(self.starts, offset) - 1
+        piece = bisect.bisect_right(self.piece_offsets[index],
+                                    offset - self.starts[index]) - 1
+        return index, piece
+
+    def split(self, offset):
+        '''Makes sure a run boundary falls at offset'''
+        if self.stale:
+            self.refresh()
+        if offset <= 0 or offset >= self.length:
+            return
+        index, piece = self.locate(offset)
+        piece_start = self.starts[index] + self.piece_offsets[index][piece]
+        if piece_start != offset:
+            new_run = split_run(self.pieces[index][piece], offset - piece_start)
+            self.pieces[index].insert(piece + 1, new_run)
+            self.piece_offsets[index].insert(piece + 1,
+                                             offset - self.starts[index])
+
+    def runs(self, start, end):
+        '''Returns the runs holding exactly the text from start to end,
+        splitting runs at those offsets if needed'''
+        self.split(start)
+        self.split(end)
+        if start >= end:
+            return []
+        run_list = []
+        index, piece = self.locate(start)
+        while index < len(self.starts) and self.starts[index] < end:
+            for offset, run in zip(self.piece_offsets[index][piece:],
+                                   self.pieces[index][piece:]):
+                if self.starts[index] + offset >= end:
+                    break
+                run_list.append(run)
+            index += 1
+            piece = 0
+        return run_list
+
+    def remove(self, start, end):
+        '''Removes the runs holding the text from start to end from the
+        element and the index, and moves the later runs back'''
+        if not self.runs(start, end):
+            return
+        delta = start - end
+        first = last = self.locate(start)[0]
+        entries = []
+        while last < len(self.starts) and self.starts[last] < end:
+            kept = []
+            for offset, run in zip(self.piece_offsets[last],
+                                   self.pieces[last]):
+                position = self.starts[last] + offset
+                if position < start:
+                    kept.append((position, run))
+                elif position >= end:
+                    kept.append((position + delta, run))
+                else:
+                    run.getparent().remove(run)
+            if kept:
+                entries.append(kept)
+            last += 1
+        self.starts[first:last] = [kept[0][0] for kept in entries]
+        self.pieces[first:last] = [[run for position, run in kept]
+                                   for kept in entries]
+        self.piece_offsets[first:last] = [[position - kept[0][0] for
+                                           position, run in kept]
+                                          for kept in entries]
+        following = first + len(entries)
+        self.starts[following:] = [position + delta for position in
+                                   self.starts[following:]]
+        self.length += delta
+
+    def add(self, run, offset, length, after=None):
+        '''Records a new run holding length characters from offset, which
+        has been placed after the piece at the (original run, piece)
+        indexes after, or before all runs if after is None'''
+        if after is None:
+            index = 0
+            self.starts.insert(0, offset)
+            self.pieces.insert(0, [run])
+            self.piece_offsets.insert(0, [0])
+        else:
+            index, piece = after
+            offsets = self.piece_offsets[index]
+            offsets.insert(piece + 1, offset - self.starts[index])
+            self.pieces[index].insert(piece + 1, run)
+            for number in range(piece + 2, len(offsets)):
+                offsets[number] += length
+        self.starts[index + 1:] = [position + length for position in
+                                   self.starts[index + 1:]]
+        self.length += length
+
+    def range(self, start, end):
+        return Range(self.element, start, end, index=self)
+
+
+class Range():
+    '''A span of text between two character offsets in a paragraph, the
+    body or any other element, as counted by get_text. Runs are only
+    split at the span's boundaries, when an operation needs them. Ranges
+    over the same element should share a TextIndex to avoid rebuilding
+    it for each one.'''
+    def __init__(self, element, start=0, end=None, index=None):
+        self.element = element
+        self.index = index if index is not None else TextIndex(element)
+        if self.index.stale:
+            self.index.refresh()
+        self.start = start
+        self.end = self.index.length if end is None else end
+        if not 0 <= self.start <= self.end <= self.index.length:
+            raise ValueError('range offsets must satisfy 0 <= start <= end '
+                             '<= length of text')
+
+    def runs(self):
+        return self.index.runs(self.start, self.end)
+
+    def get_text(self):
+        return ''.join(get_text(run) for run in self.runs())
+
+    def modify_font(self, **kwargs):
+        '''Applies modify_font to the span; takes the same keyword
+        arguments'''
+        modify_font(self.runs(), **kwargs)
+
+    def remove_formatting(self):
+        '''Removes the run properties of the span'''
+        for run in self.runs():
+            rpr = run.find('{' + NSPREFIXES['w'] + '}rPr')
+            if rpr is not None:
+                run.remove(rpr)
+
+    def delete(self):
+        '''Removes the text of the span, leaving an empty range'''
+        self.index.remove(self.start, self.end)
+        self.end = self.start
+
+    def insert_text(self, text):
+        '''Inserts text directly after the span, in a new run formatted
+        like the span's last run, and returns a Range over the new text'''
+        self.runs()
+        new_run = makeelement('r')
+        after = None
+        if self.end > 0:
+            # The span's last run, or the run before an empty span
+            after = self.index.locate(self.end - 1)
+            previous_run = self.index.pieces[after[0]][after[1]]
+            rpr = previous_run.find('{' + NSPREFIXES['w'] + '}rPr')
+            if rpr is not None:
+                new_run.append(copy.deepcopy(rpr))
+            previous_run.addnext(new_run)
+        elif self.index.length:
+            self.index.pieces[0][0].addprevious(new_run)
+        elif self.element.tag == '{' + NSPREFIXES['w'] + '}p':
+            self.element.append(new_run)
+        else:
+            raise ValueError('cannot insert text into an element without '
+                             'runs unless it is a paragraph')
+        text_element = makeelement('t', tagtext=text)
+        text_element.set('{' + NSPREFIXES['xml'] + '}space', 'preserve')
+        new_run.append(text_element)
+        if text:
+            self.index.add(new_run, self.end, len(text), after)
+        return Range(self.element, self.end, self.end + len(text),
+                     index=self.index)
+
+    def add_comment(self, document, text, username='', initials=''):
+        '''Wraps the span in a new comment and returns its id'''
+        run_list = self.runs()
+        if not run_list:
+            raise ValueError('cannot comment on an empty range')
+        id_number = write_files.setup_comments(document)
+        mark_comment(run_list[0], run_list[-1], id_number)
+        date = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:00Z')
+        document.comments.append(make_comment(id_number, text, username,
+                                              initials, date))
+        # The comment reference run has no text, so offsets are unchanged
+        return id_number
+
     
+TOGGLE_PROPERTIES = set(('b', 'bCs', 'i', 'iCs', 'caps', 'smallCaps',
+'strike', 'dstrike', 'outline', 'shadow', 'emboss', 'imprint', 'vanish'))
+
+def formatting_key(properties, style_tag, kept_tags=(), blocking_tags=()):
+    '''Returns a hashable (style id, content) key for a pPr or rPr
+    element, where content is the canonical form of its children other
+    than the style reference and kept_tags, or None if it has a child in
+    blocking_tags or nothing else to compare'''
+    style_id = None
+    content = []
+    for child in properties:
+        if not isinstance(child.tag, str):
+            continue
+        tag = child.tag.rpartition('}')[2]
+        if tag in blocking_tags:
+            return None
+        if tag == style_tag:
+            style_id = child.get('{' + NSPREFIXES['w'] + '}val')
+        elif tag not in kept_tags:
+            content.append(canonical_form(child))
+    if not content:
+        return None
+    return style_id, tuple(sorted(content))
+
+def style_key(style):
+    '''Returns a hashable form of a style's type and content, ignoring its
+    styleId and its next, link and rsid references'''
+    ignored_tags = set('{' + NSPREFIXES['w'] + '}' + tag for tag in
+                       ('next', 'link', 'rsid'))
+    return (style.get('{' + NSPREFIXES['w'] + '}type'),
+            tuple(canonical_form(child) for child in style
+                  if isinstance(child.tag, str) and
+                  child.tag not in ignored_tags))
+
+def canonical_form(element):
+    '''Returns a hashable form of an element that ignores attribute order
+    and namespace declarations'''
+    return (element.tag, tuple(sorted(element.items())), element.text or '',
+            tuple(canonical_form(child) for child in element
+                  if isinstance(child.tag, str)))
+
+def merge_properties(properties, element):
+    '''Updates a properties dictionary, mapping tag names to attribute
+    dictionaries, with the children of a pPr or rPr element, and returns
+    it. Attributes are merged with those already present for a tag.'''
+    if element is None:
+        return properties
+    for child in element:
+        if not isinstance(child.tag, str):
+            continue
+        tag = etree.QName(child).localname
+        if tag in ('rPr', 'rStyle', 'pStyle', 'rPrChange', 'pPrChange'):
+            continue
+        attributes = dict((etree.QName(key).localname, value) for key, value
+                          in child.items())
+        if tag in properties:
+            merged = dict(properties[tag])
+            merged.update(attributes)
+            attributes = merged
+        properties[tag] = attributes
+    return properties
+
+def get_parser():
+    '''Returns this thread's XMLParser configured with PARSER_OPTIONS,
+    creating it on first use'''
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        parser = _parsers.parser = etree.XMLParser(**PARSER_OPTIONS)
+    return parser
+
+# The text that each kind of run content stands for, None meaning the
+# element's own text
+RUN_TEXT = {'{' + NSPREFIXES['w'] + '}t': None,
+            '{' + NSPREFIXES['w'] + '}tab': '\t',
+            '{' + NSPREFIXES['w'] + '}br': '\n',
+            '{' + NSPREFIXES['w'] + '}cr': '\n'}
+
+def run_content_text(element):
+    '''Returns the text of a w:t element, or the character a w:tab, w:br
+    or w:cr stands for, as used by the read-only text functions'''
+    text = RUN_TEXT.get(element.tag)
+    if text is None:
+        return element.text or ''
+    return text
+
+def iter_document_text(file):
+    '''Yields the text of each paragraph in a docx file, including empty
+    paragraphs, reading word/document.xml straight from the zip file with
+    iterparse rather than building the whole tree. Tabs and breaks become
+    '\\t' and '\\n', and each paragraph is freed once it has been read, so
+    memory use does not grow with the size of the document.'''
+    # Finished cells, rows and tables are freed too, or their emptied
+    # shells would pile up under each table
+    table_tags = ('{' + NSPREFIXES['w'] + '}tc', '{' + NSPREFIXES['w'] + '}tr',
+                  '{' + NSPREFIXES['w'] + '}tbl')
+    text_tags = ('{' + NSPREFIXES['w'] + '}p',) + table_tags + tuple(RUN_TEXT)
+    with zipfile.ZipFile(file) as zipdoc:
+        with zipdoc.open('word/document.xml') as document:
+            # A stack of text lists, as paragraphs can be nested in text boxes
+            paragraphs = []
+            for event, element in etree.iterparse(document,
+            events=('start', 'end'), tag=text_tags, **PARSER_OPTIONS):
+                tag = element.tag
+                if tag == '{' + NSPREFIXES['w'] + '}p' or tag in table_tags:
+                    if tag == '{' + NSPREFIXES['w'] + '}p':
+                        if event == 'start':
+                            paragraphs.append([])
+                            continue
+                        yield ''.join(paragraphs.pop())
+                    elif event == 'start':
+                        continue
+                    # Content nested in a paragraph, such as a table in a
+                    # text box, is freed with that paragraph
+                    if paragraphs:
+                        continue
+                    element.clear()
+                    parent = element.getparent()
+                    if parent is not None:
+                        while element.getprevious() is not None:
+                            del parent[0]
+                elif event == 'start' or not paragraphs:
+                    continue
+                # Tab stops in w:pPr/w:tabs are not text
+                elif (tag != '{' + NSPREFIXES['w'] + '}tab' or
+                element.getparent().tag != '{' + NSPREFIXES['w'] + '}tabs'):
+                    paragraphs[-1].append(run_content_text(element))
+
+# Values of toggle properties such as w:b that switch them off
+OFF_VALUES = ('0', 'false', 'off', 'none')
+
+def iter_blocks(file, runs=True):
+    '''Yields a ParagraphView or TableView for each paragraph and table
+    in the body of a docx file, in order, including those inside block
+    level content controls. Paragraphs inside tables are part of the
+    table's rows rather than yielded on their own. Like
+    iter_document_text, word/document.xml is read with iterparse and each
+    block is freed once its view is built, so memory does not grow with
+    the size of the document. If runs is False, paragraphs get no run
+    views, which saves memory when only paragraph text is wanted.'''
+    w = '{' + NSPREFIXES['w'] + '}'
+    with zipfile.ZipFile(file) as zipdoc:
+        with zipdoc.open('word/document.xml') as document:
+            index = 0
+            for event, element in etree.iterparse(document,
+            tag=(w + 'p', w + 'tbl'), **PARSER_OPTIONS):
+                # Only blocks outside any other paragraph or table are
+                # read; nested ones are read with their container
+                if next(element.iterancestors(w + 'p', w + 'tbl'),
+                        None) is not None:
+                    continue
+                if element.tag == w + 'tbl':
+                    style = element.find(w + 'tblPr/' + w + 'tblStyle')
+                    yield TableView(index, style.get(w + 'val') if style is
+                                    not None else None,
+                                    list(iter_table_rows(element)))
+                else:
+                    # The schema puts pPr first in a paragraph and pStyle
+                    # first in pPr, which saves searching for them
+                    style = None
+                    if len(element) and element[0].tag == w + 'pPr':
+                        ppr = element[0]
+                        if len(ppr) and ppr[0].tag == w + 'pStyle':
+                            style = ppr[0].get(w + 'val')
+                    run_views = []
+                    texts = []
+                    for run in element.iter(w + 'r'):
+                        text = []
+                        properties = {}
+                        for child in run:
+                            if child.tag in RUN_TEXT:
+                                text.append(run_content_text(child))
+                            elif child.tag == w + 'rPr' and runs:
+                                for property in child:
+                                    properties[property.tag] = property.get(
+                                                               w + 'val', 'true')
+                        text = ''.join(text)
+                        texts.append(text)
+                        if runs:
+                            run_views.append(RunView(text,
+                            properties.get(w + 'rStyle'),
+                            properties.get(w + 'b', 'false') not in OFF_VALUES,
+                            properties.get(w + 'i', 'false') not in OFF_VALUES,
+                            properties.get(w + 'u', 'none') not in OFF_VALUES))
+                    yield ParagraphView(index, ''.join(texts), style,
+                                        tuple(run_views))
+                index += 1
+                element.clear()
+                parent = element.getparent()
+                while element.getprevious() is not None:
+                    del parent[0]
+
 def merge_text(run):
     '''Combines the text of all text elements in a run into a single
     text element, removes the other text elements.'''
@@ -548,7 +2026,38 @@ def merge_text(run):
             child.text = get_text(run)
         else:
             run.remove(child)
-    
+
+def split_run(run, offset):
+    '''Splits a run in two at a character offset into its text. The
+    new run receives a copy of the run properties and everything after
+    the offset, and is returned, or None if there is nothing to split.'''
+    children = [child for child in run.iterchildren()
+                if child.tag != '{' + NSPREFIXES['w'] + '}rPr']
+    position = 0
+    for index, child in enumerate(children):
+        if position >= offset:
+            moved = children[index:]
+            break
+        if child.tag == '{' + NSPREFIXES['w'] + '}t' and child.text:
+            if position + len(child.text) > offset:
+                tail = makeelement('t', tagtext=child.text[offset - position:])
+                child.text = child.text[:offset - position]
+                for text_element in (child, tail):
+                    text_element.set('{' + NSPREFIXES['xml'] + '}space',
+                                     'preserve')
+                moved = [tail] + children[index + 1:]
+                break
+            position += len(child.text)
+    else:
+        return None
+    new_run = makeelement('r')
+    rpr = run.find('{' + NSPREFIXES['w'] + '}rPr')
+    if rpr is not None:
+        new_run.append(copy.deepcopy(rpr))
+    new_run.extend(moved)
+    run.addnext(new_run)
+    return new_run
+
 def modify_font(elements, name='default', size='default', underline='default',
 color='default', highlight='default', strikethrough='default', bold='default',
 subscript='default', superscript='default', italics='default',
@@ -566,190 +2075,205 @@ shadow='default', smallcaps='default', allcaps='default', hidden='default'):
     http://msdn.microsoft.com/en-us/library/documentformat.openxml.drawing.textunderlinevalues
     Otherwise, it behaves like the above parameters in that it will
     interpret True and 1 as a generic single underline, and False and 0
-    as false"""
-    underline_values = ('single', 'double', 'thick', 'dotted', 'dash',
-    'dotDash', 'dotDotDash', 'wave', 'wavyHeavy', 'wavyDouble')
-    highlight_values = ('yellow', 'green', 'cyan' 'magenta', 'blue', 'red',
-    'darkBlue', 'darkCyan', 'darkGreen', 'darkMagenta', 'darkRed', 'darkRed',
-    'lightGray', 'black')
-    if isinstance(elements, (list, tuple)):
-        run_list = []
-        for element in elements:
-            if element.tag in ('{' + NSPREFIXES['w'] + '}rPrDefault',
-            '{' + NSPREFIXES['w'] + '}style'):
-                run_list.append(element)
-                continue
-            for child in element.iter('{' + NSPREFIXES['w'] + '}r'):
-                run_list.append(child)
-    elif elements.tag == '{' + NSPREFIXES['w'] + '}r':
-        run_list = [elements]
-    else:
-        run_list = [child for child in
-        elements.iter('{' + NSPREFIXES['w'] + '}r')]
-    for run in run_list:
-        rpr = run.find('{' + NSPREFIXES['w'] + '}rPr')
-        if rpr is None:
-            rpr = makeelement('rPr')
-            run.insert(0, rpr)
-        if name != 'default':
-            rfonts = rpr.find('{' + NSPREFIXES['w'] + '}rFonts')
-            if rfonts is not None:
-                rpr.remove(rfonts)
-            rfonts = makeelement('rFonts', attributes={'ascii': name,
-            'hAnsi': name})
-            rpr.append(rfonts)
-        if size != 'default':
-            sz = rpr.find('{' + NSPREFIXES['w'] + '}sz')
-            szCs = rpr.find('{' + NSPREFIXES['w'] + '}szCs')
-            if sz is not None:
-                rpr.remove(sz)
-            sz = makeelement('sz', attributes={'val': str(int(size) * 2)})
-            rpr.append(sz)
-            if szCs is not None:
-                rpr.remove(szCs)
-            szCs = makeelement('szCs', attributes={'val': str(int(size) * 2)})
-            rpr.append(szCs)
-        if underline != 'default':
-            valid_input = False
-            u = rpr.find('{' + NSPREFIXES['w'] + '}u')
-            for value in underline_values:
-                if str(underline).lower() == value.lower():
-                    valid_input = True
-                    if u is not None:
-                        rpr.remove(u)
-                    u = makeelement('u', attributes={'val': value})
-                    rpr.append(u)
-                    break
-            if underline in (1, True) or (not valid_input and
-            isinstance(underline, str)):
-                if u is not None:
-                    rpr.remove(u)
-                u = makeelement('u', attributes={'val': 'single'})
-                rpr.append(u)
-            if underline == 0 or underline == False:
-                if u is not None:
-                    rpr.remove(u)
-        if color != 'default':
-            color_element = rpr.find('{' + NSPREFIXES['w'] + '}color')
-            if color_element is not None:
-                rpr.remove(color_element)
-            if isinstance(color, str):
-                if color.lower() in COLOR_MAP:
-                    color = COLOR_MAP[color.lower()]
-                color_element = makeelement('color', attributes={'val': color})
-                rpr.append(color_element)	
-        if highlight != 'default':
-            valid_input = False
-            highlight_element = rpr.find('{' + NSPREFIXES['w'] + '}highlight')
-            if isinstance(highlight, str) or highlight in (0, False):
-                if highlight_element is not None:
-                    rpr.remove(highlight_element)
-                if isinstance(highlight, str):
-                    for value in highlight_values:
-                        if str(highlight).lower() == value.lower():
-                            valid_input = True
-                            highlight_element = makeelement('highlight',
-                            attributes={'val': value})
-                            break
-                    if not valid_input:
-                        highlight_element = makeelement('highlight',
-                        attributes={'val': highlight})
-                    rpr.append(highlight_element)
-        if strikethrough != 'default':
-            strike = rpr.find('{' + NSPREFIXES['w'] + '}strike')
-            dstrike = rpr.find('{' + NSPREFIXES['w'] + '}dstrike')
-            if (isinstance(strikethrough, str) or 
-            strikethrough in (1, True, 0, False)):
-                if strike is not None:
-                    rpr.remove(strike)
-                if dstrike is not None:
-                    rpr.remove(dstrike)
-                if isinstance(strikethrough, str):
-                    if strikethrough.lower() in ('single', 'strike'):
-                        rpr.append(makeelement('strike'))
-                    elif strikethrough.lower() in ('double', 'dstrike'):
-                        rpr.append(makeelement('dstrike'))
-                    else:
-                        rpr.append(makeelement(strikethrough))
-                elif strikethrough in (1, True):
-                    rpr.append(makeelement('strike'))
-        if subscript != 'default':
-            vertAlign = rpr.find('{' + NSPREFIXES['w'] + '}vertAlign')
-            if vertAlign is not None and subscript in (0, False, 1, True):
-                rpr.remove(vertAlign)
-            if subscript in (1, True):
-                vertAlign = makeelement('vertAlign',
-                attributes={'val': 'subscript'})
-                rpr.append(vertAlign)
-        if superscript != 'default':
-            vertAlign = rpr.find('{' + NSPREFIXES['w'] + '}vertAlign')
-            if vertAlign is not None and superscript in (0, False, 1, True):
-                rpr.remove(vertAlign)
-            if superscript in (1, True):
-                vertAlign = makeelement('vertAlign',
-                attributes={'val': 'superscript'})
-                rpr.append(vertAlign)
-        bool_list = ((bold, 'b'), (italics, 'i'), (shadow, 'shadow'), 
-        (allcaps, 'caps'), (smallcaps, 'smallCaps'), (hidden, 'vanish'))
-        for key, value in bool_list:
-            if key != 'default':
-                element = rpr.find('{{{0}}}{1}'.format(NSPREFIXES['w'], value))
-                if element is not None and key in (0, False, 1, True):
-                    rpr.remove(element)
-                if key in (1, True):
-                    element = makeelement(value)
-                    rpr.append(element)
+    as false
+    *The changes are compiled once into a PropertyPlan (see font_plan), so
+    passing many elements in one call is much faster than calling this
+    function once per element."""
+    font_plan(name=name, size=size, underline=underline, color=color,
+    highlight=highlight, strikethrough=strikethrough, bold=bold,
+    subscript=subscript, superscript=superscript, italics=italics,
+    shadow=shadow, smallcaps=smallcaps, allcaps=allcaps,
+    hidden=hidden).apply(elements)
+
+
+class PropertyPlan():
+    '''A compiled set of changes to a properties element (rPr or pPr):
+    the tags to remove and ready-made elements to append. Applying it
+    makes one pass over each properties element, then appends copies
+    of the new elements.'''
+    def __init__(self, properties_tag, target_tags, default_tag):
+        self.properties_tag = '{' + NSPREFIXES['w'] + '}' + properties_tag
+        # elements, such as runs, that the plan is applied to
+        self.target_tags = set('{' + NSPREFIXES['w'] + '}' + tag for tag in
+                               target_tags)
+        # elements that are modified directly when passed in a list
+        self.container_tags = set('{' + NSPREFIXES['w'] + '}' + tag for tag
+                                  in (default_tag, 'style'))
+        self.remove_tags = set()
+        self.new_elements = []
+
+    def add(self, tags, new_element=None):
+        '''Adds a step that removes the tags and optionally appends a new
+        element. Earlier new elements with those tags are dropped, as
+        they would be removed again when the plan is applied.'''
+        tags = set('{' + NSPREFIXES['w'] + '}' + tag for tag in tags)
+        self.remove_tags.update(tags)
+        self.new_elements = [element for element in self.new_elements
+                             if element.tag not in tags]
+        if new_element is not None:
+            self.new_elements.append(new_element)
+
+    def targets(self, elements):
+        '''Yields the elements the plan applies to within an element or
+        list/tuple of elements'''
+        if isinstance(elements, (list, tuple)):
+            for element in elements:
+                if element.tag in self.container_tags:
+                    yield element
+                    continue
+                for target in self.descendants(element):
+                    yield target
+        elif elements.tag in self.target_tags:
+            yield elements
+        else:
+            for target in self.descendants(elements):
+                yield target
+
+    def descendants(self, element):
+        return element.iter(*self.target_tags)
+
+    def apply(self, elements):
+        '''Applies the plan to an element or list/tuple of elements'''
+        properties_tag = self.properties_tag
+        remove_tags = self.remove_tags
+        new_elements = self.new_elements
+        for target in self.targets(elements):
+            if len(target) and target[0].tag == properties_tag:
+                properties = target[0]
+            else:
+                properties = target.find(properties_tag)
+                if properties is None:
+                    properties = etree.Element(properties_tag)
+                    target.insert(0, properties)
+            if remove_tags:
+                for child in [child for child in properties
+                              if child.tag in remove_tags]:
+                    properties.remove(child)
+            for element in new_elements:
+                properties.append(copy.deepcopy(element))
+
+
+class ParagraphPlan(PropertyPlan):
+    def descendants(self, element):
+        # Only the paragraphs directly inside the element, as before
+        return element.iterchildren(*self.target_tags)
+
+
+UNDERLINE_VALUES = dict((value.lower(), value) for value in ('single',
+'double', 'thick', 'dotted', 'dash', 'dotDash', 'dotDotDash', 'wave',
+'wavyHeavy', 'wavyDouble'))
+HIGHLIGHT_VALUES = dict((value.lower(), value) for value in ('yellow',
+'green', 'cyan', 'magenta', 'blue', 'red', 'darkBlue', 'darkCyan',
+'darkGreen', 'darkMagenta', 'darkRed', 'lightGray', 'black'))
+
+def font_plan(name='default', size='default', underline='default',
+color='default', highlight='default', strikethrough='default', bold='default',
+subscript='default', superscript='default', italics='default',
+shadow='default', smallcaps='default', allcaps='default', hidden='default'):
+    '''Compiles modify_font arguments into a PropertyPlan for rPr
+    elements. Plans are cached, so repeating the same change is cheap.
+    Use plan.apply(elements) to apply one plan to many elements.'''
+    arguments = (name, size, underline, color, highlight, strikethrough, bold,
+                 subscript, superscript, italics, shadow, smallcaps, allcaps,
+                 hidden)
+    try:
+        hash(arguments)
+    except TypeError:
+        # Unhashable arguments, such as a list, can't be cache keys
+        return compile_font_plan(*arguments)
+    return cached_font_plan(*arguments)
+
+def compile_font_plan(name, size, underline, color, highlight, strikethrough,
+bold, subscript, superscript, italics, shadow, smallcaps, allcaps, hidden):
+    plan = PropertyPlan('rPr', ('r',), 'rPrDefault')
+    if name != 'default':
+        plan.add(('rFonts',), makeelement('rFonts',
+        attributes={'ascii': name, 'hAnsi': name}))
+    if size != 'default':
+        half_points = str(int(size) * 2)
+        plan.add(('sz',), makeelement('sz', attributes={'val': half_points}))
+        plan.add(('szCs',), makeelement('szCs',
+        attributes={'val': half_points}))
+    if underline != 'default':
+        if isinstance(underline, str):
+            plan.add(('u',), makeelement('u', attributes={'val':
+            UNDERLINE_VALUES.get(underline.lower(), 'single')}))
+        elif underline in (1, True):
+            plan.add(('u',), makeelement('u', attributes={'val': 'single'}))
+        elif underline in (0, False):
+            plan.add(('u',))
+    if color != 'default':
+        if isinstance(color, str):
+            color = COLOR_MAP.get(color.lower(), color)
+            plan.add(('color',), makeelement('color',
+            attributes={'val': color}))
+        else:
+            plan.add(('color',))
+    if highlight != 'default':
+        if isinstance(highlight, str):
+            plan.add(('highlight',), makeelement('highlight', attributes={
+            'val': HIGHLIGHT_VALUES.get(highlight.lower(), highlight)}))
+        elif highlight in (0, False):
+            plan.add(('highlight',))
+    if strikethrough != 'default':
+        if isinstance(strikethrough, str):
+            if strikethrough.lower() in ('single', 'strike'):
+                strike = makeelement('strike')
+            elif strikethrough.lower() in ('double', 'dstrike'):
+                strike = makeelement('dstrike')
+            else:
+                strike = makeelement(strikethrough)
+            plan.add(('strike', 'dstrike'), strike)
+        elif strikethrough in (1, True):
+            plan.add(('strike', 'dstrike'), makeelement('strike'))
+        elif strikethrough in (0, False):
+            plan.add(('strike', 'dstrike'))
+    for value, vertalign in ((subscript, 'subscript'),
+                             (superscript, 'superscript')):
+        if value != 'default' and value in (1, True):
+            plan.add(('vertAlign',), makeelement('vertAlign',
+            attributes={'val': vertalign}))
+        elif value != 'default' and value in (0, False):
+            plan.add(('vertAlign',))
+    bool_list = ((bold, 'b'), (italics, 'i'), (shadow, 'shadow'),
+    (allcaps, 'caps'), (smallcaps, 'smallCaps'), (hidden, 'vanish'))
+    for key, value in bool_list:
+        if key != 'default' and key in (1, True):
+            plan.add((value,), makeelement(value))
+        elif key != 'default' and key in (0, False):
+            plan.add((value,))
+    return plan
+
+cached_font_plan = functools.lru_cache(maxsize=256)(compile_font_plan)
                     
 def modify_paragraph(elements, indent='default', spacing='default',
 pstyle='default', justification='default'):
-    if isinstance(elements, (list, tuple)):
-        para_list = []
-        for element in elements:
-            if element.tag in ('{' + NSPREFIXES['w'] + '}pPrDefault',
-            '{' + NSPREFIXES['w'] + '}style'):
-                para_list.append(element)
-                continue
-            para_list.extend([child for child in element if child.tag
-            == '{' + NSPREFIXES['w'] + '}p'])
-    elif elements.tag == '{' + NSPREFIXES['w'] + '}p':
-        para_list = [elements]
-    else:
-        para_list = [child for child in elements if child.tag
-        == '{' + NSPREFIXES['w'] + '}p']
-    for para in para_list:
-        pPr = para.find('{' + NSPREFIXES['w'] + '}pPr')
-        if pPr is None:
-            pPr = makeelement('pPr')
-            para.insert(0, pPr)
-        if indent != 'default':
-            ind = pPr.find('{' + NSPREFIXES['w'] + '}ind')
-            if ind is not None:
-                pPr.remove(ind)
-            if isinstance(indent, dict):
-                ind = makeelement('ind', attributes=indent)
-                pPr.append(ind)
-        if spacing != 'default':
-            spacing_element = pPr.find('{' + NSPREFIXES['w'] + '}spacing')
-            if spacing_element is not None:
-                pPr.remove(spacing_element)
-            if isinstance(spacing, dict):
-                if 'lineRule' not in spacing.keys():
-                    spacing['lineRule'] = 'auto'
-                spacing_element = makeelement('spacing', attributes=spacing)
-                pPr.append(spacing_element)
-        if pstyle != 'default':
-            pstyle_element = pPr.find('{' + NSPREFIXES['w'] + '}pStyle')
-            if pstyle_element is not None:
-                pPr.remove(pstyle_element)
-            pstyle_element = makeelement('pStyle', attributes={'val': pstyle})
-            pPr.append(pstyle_element)
-        if justification != 'default':
-            jc = para.find('{' + NSPREFIXES['w'] + '}jc')
-            if jc is not None:
-                jc.set('{' + NSPREFIXES['w'] + '}val', justification.lower())
-            else:
-                jc = makeelement('jc', attributes={'val': justification.lower()})
-                pPr.append(jc)
+    paragraph_plan(indent=indent, spacing=spacing, pstyle=pstyle,
+    justification=justification).apply(elements)
+
+def paragraph_plan(indent='default', spacing='default', pstyle='default',
+justification='default'):
+    '''Compiles modify_paragraph arguments into a PropertyPlan for pPr
+    elements, which can then be applied to many paragraphs'''
+    plan = ParagraphPlan('pPr', ('p',), 'pPrDefault')
+    if indent != 'default':
+        if isinstance(indent, dict):
+            plan.add(('ind',), makeelement('ind', attributes=indent))
+        else:
+            plan.add(('ind',))
+    if spacing != 'default':
+        if isinstance(spacing, dict):
+            if 'lineRule' not in spacing.keys():
+                spacing['lineRule'] = 'auto'
+            plan.add(('spacing',), makeelement('spacing', attributes=spacing))
+        else:
+            plan.add(('spacing',))
+    if pstyle != 'default':
+        plan.add(('pStyle',), makeelement('pStyle', attributes={'val': pstyle}))
+    if justification != 'default':
+        plan.add(('jc',), makeelement('jc',
+        attributes={'val': justification.lower()}))
+    return plan
             
 def makeelement(tagname, tagtext=None, nsprefix='w', attributes=None,
                 attrnsprefix=None):
@@ -768,6 +2292,8 @@ def makeelement(tagname, tagtext=None, nsprefix='w', attributes=None,
         # For when namespace = None
         namespace = ''
     newelement = etree.Element(namespace + tagname, nsmap=namespacemap)
+    if instrumented:
+        global_stats.add('makeelement')
     # Add attributes with namespaces
     if attributes:
         # If they haven't bothered setting attribute namespace, use an empty string
@@ -1027,6 +2553,65 @@ def table(contents, heading=True, colw=None, cwunit='dxa', tblw=0, twunit='auto'
         table.append(row)
     return table
     
+def iter_table_rows(table, fill_merged=True):
+    '''Yields each row of a table element as a list of cell text, one
+    string per grid column. Paragraphs in a cell are joined with newlines.
+    Cells spanning several columns (gridSpan) or continuing a vertical
+    merge (vMerge) are expanded, repeating the merged cell's text if
+    fill_merged is True and using empty strings otherwise.'''
+    grid = table.find('{' + NSPREFIXES['w'] + '}tblGrid')
+    columns = len(grid) if grid is not None else 0
+    # text of the last cell in each column, for vertical merges
+    above = {}
+    for row in table.iterchildren('{' + NSPREFIXES['w'] + '}tr'):
+        cells = []
+        trPr = row.find('{' + NSPREFIXES['w'] + '}trPr')
+        if trPr is not None:
+            before = trPr.find('{' + NSPREFIXES['w'] + '}gridBefore')
+            if before is not None:
+                cells.extend([''] * int(before.get('{' + NSPREFIXES['w'] +
+                                                   '}val', '0')))
+        for cell in row.iterchildren('{' + NSPREFIXES['w'] + '}tc'):
+            span = 1
+            vmerge = None
+            tcPr = cell.find('{' + NSPREFIXES['w'] + '}tcPr')
+            if tcPr is not None:
+                gridspan = tcPr.find('{' + NSPREFIXES['w'] + '}gridSpan')
+                if gridspan is not None:
+                    span = int(gridspan.get('{' + NSPREFIXES['w'] + '}val', '1'))
+                vmerge = tcPr.find('{' + NSPREFIXES['w'] + '}vMerge')
+            column = len(cells)
+            if (vmerge is not None and vmerge.get('{' + NSPREFIXES['w'] +
+            '}val', 'continue') != 'restart'):
+                text = above.get(column, '') if fill_merged else ''
+            else:
+                text = '\n'.join(get_text(para) for para in
+                                 cell.iterchildren('{' + NSPREFIXES['w'] + '}p'))
+                above[column] = text
+            cells.append(text)
+            cells.extend([text if fill_merged else ''] * (span - 1))
+        if len(cells) < columns:
+            cells.extend([''] * (columns - len(cells)))
+        yield cells
+
+def table_to_csv(table, output, fill_merged=True, **kwargs):
+    '''Writes the rows of a table element to output, a file-like object
+    opened in text mode with newline='', one row at a time. Extra keyword
+    arguments are passed to csv.writer.'''
+    writer = csv.writer(output, **kwargs)
+    for row in iter_table_rows(table, fill_merged):
+        writer.writerow(row)
+
+def table_to_array(table, fill_merged=True, dtype=object):
+    '''Returns the cell text of a table element as a two dimensional
+    NumPy array. Requires numpy.'''
+    import numpy
+    rows = list(iter_table_rows(table, fill_merged))
+    columns = max([len(row) for row in rows] + [0])
+    for row in rows:
+        row.extend([''] * (columns - len(row)))
+    return numpy.array(rows, dtype=dtype).reshape(len(rows), columns)
+
 def picture(document, picpath, picdescription='', pixelwidth=None, pixelheight=None, nochangeaspect=True, nochangearrowheads=True):
     '''Take a document and a picture file path, and return a paragraph
     containing the image. The document argument is necessary because we
@@ -1036,9 +2621,9 @@ def picture(document, picpath, picdescription='', pixelwidth=None, pixelheight=N
     # pixel size of image.
     # Copy the file into the media dir
     if not os.path.isdir(document.media_dir):
-        os.mkdir(document.media_dir)
+        os.makedirs(document.media_dir)
     picname = os.path.basename(picpath)
-    shutil.copyfile(picname, os.path.join(document.media_dir, picname))
+    shutil.copyfile(picpath, os.path.join(document.media_dir, picname))
     # Check if the user has specified a size
     if not pixelwidth or not pixelheight:
         pixelwidth, pixelheight = helper_functions.get_image_size(picpath)
@@ -1180,10 +2765,7 @@ def numbered_list(start, end=None):
         raise ValueError('start argument must be a paragraph element')
     if end.tag != '{' + NSPREFIXES['w'] + '}p':
         raise ValueError('end argument must be a paragraph element')
-    if body.index(start) > body.index(end):
-        raise ValueError('end paragraph cannot precede start paragraph')
-    para_list = [para for para in body.iterchildren() if body.index(para) in
-    range(body.index(start), body.index(end) + 1)]
+    para_list = sibling_range(start, end)
     numId_set = set()
     for element in body.iter('{' + NSPREFIXES['w'] + '}numId'):
         for k, v in element.items():
@@ -1206,6 +2788,62 @@ def numbered_list(start, end=None):
         numPr.append(numId)
         pPr.insert(0, numPr)	
 
+def sibling_range(start, end):
+    '''Returns a list of the elements from start to end, inclusively,
+    which must share the same parent'''
+    if start.getparent() is not end.getparent():
+        raise ValueError('start and end elements must have the same parent')
+    elements = [start]
+    if start is not end:
+        for sibling in start.itersiblings():
+            elements.append(sibling)
+            if sibling is end:
+                break
+        else:
+            raise ValueError('end element cannot precede start element')
+    return elements
+
+def apply_numbering(paragraphs, numId, level=0):
+    '''Gives each paragraph a numPr element referring to numId, replacing
+    any numbering it already has. level is either a single list level or
+    a sequence of levels, one per paragraph; a sequence of another length
+    raises ValueError.'''
+    if isinstance(level, int):
+        level = itertools.repeat(level)
+    else:
+        paragraphs = list(paragraphs)
+        level = list(level)
+        if len(level) != len(paragraphs):
+            raise ValueError('level has {0} items for {1} paragraphs'
+                             .format(len(level), len(paragraphs)))
+    numpr_prototypes = {}
+    # Elements that must precede numPr inside pPr
+    leading_tags = set('{' + NSPREFIXES['w'] + '}' + tag for tag in
+    ('pStyle', 'keepNext', 'keepLines', 'pageBreakBefore', 'framePr',
+    'widowControl'))
+    for para, ilvl in zip(paragraphs, level):
+        if ilvl not in numpr_prototypes:
+            numPr = makeelement('numPr')
+            numPr.append(makeelement('ilvl', attributes={'val': str(ilvl)}))
+            numPr.append(makeelement('numId', attributes={'val': numId}))
+            numpr_prototypes[ilvl] = numPr
+        numPr = copy.deepcopy(numpr_prototypes[ilvl])
+        if len(para) and para[0].tag == '{' + NSPREFIXES['w'] + '}pPr':
+            pPr = para[0]
+        else:
+            pPr = makeelement('pPr')
+            para.insert(0, pPr)
+        old_numPr = pPr.find('{' + NSPREFIXES['w'] + '}numPr')
+        if old_numPr is not None:
+            pPr.replace(old_numPr, numPr)
+            continue
+        position = 0
+        for child in pPr:
+            if child.tag not in leading_tags:
+                break
+            position += 1
+        pPr.insert(position, numPr)
+
 def add_comment(document, text, start, end=None, username='', initials=''):
     if end is None:
         end = start
@@ -1314,20 +2952,53 @@ def add_comment(document, text, start, end=None, username='', initials=''):
         attributes={'val': 'CommentReference'}))
         run.append(makeelement('commentReference',
         attributes={'id': id_number}))
-    date = datetime.datetime.now()              # Content for comments.xml
-    daystr = str(date.day)
-    hourstr = str(date.hour)
-    minutestr = str(date.minute)
-    if len(daystr) == 1:
-        daystr = '0' + daystr
-    if len(hourstr) == 1:
-        hourstr = '0' + hourstr
-    if len(minutestr) == 1:
-        minutestr = '0' + minutestr
-    comment = makeelement('comment', attributes={'id': id_number, 
-    'author': username, 'date': '{0}-{1}-{2}T{3}:{4}:00Z'.format(
-    str(date.year), str(date.month), daystr, hourstr, minutestr),
-    'initials': initials})
+    date = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:00Z')
+    document.comments.append(make_comment(id_number, text, username,
+                                          initials, date))
+
+def mark_comment(start, end, id_number):
+    '''Inserts the range and reference elements for comment id_number
+    around the start and end paragraph, run or text elements. Text
+    elements are treated as their parent runs.'''
+    if start.tag == '{' + NSPREFIXES['w'] + '}t':
+        start = start.getparent()
+    if end.tag == '{' + NSPREFIXES['w'] + '}t':
+        end = end.getparent()
+    range_start = makeelement('commentRangeStart',
+                              attributes={'id': id_number})
+    if start.tag == '{' + NSPREFIXES['w'] + '}p':
+        ppr = start.find('{' + NSPREFIXES['w'] + '}pPr')
+        if ppr is not None:
+            ppr.addnext(range_start)
+        else:
+            start.insert(0, range_start)
+    else:
+        start.addprevious(range_start)
+    range_end = makeelement('commentRangeEnd', attributes={'id': id_number})
+    reference = copy.deepcopy(COMMENT_REFERENCE_PROTOTYPE)
+    reference[-1].set('{' + NSPREFIXES['w'] + '}id', id_number)
+    if end.tag == '{' + NSPREFIXES['w'] + '}p':
+        end.append(range_end)
+        end.append(reference)
+    else:
+        end.addnext(range_end)
+        range_end.addnext(reference)
+
+def make_comment(id_number, text, author='', initials='', date=''):
+    '''Returns a comment element for the comments part, copied from a
+    prototype rather than built element by element'''
+    comment = copy.deepcopy(COMMENT_PROTOTYPE)
+    comment.set('{' + NSPREFIXES['w'] + '}id', id_number)
+    comment.set('{' + NSPREFIXES['w'] + '}author', author)
+    comment.set('{' + NSPREFIXES['w'] + '}date', date)
+    comment.set('{' + NSPREFIXES['w'] + '}initials', initials)
+    comment[0][-1][0].text = text
+    return comment
+
+def comment_prototypes():
+    '''Builds the prototype comment and comment reference run elements
+    that make_comment and mark_comment copy'''
+    comment = makeelement('comment')
     para = makeelement('p')
     comment.append(para)
     pPr = makeelement('pPr')
@@ -1341,9 +3012,15 @@ def add_comment(document, text, start, end=None, username='', initials=''):
     run_reference.append(makeelement('annotationRef'))
     run_text = makeelement('r')
     para.append(run_text)
-    run_text.append(makeelement('t', tagtext=text))
-    document.comments.append(comment)
-    
+    run_text.append(makeelement('t'))
+    reference = makeelement('r')
+    rPr = makeelement('rPr')
+    reference.append(rPr)
+    rPr.append(makeelement('rStyle', attributes={'val': 'CommentReference'}))
+    reference.append(makeelement('commentReference'))
+    return comment, reference
+
+COMMENT_PROTOTYPE, COMMENT_REFERENCE_PROTOTYPE = comment_prototypes()
     
 def get_text(element):
     '''Returns a single string of text which is a concatenation of all
@@ -0,0 +1,354 @@
+"""
+Split a Docx into several documents, used by Docx.split.
+
+The body is cut into pieces in one pass. Each piece becomes a new Docx that
+carries copies of only the relationships, media, styles, numbering and
+comments its own content refers to, so splitting is linear in the size of
+the document rather than copying the whole package for every piece.
+"""
+
+import concurrent.futures
+import copy
+import os
+import posixpath
+import shutil
+import tempfile
+from oodocx import oodocx
+
+W = '{' + oodocx.NSPREFIXES['w'] + '}'
+R = '{' + oodocx.NSPREFIXES['r'] + '}'
+STYLE_TAGS = (W + 'pStyle', W + 'rStyle', W + 'tblStyle')
+COMMENT_TAGS = (W + 'commentRangeStart', W + 'commentRangeEnd',
+                W + 'commentReference')
+# The kind of range each range tag belongs to and whether it starts it
+RANGE_TAGS = {W + 'commentRangeStart': ('commentRange', True),
+              W + 'commentRangeEnd': ('commentRange', False),
+              W + 'bookmarkStart': ('bookmark', True),
+              W + 'bookmarkEnd': ('bookmark', False)}
+# Attributes whose values are ids from the relationships part
+RELATIONSHIP_ATTRIBUTES = tuple(R + name for name in ('id', 'embed', 'link',
+                                'pict', 'dm', 'lo', 'qs', 'cs'))
+
+
+def heading_start(style='Heading1'):
+    '''Returns a predicate for Docx.split that starts a new piece at each
+    paragraph with the given paragraph style'''
+    def predicate(element):
+        return (element.tag == W + 'p' and
+                element.find(W + 'pPr/' + W + 'pStyle') is not None and
+                element.find(W + 'pPr/' + W + 'pStyle').get(W + 'val') ==
+                style)
+    return predicate
+
+def section_start(element):
+    '''A predicate for Docx.split that starts a new piece after each
+    section break, that is after each paragraph holding a sectPr'''
+    previous = element.getprevious()
+    return (previous is not None and previous.tag == W + 'p' and
+            previous.find(W + 'pPr/' + W + 'sectPr') is not None)
+
+def split(document, predicate, output=None, workers=None, **save_options):
+    '''Cuts the body of document before every block for which
+    predicate(block) is true. If output is None the pieces are returned
+    as new Docx objects. Otherwise output is a format string, such as
+    'chapter{0:03}.docx', or a function of the piece's index returning a
+    path or file object, and the pieces are saved through a pool of
+    workers threads, passing save_options to Docx.save; a list of the
+    outputs is returned.'''
+    blocks = [block for block in document.body
+              if block.tag != W + 'sectPr']
+    final_sectpr = document.body.find(W + 'sectPr')
+    # The section properties that apply to each block are those of the
+    # next section break, so find them walking backwards
+    governing = [None] * len(blocks)
+    sectpr = final_sectpr
+    for index in range(len(blocks) - 1, -1, -1):
+        found = (blocks[index].find(W + 'pPr/' + W + 'sectPr')
+                 if blocks[index].tag == W + 'p' else None)
+        if found is not None:
+            sectpr = found
+        governing[index] = sectpr
+    ranges = []
+    start = 0
+    for index, block in enumerate(blocks):
+        if index > start and predicate(block):
+            ranges.append((start, index))
+            start = index
+    if start < len(blocks):
+        ranges.append((start, len(blocks)))
+    package = Package(document)
+    pieces = (package.piece(blocks[start:end], governing[end - 1])
+              for start, end in ranges)
+    if output is None:
+        return list(pieces)
+    if isinstance(output, str):
+        output = output.format
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = []
+        for index, piece in enumerate(pieces):
+            target = output(index)
+            futures.append((target, executor.submit(piece.save, target,
+                                                    **save_options)))
+        # Raises the first error from a worker, if any
+        return [future.result() or target for target, future in futures]
+
+def close_ranges(blocks):
+    '''Balances the comment ranges and bookmarks of a piece that were cut
+    at its boundaries. A range that goes on past the piece's end is
+    closed at the end of its last paragraph, a comment range that began
+    in an earlier piece is reopened at the start of its first paragraph,
+    and the end of a bookmark that began earlier is removed.'''
+    starts = set()
+    ends = {}
+    references = set()
+    for block in blocks:
+        for element in block.iter(W + 'commentReference', *RANGE_TAGS):
+            if element.tag == W + 'commentReference':
+                references.add(element.get(W + 'id'))
+                continue
+            kind, start = RANGE_TAGS[element.tag]
+            if start:
+                starts.add((kind, element.get(W + 'id')))
+            else:
+                ends[(kind, element.get(W + 'id'))] = element
+    # Paragraphs in text boxes are left out, as a range can't span them
+    paragraphs = [paragraph for block in blocks for paragraph in
+                  block.iter(W + 'p') if next(paragraph.iterancestors(W + 'p'),
+                                              None) is None]
+    if not paragraphs:
+        return
+    for kind, id_number in sorted(starts - set(ends)):
+        paragraphs[-1].append(oodocx.makeelement(kind + 'End',
+                              attributes={'id': id_number}))
+        if kind == 'commentRange' and id_number not in references:
+            reference = copy.deepcopy(oodocx.COMMENT_REFERENCE_PROTOTYPE)
+            reference[-1].set(W + 'id', id_number)
+            paragraphs[-1].append(reference)
+    for (kind, id_number), end in ends.items():
+        if (kind, id_number) in starts:
+            continue
+        if kind == 'bookmark':
+            end.getparent().remove(end)
+        else:
+            range_start = oodocx.makeelement('commentRangeStart',
+                                             attributes={'id': id_number})
+            ppr = paragraphs[0].find(W + 'pPr')
+            if ppr is not None:
+                ppr.addnext(range_start)
+            else:
+                paragraphs[0].insert(0, range_start)
+
+
+class Package():
+    '''What split needs to know about the source package, worked out once
+    for all of the pieces'''
+    def __init__(self, document):
+        self.document = document
+        self.relationships = dict((relationship.get('Id'), relationship)
+                                  for relationship in document.relationships)
+        # Relationships the body never refers to belong to the package as a
+        # whole, such as styles and settings, and every piece keeps them
+        body_ids = set()
+        for element in document.body.iter():
+            for name in RELATIONSHIP_ATTRIBUTES:
+                value = element.get(name)
+                if value is not None:
+                    body_ids.add(value)
+        self.shared_ids = set(self.relationships) - body_ids
+        self.document_dir = posixpath.dirname(self.part_name(
+                                              document.document))
+        # The parts each of the document's relationships brings along: its
+        # target and the target's own relationships part
+        self.relationship_parts = {}
+        for rid, relationship in self.relationships.items():
+            name = self.target_name(relationship)
+            if name is not None:
+                self.relationship_parts[rid] = (name, posixpath.join(
+                posixpath.dirname(name), '_rels',
+                posixpath.basename(name) + '.rels'))
+        # The targets of every other relationships part, which stay in a
+        # piece as long as that relationships part does
+        self.part_dependencies = []
+        for element, relpath in document.xmlfiles.items():
+            name = relpath.replace(os.sep, '/')
+            if (name.endswith('.rels') and
+            element is not document.relationships and
+            element is not getattr(document, 'rels', None)):
+                part_dir = posixpath.dirname(posixpath.dirname(name))
+                self.part_dependencies.append((name, set(
+                posixpath.normpath(posixpath.join(part_dir,
+                relationship.get('Target'))) for relationship in element
+                if relationship.get('TargetMode') != 'External')))
+        # The files outside the XML parts, such as media, by package path
+        self.files = []
+        for dirpath, dirnames, filenames in os.walk(document.write_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                self.files.append((path, os.path.relpath(path,
+                document.write_dir).replace(os.sep, '/')))
+        self.part_attributes = {}
+        for name, value in vars(document).items():
+            if (name not in ('body', 'xmlfiles') and
+            isinstance(value, oodocx.etree._Element) and
+            value in document.xmlfiles):
+                self.part_attributes.setdefault(id(value), []).append(name)
+        self.styles = (document.get_style_registry().style_elements
+                       if getattr(document, 'styles', None) is not None
+                       else {})
+
+    def part_name(self, element):
+        return self.document.xmlfiles[element].replace(os.sep, '/')
+
+    def target_name(self, relationship):
+        '''Returns the package path of a relationship's target, or None
+        for external targets such as hyperlinks'''
+        if relationship.get('TargetMode') == 'External':
+            return None
+        target = relationship.get('Target')
+        if target.startswith('/'):
+            return target[1:]
+        return posixpath.normpath(posixpath.join(self.document_dir, target))
+
+    def piece(self, blocks, sectpr):
+        '''Returns a new Docx holding copies of blocks and what they need
+        from the package'''
+        source = self.document
+        body = [copy.deepcopy(block) for block in blocks]
+        if sectpr is not None:
+            body.append(copy.deepcopy(sectpr))
+            # The last section break of a piece becomes its body's sectPr,
+            # or the piece would end with an empty section
+            last = body[-2].find(W + 'pPr/' + W + 'sectPr')
+            if last is not None:
+                last.getparent().remove(last)
+        close_ranges(body)
+        relationship_ids = set()
+        style_ids = set()
+        num_ids = set()
+        comment_ids = set()
+        for block in body:
+            for element in block.iter():
+                for name in RELATIONSHIP_ATTRIBUTES:
+                    value = element.get(name)
+                    if value is not None:
+                        relationship_ids.add(value)
+                if element.tag in STYLE_TAGS:
+                    style_ids.add(element.get(W + 'val'))
+                elif element.tag == W + 'numId':
+                    num_ids.add(element.get(W + 'val'))
+                elif element.tag in COMMENT_TAGS:
+                    comment_ids.add(element.get(W + 'id'))
+        kept_ids = relationship_ids | self.shared_ids
+        dropped_parts = set()
+        for rid, names in self.relationship_parts.items():
+            if rid not in kept_ids:
+                dropped_parts.update(names)
+        # A dropped target may still be needed by a part that is kept, such
+        # as an image used in a header as well as in another piece's body
+        for name, targets in self.part_dependencies:
+            if name not in dropped_parts:
+                dropped_parts.difference_update(targets)
+        style_ids, num_ids = self.style_closure(style_ids, num_ids)
+        piece = oodocx.Docx.__new__(oodocx.Docx)
+        piece.stats = oodocx.Stats()
+        piece.write_dir = tempfile.mkdtemp(dir=oodocx.BASE_DIR)
+        piece.media_dir = os.path.join(piece.write_dir, 'word', 'media')
+        piece.comments = None
+        piece.numbering = None
+        piece.numbering_registry = None
+        piece.style_registry = None
+        piece.xmlfiles = {}
+        for element, relpath in source.xmlfiles.items():
+            name = relpath.replace(os.sep, '/')
+            if name in dropped_parts:
+                continue
+            if element is source.document:
+                part = self.filtered(element, lambda child: False)
+                new_body = part.makeelement(W + 'body', source.body.attrib)
+                part.append(new_body)
+                new_body.extend(body)
+                piece.body = new_body
+            elif element is source.relationships:
+                part = self.filtered(element, lambda child: child.get('Id')
+                                     in kept_ids)
+            elif element is getattr(source, 'styles', None):
+                part = self.filtered(element, lambda child: child.tag !=
+                W + 'style' or child.get(W + 'styleId') in style_ids or
+                child.get(W + 'default') in ('1', 'true', 'on'))
+            elif element is source.numbering:
+                abstract_ids = set(num.find(W + 'abstractNumId').get(W + 'val')
+                for num in element.iterchildren(W + 'num')
+                if num.get(W + 'numId') in num_ids)
+                part = self.filtered(element, lambda child:
+                (child.tag != W + 'num' or child.get(W + 'numId') in num_ids)
+                and (child.tag != W + 'abstractNum' or
+                     child.get(W + 'abstractNumId') in abstract_ids))
+            elif element is source.comments:
+                part = self.filtered(element, lambda child:
+                                     child.get(W + 'id') in comment_ids)
+            elif element is source.contenttypes:
+                part = self.filtered(element, lambda child:
+                child.get('PartName', '/')[1:] not in dropped_parts)
+            else:
+                part = copy.deepcopy(element)
+            piece.xmlfiles[part] = relpath
+            for attribute in self.part_attributes.get(id(element), ()):
+                setattr(piece, attribute, part)
+        for path, name in self.files:
+            if name not in dropped_parts:
+                destination = os.path.join(piece.write_dir, name)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copyfile(path, destination)
+        return piece
+
+    def filtered(self, element, keep):
+        '''Returns a copy of a part keeping only the children for which
+        keep(child) is true'''
+        part = oodocx.etree.Element(element.tag, element.attrib,
+                                    nsmap=element.nsmap)
+        part.extend(copy.deepcopy(child) for child in element if keep(child))
+        return part
+
+    def style_closure(self, style_ids, num_ids):
+        '''Adds the styles that style_ids are based on or link to, and the
+        lists and list styles they use, returning both sets'''
+        numbering = self.document.numbering
+        abstract_nums = {}
+        nums = {}
+        if numbering is not None:
+            for abstract in numbering.iterchildren(W + 'abstractNum'):
+                abstract_nums[abstract.get(W + 'abstractNumId')] = abstract
+            for num in numbering.iterchildren(W + 'num'):
+                nums[num.get(W + 'numId')] = num.find(W + 'abstractNumId').get(
+                                             W + 'val')
+        style_ids = set(style_ids)
+        num_ids = set(num_ids)
+        pending = list(style_ids)
+        pending_nums = list(num_ids)
+        while pending or pending_nums:
+            while pending:
+                style = self.styles.get(pending.pop())
+                if style is None:
+                    continue
+                for element in style.iter():
+                    if element.tag in (W + 'basedOn', W + 'next', W + 'link'):
+                        value = element.get(W + 'val')
+                        if value not in style_ids:
+                            style_ids.add(value)
+                            pending.append(value)
+                    elif element.tag == W + 'numId':
+                        value = element.get(W + 'val')
+                        if value not in num_ids:
+                            num_ids.add(value)
+                            pending_nums.append(value)
+            while pending_nums:
+                abstract = abstract_nums.get(nums.get(pending_nums.pop()))
+                if abstract is None:
+                    continue
+                for element in abstract.iter(W + 'pStyle', W + 'styleLink',
+                                             W + 'numStyleLink'):
+                    value = element.get(W + 'val')
+                    if value not in style_ids:
+                        style_ids.add(value)
+                        pending.append(value)
+        return style_ids, num_ids
@@ -127,8 +127,10 @@ def setup_comments(document):
         next_id = '0'
         document.xmlfiles[document.comments] = os.path.join('word', 'comments.xml')
     else:
-        next_id = str(len([element for element in document.comments if
-        element.tag == '{' + NSPREFIXES['w'] + '}Comment']))
+        id_numbers = [int(element.get('{' + NSPREFIXES['w'] + '}id'))
+        for element in document.comments.iterchildren(
+        '{' + NSPREFIXES['w'] + '}comment')]
+        next_id = str(max(id_numbers) + 1 if id_numbers else 0)
     add_content_override(document,  '/word/comments.xml',
                             'application/vnd.openxmlformats-officedocument'
                             '.wordprocessingml.comments+xml')
@@ -136,6 +138,22 @@ def setup_comments(document):
     'openxmlformats.org/officeDocument/2006/relationships/comments')
     return next_id
     
+def setup_numbering(document):
+    '''Creates the numbering part if the document does not have one,
+    returns the numbering element'''
+    if document.numbering is None:
+        document.numbering = etree.fromstring(
+        '<w:numbering xmlns:w="http://schemas.openxmlformats.org/'
+        'wordprocessingml/2006/main"></w:numbering>')
+        document.xmlfiles[document.numbering] = os.path.join('word',
+                                                             'numbering.xml')
+        add_content_override(document, '/word/numbering.xml',
+                             'application/vnd.openxmlformats-officedocument'
+                             '.wordprocessingml.numbering+xml')
+        helper_functions.add_relationship(document, 'numbering.xml', 'http://'
+        'schemas.openxmlformats.org/officeDocument/2006/relationships/numbering')
+    return document.numbering
+    
 def add_content_override(document, part_name, content_type): 
     '''checks Types element to see if comments element is included,
     adds it if not'''
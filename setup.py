@@ -4,7 +4,7 @@ from setuptools import setup, find_packages
 setup(
 	name = "oodocx",
 	version = "0.1.0",
-	packages = find_packages(),
+	packages = find_packages(exclude=["benchmarks"]),
 	include_package_data = True,
 	# package_data = {
 		# 'oodocx/template': ['*.xml'],
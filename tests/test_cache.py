@@ -0,0 +1,31 @@
+import concurrent.futures
+import io
+import os
+from oodocx import oodocx
+from oodocx.cache import DocumentCache
+
+
+def docx_bytes(text):
+    document = oodocx.Docx()
+    document.body[-1].addprevious(oodocx.paragraph(text))
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+def test_concurrent_opens_survive_eviction():
+    sources = [docx_bytes('document {0}'.format(number))
+               for number in range(3)]
+    cache = DocumentCache(maxsize=1)
+
+    def open_text(number):
+        document = cache.open(sources[number % len(sources)])
+        return oodocx.get_text(document.body)
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        texts = list(executor.map(open_text, range(300)))
+    assert texts == ['document {0}'.format(number % len(sources))
+                     for number in range(300)]
+    assert cache.stats()['hits']
+    snapshot = next(iter(cache.snapshots.values()))
+    cache.clear()
+    assert not os.path.exists(snapshot.files_dir)
@@ -0,0 +1,18 @@
+import pytest
+from oodocx.__main__ import parse_args
+
+
+@pytest.mark.parametrize('argv', [
+    ['--workers', '4', '-o', 'out.jsonl', 'stats', 'a.docx'],
+    ['stats', 'a.docx', '--workers', '4', '-o', 'out.jsonl'],
+])
+def test_common_options_before_or_after_command(argv):
+    args = parse_args(argv)
+    assert args.workers == 4
+    assert args.output == 'out.jsonl'
+    assert args.chunksize == 1
+    assert args.paths == ['a.docx']
+
+def test_common_option_defaults():
+    args = parse_args(['text', 'reports'])
+    assert (args.workers, args.chunksize, args.output) == (None, 1, '-')
@@ -0,0 +1,64 @@
+from oodocx import oodocx
+
+W = '{' + oodocx.NSPREFIXES['w'] + '}'
+
+
+def make_document():
+    document = oodocx.Docx()
+    normal = document.get_style_registry().style_elements['Normal']
+    ppr = normal.find(W + 'pPr')
+    if ppr is None:
+        ppr = oodocx.makeelement('pPr')
+        normal.append(ppr)
+    ppr.append(oodocx.makeelement('spacing', attributes={'after': '240'}))
+    rpr = normal.find(W + 'rPr')
+    if rpr is None:
+        rpr = oodocx.makeelement('rPr')
+        normal.append(rpr)
+    rpr.append(oodocx.makeelement('sz', attributes={'val': '28'}))
+    document.style_registry = None
+    sectpr = document.body[-1]
+    for number in range(3):
+        sectpr.addprevious(oodocx.paragraph(['plain ', ('italic', 'i')],
+                           pprops={'jc': {'val': 'center'}}))
+    return document
+
+def effective_properties(document):
+    document.style_registry = None
+    properties = []
+    for paragraph in document.body.iter(W + 'p'):
+        paragraph_props = dict(document.effective_paragraph_props(paragraph))
+        paragraph_props.pop('pStyle', None)
+        properties.append(paragraph_props)
+        for run in paragraph.iter(W + 'r'):
+            run_props = dict(document.effective_run_props(run))
+            run_props.pop('rStyle', None)
+            properties.append(run_props)
+    return properties
+
+
+def test_default_style_properties_survive_compacting():
+    document = make_document()
+    before = effective_properties(document)
+    assert before[0]['spacing']['after'] == '240'
+    assert before[1]['sz']['val'] == '28'
+    new_style_ids = document.compact_formatting()
+    assert new_style_ids
+    after = effective_properties(document)
+    assert after == before
+
+def test_generated_paragraph_style_is_based_on_default_style():
+    document = make_document()
+    document.compact_formatting()
+    style = document.get_style_registry().style_elements['CompactParagraph1']
+    assert style.find(W + 'basedOn').get(W + 'val') == 'Normal'
+
+def test_text_box_runs_are_counted_once():
+    document = oodocx.Docx()
+    paragraph = oodocx.paragraph('caption')
+    anchor = oodocx.etree.SubElement(paragraph, W + 'r')
+    content = oodocx.etree.SubElement(oodocx.etree.SubElement(anchor,
+                                      W + 'pict'), W + 'txbxContent')
+    content.append(oodocx.paragraph([('boxed', 'i')]))
+    document.body.insert(0, paragraph)
+    assert document.compact_formatting(min_count=2) == []
@@ -0,0 +1,126 @@
+from lxml import etree
+from oodocx import oodocx, diff
+
+W = '{' + oodocx.NSPREFIXES['w'] + '}'
+
+
+def document(*blocks):
+    document = oodocx.Docx()
+    sectpr = document.body[-1]
+    for block in blocks:
+        sectpr.addprevious(block)
+    return document
+
+def run(text):
+    run = oodocx.makeelement('r')
+    run.append(oodocx.makeelement('t', tagtext=text))
+    return run
+
+def paragraph(*children):
+    paragraph = oodocx.makeelement('p')
+    paragraph.extend(children)
+    return paragraph
+
+def hyperlink(text):
+    link = oodocx.makeelement('hyperlink', attributes={'anchor': 'target'})
+    link.append(run(text))
+    return link
+
+def text_order(paragraph):
+    '''Returns the text of a paragraph's w:t elements and the names of
+    its comment range markers, in document order'''
+    return [element.text if element.tag == W + 't' else
+            etree.QName(element).localname for element in paragraph.iter(
+            W + 't', W + 'commentRangeStart', W + 'commentRangeEnd')]
+
+def paragraph_text(paragraph):
+    return ''.join(element.text for element in paragraph.iter(W + 't',
+                                                              W + 'delText'))
+
+
+def test_compare_reports_word_changes():
+    old = document(oodocx.paragraph('The party shall pay'),
+                   oodocx.paragraph('unchanged'))
+    new = document(oodocx.paragraph('The customer shall pay'),
+                   oodocx.paragraph('unchanged'))
+    assert diff.compare(old, new) == [diff.Change('change', 0, 0,
+    'The party shall pay', 'The customer shall pay',
+    [('replace', 'party', 'customer')])]
+
+def test_redline_inserted_paragraph_keeps_hyperlink_in_place():
+    old = document(oodocx.paragraph('first'))
+    new = document(oodocx.paragraph('first'),
+                   paragraph(run('A '), hyperlink('B'), run(' C')))
+    diff.redline(old, new)
+    inserted = list(new.body.iter(W + 'p'))[1]
+    assert text_order(inserted) == ['A ', 'B', ' C']
+    for t in inserted.iter(W + 't'):
+        assert next(t.iterancestors(W + 'ins'), None) is not None
+    link_run = inserted.find(W + 'hyperlink/' + W + 'ins/' + W + 'r')
+    assert link_run is not None
+
+def test_redline_inserted_paragraph_keeps_comment_range_in_place():
+    old = document(oodocx.paragraph('first'))
+    reference = run('')
+    reference.remove(reference[0])
+    reference.append(oodocx.makeelement('commentReference',
+                                        attributes={'id': '0'}))
+    new = document(oodocx.paragraph('first'), paragraph(run('before '),
+    oodocx.makeelement('commentRangeStart', attributes={'id': '0'}),
+    run('noted'), oodocx.makeelement('commentRangeEnd',
+    attributes={'id': '0'}), reference, run(' after')))
+    diff.redline(old, new)
+    inserted = list(new.body.iter(W + 'p'))[1]
+    assert text_order(inserted) == ['before ', 'commentRangeStart', 'noted',
+                                    'commentRangeEnd', ' after']
+    children = list(inserted)
+    reference = next(inserted.iter(W + 'commentReference'))
+    wrapper = reference.getparent().getparent()
+    assert wrapper.tag == W + 'ins'
+    assert (children.index(inserted.find(W + 'commentRangeEnd')) <
+            children.index(wrapper))
+
+def test_redline_deletion_after_table_stays_in_body():
+    old = document(oodocx.paragraph('first'),
+                   oodocx.table([['a', 'b'], ['c', 'd']]),
+                   oodocx.paragraph('removed'))
+    new = document(oodocx.paragraph('first'),
+                   oodocx.table([['a', 'b'], ['c', 'd']]))
+    diff.redline(old, new)
+    deleted = [element for element in new.body.iter(W + 'p')
+               if paragraph_text(element) == 'removed']
+    assert len(deleted) == 1
+    assert deleted[0].getparent() is new.body
+    assert deleted[0].getprevious().tag == W + 'tbl'
+    for cell in new.body.iter(W + 'tc'):
+        assert len(cell.findall(W + 'p')) == 1
+
+def test_redline_deletion_in_table_cell_stays_in_cell():
+    old_table = oodocx.table([['a', 'b'], ['c', 'd']])
+    old_table.find(W + 'tr/' + W + 'tc').append(oodocx.paragraph('gone'))
+    old = document(old_table, oodocx.paragraph('last'))
+    new = document(oodocx.table([['a', 'b'], ['c', 'd']]),
+                   oodocx.paragraph('last'))
+    diff.redline(old, new)
+    first_cell = new.body.find(W + 'tbl/' + W + 'tr/' + W + 'tc')
+    assert [paragraph_text(element) for element in
+            first_cell.findall(W + 'p')] == ['a', 'gone']
+    assert first_cell.find(W + 'p/' + W + 'del') is not None
+
+def test_redline_deleted_table_is_replaced_by_deleted_paragraphs():
+    old = document(oodocx.paragraph('first'), oodocx.table([['a', 'b']]),
+                   oodocx.paragraph('last'))
+    new = document(oodocx.paragraph('first'), oodocx.paragraph('last'))
+    diff.redline(old, new)
+    assert [paragraph_text(element) for element in new.body
+            if element.tag == W + 'p'] == ['first', 'a', 'b', 'last']
+
+def test_compare_matches_frequent_words_in_long_paragraphs():
+    # 601 words, so difflib's autojunk would treat 'the' as junk
+    words = ['the'] * 300 + ['x'] + ['the'] * 300
+    old = document(oodocx.paragraph(' '.join(words)))
+    new = document(oodocx.paragraph(' '.join(word for word in words
+                                             if word != 'x')))
+    changes = diff.compare(old, new)
+    assert [change.kind for change in changes] == ['change']
+    assert changes[0].edits == [('delete', 'x ', '')]
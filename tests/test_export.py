@@ -0,0 +1,61 @@
+from oodocx import oodocx
+from oodocx import export
+
+W = '{' + oodocx.NSPREFIXES['w'] + '}'
+R = '{' + oodocx.NSPREFIXES['r'] + '}'
+
+
+def hyperlink(document, target, text):
+    '''Returns a w:hyperlink holding one run of text, linked to target
+    through a new relationship'''
+    rid = 'rIdTest' + str(len(document.relationships))
+    relationship = document.relationships.makeelement(
+        '{' + oodocx.NSPREFIXES['pr'] + '}Relationship', {'Id': rid, 'Target': target, 'TargetMode': 'External', 'Type':
+         oodocx.NSPREFIXES['r'] + '/hyperlink'})
+    document.relationships.append(relationship)
+    link = oodocx.makeelement('hyperlink')
+    link.set(R + 'id', rid)
+    link.append(oodocx.paragraph(text).find(W + 'r'))
+    return link
+
+def make_document():
+    document = oodocx.Docx()
+    sectpr = document.body[-1]
+    first = oodocx.paragraph(['plain ', ('bold', 'b'), ' ', ('italic', 'i'),
+                              ' '])
+    first.append(hyperlink(document, 'https://example.com/?a=1&b=2', 'site'))
+    first.append(oodocx.paragraph(' ').find(W + 'r'))
+    first.append(hyperlink(document, 'javascript:alert(1)', 'script'))
+    sectpr.addprevious(first)
+    items = [oodocx.paragraph(text) for text in ('one', 'two', 'three')]
+    oodocx.apply_numbering(items, '1', [0, 1, 0])
+    for item in items:
+        sectpr.addprevious(item)
+    sectpr.addprevious(oodocx.table([['a', 'b'], ['c', 'd']]))
+    return document
+
+def test_html_export():
+    html = export.to_html(make_document())
+    assert ('<p>plain <strong>bold</strong> <em>italic</em> '
+            '<a href="https://example.com/?a=1&amp;b=2">site</a> script</p>'
+            in html)
+    assert 'javascript' not in html
+    assert ('<ol>\n<li>one<ol>\n<li>two</li>\n</ol>\n</li>\n'
+            '<li>three</li>\n</ol>\n' in html)
+    assert '<td>a</td><td>b</td>' in html
+    assert '<td>c</td><td>d</td>' in html
+
+def test_markdown_export():
+    markdown = export.to_markdown(make_document())
+    assert ('plain **bold** *italic* [site](https://example.com/?a=1&b=2) '
+            'script\n' in markdown)
+    assert 'javascript' not in markdown
+    assert '1. one\n    1. two\n' in markdown
+    assert '1. three\n' in markdown
+    assert '| a | b |\n| --- | --- |\n| c | d |\n' in markdown
+
+def test_text_export():
+    text = export.to_text(make_document())
+    assert text.startswith('plain bold italic site script\n')
+    assert 'one\n    two\nthree\n' in text
+    assert 'a\tb\nc\td\n' in text
@@ -0,0 +1,32 @@
+from oodocx import oodocx
+
+W = '{' + oodocx.NSPREFIXES['w'] + '}'
+V = '{' + oodocx.NSPREFIXES['v'] + '}'
+
+
+def paragraph_with_text_box(text, box_text):
+    '''Returns a paragraph of text whose first run anchors a text box
+    holding a paragraph of box_text'''
+    paragraph = oodocx.paragraph(text)
+    anchor = paragraph.makeelement(W + 'r')
+    pict = oodocx.etree.SubElement(anchor, W + 'pict')
+    textbox = oodocx.etree.SubElement(oodocx.etree.SubElement(pict,
+                                      V + 'shape'), V + 'textbox')
+    content = oodocx.etree.SubElement(textbox, W + 'txbxContent')
+    content.append(oodocx.paragraph(box_text))
+    paragraph.find(W + 'r').addprevious(anchor)
+    return paragraph
+
+def test_text_box_runs_are_formatted_once():
+    document = oodocx.Docx()
+    paragraph = paragraph_with_text_box('an apple', 'apple pie')
+    document.body.insert(0, paragraph)
+    assert document.format_matches('apple', bold=True) == 2
+    runs = list(paragraph.iter(W + 'r'))
+    bold = [oodocx.get_text(run) for run in runs
+            if run.find(W + 'rPr/' + W + 'b') is not None]
+    assert bold == ['apple', 'apple']
+    for run in runs:
+        assert len(run.findall(W + 'rPr/' + W + 'b')) <= 1
+    assert [oodocx.get_text(run) for run in oodocx.paragraph_runs(
+            paragraph)] == ['apple pie', 'an ', 'apple']
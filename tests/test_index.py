@@ -0,0 +1,16 @@
+import os
+from oodocx import oodocx
+from oodocx.index import DocumentIndex
+
+
+def test_update_counts_unreadable_paths_as_failed(tmp_path):
+    document = oodocx.Docx()
+    document.body[-1].addprevious(oodocx.paragraph('apple banana'))
+    document.save(str(tmp_path / 'fruit.docx'))
+    os.symlink(str(tmp_path / 'missing.docx'), str(tmp_path / 'gone.docx'))
+    index = DocumentIndex(str(tmp_path / 'corpus.db'))
+    counts = index.update([str(tmp_path)])
+    assert counts['indexed'] == 1
+    assert counts['failed'] == 1
+    assert [hit.path for hit in index.search('apple')] == [
+        os.path.abspath(str(tmp_path / 'fruit.docx'))]
@@ -0,0 +1,28 @@
+import pytest
+from oodocx import oodocx
+
+W = '{' + oodocx.NSPREFIXES['w'] + '}'
+
+
+def paragraphs(count):
+    return [oodocx.paragraph(str(number)) for number in range(count)]
+
+def test_apply_numbering_with_one_level_per_paragraph():
+    items = paragraphs(3)
+    oodocx.apply_numbering(items, '1', [0, 1, 0])
+    assert [item.find(W + 'pPr/' + W + 'numPr/' + W + 'ilvl').get(W + 'val')
+            for item in items] == ['0', '1', '0']
+
+def test_apply_numbering_rejects_level_count_mismatch():
+    items = paragraphs(3)
+    with pytest.raises(ValueError):
+        oodocx.apply_numbering(items, '1', [0, 1])
+    assert all(item.find(W + 'pPr/' + W + 'numPr') is None for item in items)
+
+def test_make_list_repeats_a_single_level():
+    document = oodocx.Docx()
+    for item in paragraphs(3):
+        document.body[-1].addprevious(item)
+    document.make_list(0, 3, level=2)
+    assert [item.get(W + 'val') for item in
+            document.body.iter(W + 'ilvl')] == ['2', '2', '2']
@@ -0,0 +1,30 @@
+import random
+from oodocx import oodocx
+
+
+def test_edits_keep_text_index_offsets():
+    paragraph = oodocx.paragraph('alpha ')
+    for text in ('beta ', 'gamma ', 'delta'):
+        paragraph.append(oodocx.paragraph(text)[0])
+    index = oodocx.TextIndex(paragraph)
+    text = oodocx.get_text(paragraph)
+    generator = random.Random(3)
+    for step in range(200):
+        start = generator.randint(0, len(text))
+        end = generator.randint(start, min(len(text), start + 6))
+        span = index.range(start, end)
+        if generator.random() < 0.5:
+            span.delete()
+            text = text[:start] + text[end:]
+        else:
+            inserted = 'x' * generator.randint(0, 3)
+            new = span.insert_text(inserted)
+            assert new.get_text() == inserted
+            text = text[:end] + inserted + text[end:]
+        assert oodocx.get_text(paragraph) == text
+        assert not index.stale
+        assert index.length == len(text)
+        for offset in range(len(text)):
+            run_list = index.runs(offset, offset + 1)
+            assert [oodocx.get_text(run) for run in run_list] == [
+                text[offset]]
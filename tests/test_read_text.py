@@ -0,0 +1,32 @@
+import io
+from oodocx import oodocx
+
+
+def saved_document(*paragraphs):
+    document = oodocx.Docx()
+    sectpr = document.body[-1]
+    for paragraph in paragraphs:
+        sectpr.addprevious(paragraph)
+    output = io.BytesIO()
+    document.save(output)
+    return output
+
+def test_read_only_text_matches_streamed_text():
+    paragraph = oodocx.paragraph('name')
+    run = paragraph.find('{' + oodocx.NSPREFIXES['w'] + '}r')
+    run.append(oodocx.makeelement('tab'))
+    run.append(oodocx.makeelement('t', tagtext='value'))
+    run.append(oodocx.makeelement('br'))
+    run.append(oodocx.makeelement('t', tagtext='next line'))
+    output = saved_document(paragraph, oodocx.paragraph('plain'))
+    streamed = list(oodocx.iter_document_text(output))
+    views = [block.text for block in oodocx.iter_blocks(output)]
+    assert streamed == ['name\tvalue\nnext line', 'plain']
+    assert views == streamed
+
+def test_streamed_text_reads_tables_in_order():
+    output = saved_document(oodocx.paragraph('before'),
+                            oodocx.table([['a', 'b'], ['c', 'd']]),
+                            oodocx.paragraph('after'))
+    assert list(oodocx.iter_document_text(output)) == ['before', 'a', 'b', 'c',
+                                                       'd', 'after']
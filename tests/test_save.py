@@ -0,0 +1,26 @@
+import io
+from oodocx import oodocx
+
+
+def saved(workers):
+    document = oodocx.Docx()
+    sectpr = document.body[-1]
+    for number in range(20):
+        sectpr.addprevious(oodocx.paragraph('Paragraph {0}'.format(number)))
+    output = io.BytesIO()
+    document.save(output, workers=workers, deterministic=True)
+    return output.getvalue()
+
+def test_parallel_save_writes_the_same_file():
+    assert saved(3) == saved(1)
+
+def test_docx_writer_copies_elements_from_another_tree():
+    source = oodocx.Docx()
+    source.body[-1].addprevious(oodocx.paragraph('kept'))
+    blocks = list(source.body)
+    output = io.BytesIO()
+    with oodocx.DocxWriter(output, section_properties=blocks[-1]) as writer:
+        writer.extend(blocks[:-1])
+        writer.write(oodocx.paragraph('new'))
+    assert list(source.body) == blocks
+    assert list(oodocx.iter_document_text(output))[-2:] == ['kept', 'new']
@@ -0,0 +1,102 @@
+import io
+import os
+from oodocx import oodocx, split
+
+W = '{' + oodocx.NSPREFIXES['w'] + '}'
+
+
+def heading(text):
+    return oodocx.paragraph(text, pprops={'pStyle': {'val': 'Heading1'}})
+
+def comment(document, start, end, text):
+    '''Adds a comment on the paragraphs from start to end'''
+    id_number = oodocx.write_files.setup_comments(document)
+    oodocx.mark_comment(start, end, id_number)
+    document.comments.append(oodocx.make_comment(id_number, text))
+    return id_number
+
+def block_texts(document):
+    return [oodocx.get_text(block) for block in document.body
+            if block.tag == W + 'p']
+
+def make_book(tmp_path):
+    '''Returns a document of three chapters: the first with a comment, the
+    second with a picture and a list, the third plain'''
+    document = oodocx.Docx()
+    sectpr = document.body[-1]
+    image = tmp_path / 'image.png'
+    image.write_bytes(b'\x89PNG\r\n\x1a\n')
+    blocks = [heading('One'), oodocx.paragraph('alpha'), heading('Two'),
+              oodocx.picture(document, str(image), pixelwidth=4,
+                             pixelheight=4),
+              oodocx.paragraph('beta'), heading('Three'),
+              oodocx.paragraph('gamma')]
+    for block in blocks:
+        sectpr.addprevious(block)
+    comment(document, blocks[1], blocks[1], 'on alpha')
+    document.make_list(blocks[4], blocks[4])
+    return document
+
+def test_split_at_headings_keeps_only_what_each_piece_uses(tmp_path):
+    pieces = make_book(tmp_path).split(split.heading_start('Heading1'))
+    assert [block_texts(piece) for piece in pieces] == [
+        ['One', 'alpha'], ['Two', '', 'beta'], ['Three', 'gamma']]
+    media = [os.listdir(piece.media_dir) if os.path.isdir(piece.media_dir)
+             else [] for piece in pieces]
+    assert media == [[], ['image.png'], []]
+    assert [len(piece.comments.findall(W + 'comment')) for piece in
+            pieces] == [1, 0, 0]
+    assert [len(piece.numbering.findall(W + 'num')) for piece in
+            pieces] == [0, 1, 0]
+    for piece in pieces:
+        assert piece.body[-1].tag == W + 'sectPr'
+        output = io.BytesIO()
+        piece.save(output)
+        reopened = oodocx.Docx(output)
+        assert block_texts(reopened) == block_texts(piece)
+
+def test_split_at_section_breaks_carries_each_section_properties():
+    document = oodocx.Docx()
+    sectpr = document.body[-1]
+    landscape = oodocx.paragraph('landscape')
+    break_sectpr = oodocx.makeelement('sectPr')
+    break_sectpr.append(oodocx.makeelement('pgSz', attributes={
+                        'w': '15840', 'h': '12240', 'orient': 'landscape'}))
+    ppr = oodocx.makeelement('pPr')
+    ppr.append(break_sectpr)
+    landscape.insert(0, ppr)
+    for block in (oodocx.paragraph('first'), landscape,
+                  oodocx.paragraph('portrait')):
+        sectpr.addprevious(block)
+    pieces = document.split(split.section_start)
+    assert [block_texts(piece) for piece in pieces] == [
+        ['first', 'landscape'], ['portrait']]
+    first, second = pieces
+    assert first.body[-1].find(W + 'pgSz').get(W + 'orient') == 'landscape'
+    assert first.body.find('.//' + W + 'pPr/' + W + 'sectPr') is None
+    assert (oodocx.etree.tostring(second.body[-1]) ==
+            oodocx.etree.tostring(sectpr))
+
+def test_split_closes_ranges_cut_between_pieces():
+    document = oodocx.Docx()
+    sectpr = document.body[-1]
+    blocks = [heading('One'), oodocx.paragraph('alpha'), heading('Two'),
+              oodocx.paragraph('beta')]
+    for block in blocks:
+        sectpr.addprevious(block)
+    id_number = comment(document, blocks[1], blocks[3], 'alpha to beta')
+    blocks[1].append(oodocx.makeelement('bookmarkStart', attributes={
+                     'id': '7', 'name': 'across'}))
+    blocks[3].append(oodocx.makeelement('bookmarkEnd',
+                                        attributes={'id': '7'}))
+    pieces = document.split(split.heading_start('Heading1'))
+    for piece in pieces:
+        for tag in ('commentRangeStart', 'commentRangeEnd',
+                    'commentReference'):
+            assert [element.get(W + 'id') for element in
+                    piece.body.iter(W + tag)] == [id_number]
+        assert len(piece.comments.findall(W + 'comment')) == 1
+    assert len(list(pieces[0].body.iter(W + 'bookmarkStart'))) == 1
+    assert len(list(pieces[0].body.iter(W + 'bookmarkEnd'))) == 1
+    assert not list(pieces[1].body.iter(W + 'bookmarkStart',
+                                        W + 'bookmarkEnd'))
@@ -0,0 +1,34 @@
+import pytest
+from oodocx import oodocx
+
+W = '{' + oodocx.NSPREFIXES['w'] + '}'
+
+
+def merged_table():
+    '''A 3 by 2 table whose first cell spans both columns'''
+    table = oodocx.table([['a', 'b'], ['c', 'd'], ['e', 'f']])
+    first_row = table.find(W + 'tr')
+    cells = first_row.findall(W + 'tc')
+    first_row.remove(cells[1])
+    tcpr = cells[0].find(W + 'tcPr')
+    if tcpr is None:
+        tcpr = oodocx.makeelement('tcPr')
+        cells[0].insert(0, tcpr)
+    tcpr.append(oodocx.makeelement('gridSpan', attributes={'val': '2'}))
+    return table
+
+def test_iter_table_rows_expands_spans():
+    assert list(oodocx.iter_table_rows(merged_table())) == [['a', 'a'],
+                                                           ['c', 'd'],
+                                                           ['e', 'f']]
+
+def test_table_to_array():
+    numpy = pytest.importorskip('numpy')
+    array = oodocx.table_to_array(merged_table())
+    assert array.shape == (3, 2)
+    assert array.dtype == object
+    assert array.tolist() == [['a', 'a'], ['c', 'd'], ['e', 'f']]
+    array = oodocx.table_to_array(merged_table(), fill_merged=False,
+                                  dtype=str)
+    assert array.dtype.kind == 'U'
+    assert numpy.array_equal(array[0], ['a', ''])